@@ -8,7 +8,8 @@ def group_stability_matrix(indiv_stability_list, n_bootstraps, k_clusters, strat
     Parameters
     ----------
     indiv_stability_list : list of strings
-        A length `N` list of file paths to numpy matrices of shape (`V`, `V`), `N` subjects, `V` voxels
+        A length `N` list of file paths to numpy matrices of shape (`V`, `V`), `N` subjects, `V` voxels.
+        The matrices are memory-mapped rather than loaded together.
     n_bootstraps : integer
         Number of bootstrap datasets
     k_clusters : integer
@@ -34,22 +35,28 @@ def group_stability_matrix(indiv_stability_list, n_bootstraps, k_clusters, strat
     from CPAC.basc import standard_bootstrap, adjacency_matrix, cluster_timeseries, cluster_matrix_average
     import numpy as np
 
-    indiv_stability_set = np.asarray([np.load(ism_file) for ism_file in indiv_stability_list])
-#    indiv_stability_set = indiv_stability_list
-    print 'Individual stability list dimensions:', indiv_stability_set.shape
+    from CPAC.utils import load_group_store
+
+    # Memory-map the matrices, only the bootstrapped ones are read and summed
+    indiv_stability_set = load_group_store(indiv_stability_list)
+    nSubjects = len(indiv_stability_set)
+    print 'Individual stability list dimensions:', (nSubjects,) + indiv_stability_set[0].shape
     
-    V = indiv_stability_set.shape[2]
+    V = indiv_stability_set[0].shape[1]
+    subjects = np.arange(nSubjects)
     
     G = np.zeros((V,V))
     for bootstrap_i in range(n_bootstraps):
         if stratification is not None:
             strata = np.unique(stratification)
-            J = np.zeros((V,V))
-            for stratum in strata:
-                J += standard_bootstrap(indiv_stability_set[np.where(stratification == stratum)]).sum(0)
-            J /= indiv_stability_set.shape[0]
+            bootstrap = np.concatenate([standard_bootstrap(subjects[np.where(stratification == stratum)])
+                                        for stratum in strata])
         else:
-            J = standard_bootstrap(indiv_stability_set).mean(0)
+            bootstrap = standard_bootstrap(subjects)
+        J = np.zeros((V,V))
+        for i in bootstrap:
+            J += indiv_stability_set[i]
+        J /= nSubjects
         G += adjacency_matrix(cluster_timeseries(J, k_clusters, similarity_metric = 'data')[:,np.newaxis])
     G /= n_bootstraps
 
@@ -84,11 +91,12 @@ def individual_group_clustered_maps(indiv_stability_list, clusters_G, roi_mask_f
     import os
     import numpy as np
     from CPAC.basc import cluster_matrix_average, ndarray_to_vol
+    from CPAC.utils import load_group_store
     
-    indiv_stability_set = np.asarray([np.load(ism_file) for ism_file in indiv_stability_list])
+    indiv_stability_set = load_group_store(indiv_stability_list)
 
-    nSubjects = indiv_stability_set.shape[0]
-    nVoxels = indiv_stability_set.shape[1]
+    nSubjects = len(indiv_stability_set)
+    nVoxels = indiv_stability_set[0].shape[0]
 
     cluster_ids = np.unique(clusters_G)
     nClusters = cluster_ids.shape[0]
@@ -151,7 +159,8 @@ def nifti_individual_stability(subject_file, roi_mask_file, n_bootstraps, k_clus
     
     ism = individual_stability_matrix(Y, n_bootstraps, k_clusters, cbb_block_size=cbb_block_size, affinity_threshold=affinity_threshold)
     ism_file = os.path.join(os.getcwd(), 'individual_stability_matrix.npy')
-    np.save(ism_file, ism)
+    # Stored as float32 so the group nodes can memory-map it
+    np.save(ism_file, ism.astype('float32'))
     
     print 'Saving individual stability matrix %s for %s' % (ism_file, subject_file)
     
@@ -1,5 +1,6 @@
 import nipype.pipeline.engine as pe
 import nipype.interfaces.utility as util
+from CPAC.utils.group_store import create_group_store
 
 def joint_mask(subjects_file_list, mask_file):
     """
@@ -45,27 +46,31 @@ def joint_mask(subjects_file_list, mask_file):
     return img_file
 
 def nifti_cwas(subjects_file_list, mask_file, regressor, cols, f_samples, 
-               voxel_range, strata=None):
+               voxel_range, strata=None, memory_limit=None):
     """
     Performs CWAS for a group of subjects
     
     Parameters
     ----------
     subjects_file_list : list of strings
-        A length `N` list of file paths of the nifti files of subjects
+        A length `N` list of file paths of the nifti files of subjects, or of
+        the normalized .npy files of a group store (see `create_group_store`)
     mask_file : string
         Path to a mask file in nifti format
     regressor : ndarray
         Vector of shape (`S`) or (`S`, `1`), `S` subjects
     cols : list
         todo
-    f_samples : integer
-        Number of pseudo f values to sample using a random permutation test
+    f_samples : integer or ndarray
+        Number of pseudo f values to sample using a random permutation test,
+        or the permutations to use (see `cwas_permutations`)
     voxel_range : tuple
         (start, end) tuple specify the range of voxels (inside the mask) to perform cwas on.
         Index ordering is based on the np.where(mask) command
     strata : ndarray (optional)
         todo
+    memory_limit : float (optional)
+        Memory (in GB) used for each block of subject distances
     
     Returns
     -------
@@ -82,6 +87,7 @@ def nifti_cwas(subjects_file_list, mask_file, regressor, cols, f_samples,
     import numpy as np
     import os
     from CPAC.cwas import calc_cwas
+    from CPAC.utils import load_group_store
     
     #Check regressor is a column vector
     if(len(regressor.shape) == 1):
@@ -92,18 +98,23 @@ def nifti_cwas(subjects_file_list, mask_file, regressor, cols, f_samples,
     if(len(subjects_file_list) != regressor.shape[0]):
         raise ValueError('Number of subjects does not match regressor size')
     
-    #Load the data to produce the joint mask
-    mask = nb.load(mask_file).get_data().astype('bool')
-    mask_indices = np.where(mask)
-    #batch_indices = tuple([mask_index[voxel_range[0]:voxel_range[1]] for mask_index in mask_indices])
-    
-    #Reload the data again to actually get the values, sacrificing CPU for smaller memory footprint
-    subjects_data = [ nb.load(subject_file).get_data().astype('float64')[mask_indices].T 
-                        for subject_file in subjects_file_list ]
-    #subjects_data = np.array(subjects_data)
+    if all(f.endswith('.npy') for f in subjects_file_list):
+        #Memory-map the prepared (already masked and normalized) group store
+        subjects_data = load_group_store(subjects_file_list)
+        normed = True
+    else:
+        #Load the data to produce the joint mask
+        mask = nb.load(mask_file).get_data().astype('bool')
+        mask_indices = np.where(mask)
+        
+        #Reload the data again to actually get the values, sacrificing CPU for smaller memory footprint
+        subjects_data = [ nb.load(subject_file).get_data().astype('float64')[mask_indices].T 
+                            for subject_file in subjects_file_list ]
+        normed = False
     print '... subject data loaded', len(subjects_data), 'batch voxel range', voxel_range
     
-    F_set, p_set = calc_cwas(subjects_data, regressor, cols, f_samples, voxel_range, strata)
+    F_set, p_set = calc_cwas(subjects_data, regressor, cols, f_samples, voxel_range, strata,
+                             memory_limit, normed)
     
     print '... writing cwas data to disk'
     cwd = os.getcwd()
@@ -172,7 +183,30 @@ def create_cwas_batches(mask_file, batches):
     return batch_list
 
 
-def create_cwas(name='cwas'):
+def cwas_permutations(subjects_file_list, f_samples, strata=None):
+    """
+    Draws one set of permutations to be shared by all CWAS batches
+    
+    Parameters
+    ----------
+    subjects_file_list : list of strings
+        A length `N` list of file paths of the nifti files of subjects
+    f_samples : integer
+        Number of pseudo f values to sample using a random permutation test
+    strata : ndarray (optional)
+        todo
+    
+    Returns
+    -------
+    perms : ndarray
+        Permuted indices of shape (`f_samples`, `N`)
+    
+    """
+    from CPAC.cwas.mdmr import gen_perms
+    
+    return gen_perms(f_samples, len(subjects_file_list), strata)
+
+def create_cwas(name='cwas', shared_perms=False):
     """
     Connectome Wide Association Studies
     
@@ -182,6 +216,9 @@ def create_cwas(name='cwas'):
     ----------
     name : string, optional
         Name of the workflow.
+    shared_perms : boolean, optional
+        Draw the permutations once and use the same set in every batch,
+        instead of drawing them anew in each batch.
         
     Returns
     -------
@@ -207,6 +244,8 @@ def create_cwas(name='cwas'):
             todo
         inputspec.parallel_nodes : integer
             Number of nodes to create and potentially parallelize over
+        inputspec.memory_limit : float (optional)
+            Memory (in GB) each node uses for a block of subject distances
         
     Workflow Outputs::
 
@@ -217,6 +256,7 @@ def create_cwas(name='cwas'):
             
     CWAS Procedure:
     
+    0. Write the masked and normalized data of every subject to a group store
     1. Calculate spatial correlation of a voxel
     2. Correlate spatial z-score maps for every subject pair
     3. Convert matrix to distance matrix, `1-r`
@@ -245,7 +285,8 @@ def create_cwas(name='cwas'):
                                                        'cols', 
                                                        'f_samples', 
                                                        'strata', 
-                                                       'parallel_nodes']),
+                                                       'parallel_nodes',
+                                                       'memory_limit']),
                         name='inputspec')
     outputspec = pe.Node(util.IdentityInterface(fields=['F_map',
                                                         'p_map']),
@@ -266,7 +307,8 @@ def create_cwas(name='cwas'):
                                                   'f_samples',
 #                                                  'compiled_func',
                                                   'voxel_range', 
-                                                  'strata'],
+                                                  'strata',
+                                                  'memory_limit'],
                                      output_names=['result_batch'],
                                      function=nifti_cwas),
                        name='cwas_batch',
@@ -285,6 +327,14 @@ def create_cwas(name='cwas'):
                                   function=joint_mask),
                     name='joint_mask')
     
+    gstore = pe.Node(util.Function(input_names=['subjects_file_list',
+                                                'mask_file',
+                                                'normalize'],
+                                   output_names=['store_files'],
+                                   function=create_group_store),
+                     name='group_store')
+    gstore.inputs.normalize = True
+    
     #Compute the joint mask
     cwas.connect(inputspec, 'subjects',
                  jmask, 'subjects_file_list')
@@ -297,15 +347,37 @@ def create_cwas(name='cwas'):
     cwas.connect(inputspec, 'parallel_nodes',
                  ccb, 'batches')
     
+    #Write the masked group data once, to be memory-mapped by every batch
+    cwas.connect(inputspec, 'subjects',
+                 gstore, 'subjects_file_list')
+    cwas.connect(jmask, 'joint_mask',
+                 gstore, 'mask_file')
+    
     #Compute CWAS over batches of voxels
     cwas.connect(jmask, 'joint_mask',
                  ncwas, 'mask_file')
-    cwas.connect(inputspec, 'subjects',
+    cwas.connect(gstore, 'store_files',
                  ncwas, 'subjects_file_list')
     cwas.connect(inputspec, 'regressor',
                  ncwas, 'regressor')
-    cwas.connect(inputspec, 'f_samples',
-                 ncwas, 'f_samples')
+    if shared_perms:
+        cperms = pe.Node(util.Function(input_names=['subjects_file_list',
+                                                    'f_samples',
+                                                    'strata'],
+                                       output_names=['perms'],
+                                       function=cwas_permutations),
+                         name='cwas_perms')
+        cwas.connect(inputspec, 'subjects',
+                     cperms, 'subjects_file_list')
+        cwas.connect(inputspec, 'f_samples',
+                     cperms, 'f_samples')
+        cwas.connect(inputspec, 'strata',
+                     cperms, 'strata')
+        cwas.connect(cperms, 'perms',
+                     ncwas, 'f_samples')
+    else:
+        cwas.connect(inputspec, 'f_samples',
+                     ncwas, 'f_samples')
     cwas.connect(inputspec, 'cols',
                  ncwas, 'cols')
 #    cwas.connect(ctf, 'compiled_dot_norm',
@@ -314,6 +386,8 @@ def create_cwas(name='cwas'):
                  ncwas, 'voxel_range')
     cwas.connect(inputspec, 'strata',
                  ncwas, 'strata')
+    cwas.connect(inputspec, 'memory_limit',
+                 ncwas, 'memory_limit')
     
     #Merge the computed CWAS data
     cwas.connect(ncwas, 'result_batch',
@@ -36,15 +36,17 @@ def gower_center(yDis):
     return G
 
 def gower_center_many(dmats):
-    nobs    = np.sqrt(dmats.shape[0])
+    """
+    Gower centers every column of `dmats` (a flattened distance matrix) at once
+    """
+    nobs    = int(np.sqrt(dmats.shape[0]))
     ntests  = dmats.shape[1]
-    Gs      = np.zeros_like(dmats)
     
-    for i in range(ntests):
-        Dmat    = dmats[:,i].reshape(nobs,nobs)
-        Gs[:,i] = gower_center(Dmat).flatten()
+    A  = -0.5*(dmats.reshape(nobs, nobs, ntests)**2)
+    Gs = A - A.mean(1)[:,np.newaxis,:] - A.mean(0)[np.newaxis,:,:] \
+           + A.mean(0).mean(0)[np.newaxis,np.newaxis,:]
     
-    return Gs
+    return Gs.reshape(nobs**2, ntests)
 
 def gen_h2_perms(x, cols, perms):
     nperms  = perms.shape[0]
@@ -98,13 +100,52 @@ def mdmr_single(yDis, *args, **kwrds):
     return mdmr(ys, *args, **kwrds)
 
 def fperms_to_pvals(fstats, F_perms):
-    nperms,ntests = F_perms.shape
-    pvals = np.zeros(ntests)
-    for i in range(ntests):
-        j        = (F_perms[:,i] >= fstats[i]).sum().astype('float')
-        pvals[i] = j/nperms
+    nperms = F_perms.shape[0]
+    pvals  = (F_perms >= fstats).sum(0).astype('float')/nperms
     return pvals
 
+def mdmr_hats(x, cols, perms, strata=None):
+    """
+    Permuted hat matrices used by MDMR
+    
+    These only depend on the design and the permutations, so they can be
+    computed once and applied to any number of distance matrices.
+    
+    Parameters
+    ----------
+    x : ndarray
+    cols : list
+    perms : integer or ndarray
+    strata : list or ndarray
+    
+    Returns
+    --------
+    perms : ndarray
+        Permutations with the original index as the first row
+    H2perms : ndarray
+    IHperms : ndarray
+    df_among : integer
+    df_resid : integer
+    """
+    check_rank(x)
+    
+    nobs    = x.shape[0]
+    
+    # Degrees of freedom
+    df_among = len(cols)
+    df_resid = nobs - x.shape[1]
+    
+    # Permutations
+    if type(perms) is int:
+        perms = gen_perms(perms, nobs, strata)
+    perms  = add_original_index(perms)
+    
+    # Permuted versions of H2 and IH
+    H2perms = gen_h2_perms(x, cols, perms)
+    IHperms = gen_ih_perms(x, cols, perms)
+    
+    return (perms, H2perms, IHperms, df_among, df_resid)
+
 def mdmr(ys, x, cols, perms, strata=None, debug_output=False):
     """
     Multivariate Distance Matrix Regression
@@ -131,9 +172,6 @@ def mdmr(ys, x, cols, perms, strata=None, debug_output=False):
     .. [4] McArdle, B. H. and M. J. Anderson. 2001. Fitting multivariate models to community data: a comment on distance-based redundancy analysis. Ecology 290-297.
     .. [5] Neter, J., M. H. Kutner, C. J. Nachtsheim, and W. Wasserman. 1996. Applied linear statistical models. 4th ed. Irwin, Chicago, Illinois.
     """
-    check_rank(x)
-    
-    ntests  = ys.shape[1]
     nobs    = x.shape[0]
     if nobs != np.sqrt(ys.shape[0]):
         raise Exception("# of observations incompatible between x and ys")
@@ -143,20 +181,8 @@ def mdmr(ys, x, cols, perms, strata=None, debug_output=False):
     # multidimensional scaling
     Gs = gower_center_many(ys)
     
-    # Degrees of freedom
-    df_among = len(cols)
-    df_resid = nobs - x.shape[1]
-    df_total = nobs - 1
-    
-    # Permutations
-    if type(perms) is int:
-        perms = gen_perms(perms, nobs, strata)
-    perms  = add_original_index(perms)
-    nperms = perms.shape[0]
-    
     # Permuted versions of H2 and IH
-    H2perms = gen_h2_perms(x, cols, perms)
-    IHperms = gen_ih_perms(x, cols, perms)
+    perms, H2perms, IHperms, df_among, df_resid = mdmr_hats(x, cols, perms, strata)
     
     # Permutations of Fstats
     F_perms = ftest_fast(H2perms, IHperms, Gs,
@@ -46,3 +46,76 @@ def compute_distances(S0):
     S0   = norm_cols(S0.T).T
     dmat = 1 - S0.dot(S0.T)
     return dmat
+
+def calc_subdist_blocksize(nSubjects, nVoxels, memory_limit=None):
+    """
+    Number of seed voxels whose distance matrices can be computed at once
+    
+    Parameters
+    ----------
+    nSubjects : integer
+    nVoxels : integer
+        Number of voxels in each subject's (normalized) data
+    memory_limit : float (optional)
+        Memory in GB available for a block. By default 100 seeds are used.
+    
+    Returns
+    -------
+    block_size : integer
+    """
+    block_size = 100
+    
+    if memory_limit:
+        # (block, S, V) stack of z-maps + one subject's (block, V) correlations
+        memory_per_seed = (nSubjects + 1) * nVoxels * 8
+        block_size = int(memory_limit * 1024.0**3 / memory_per_seed)
+        if block_size < 1:
+            raise MemoryError('Not enough memory available to compute subject '\
+                              'distances. Need a minimum of %.2fGB' % \
+                              (memory_per_seed/1024.0**3))
+    
+    return max(min(block_size, nVoxels), 1)
+
+def subdists_block(subjects_normed_data, vox_inds):
+    """
+    Distance matrices between subjects for a block of seed voxels
+    
+    Every subject's seed maps are computed with a single matrix product. The
+    autocorrelation of each seed is masked in place by setting it to the mean
+    of the seed's other (Fisher transformed) connections, so it does not
+    contribute to the centering, scaling or distances.
+    
+    Parameters
+    ----------
+    subjects_normed_data : list of ndarrays
+        `S` normalized (`T`,`V`) arrays (see `norm_subjects`)
+    vox_inds : ndarray
+        Indices of the seed voxels
+    
+    Returns
+    -------
+    D : ndarray
+        Distance matrices of shape (`len(vox_inds)`, `S`, `S`)
+    """
+    vox_inds  = np.asarray(vox_inds)
+    nSubjects = len(subjects_normed_data)
+    nVoxels   = subjects_normed_data[0].shape[1]
+    nSeeds    = len(vox_inds)
+    seeds     = np.arange(nSeeds)
+    
+    Z = np.zeros((nSeeds, nSubjects, nVoxels))
+    for i in range(nSubjects):
+        Z[:,i,:] = ncor(subjects_normed_data[i], vox_inds)
+    
+    Z[seeds,:,vox_inds] = 0
+    np.arctanh(Z, Z)
+    Z[seeds,:,vox_inds] = Z.sum(2)/(nVoxels - 1)
+    
+    Z -= Z.mean(2)[:,:,np.newaxis]
+    Z /= np.sqrt(np.einsum('ijk,ijk->ij', Z, Z))[:,:,np.newaxis]
+    
+    D = np.zeros((nSeeds, nSubjects, nSubjects))
+    for j in range(nSeeds):
+        D[j] = 1 - Z[j].dot(Z[j].T)
+    
+    return D
@@ -297,4 +297,81 @@ def test_distances():
     fperms = np.array(robjects.r("as.matrix(attach.big.matrix('%s'))" % ffile))
     n     = np.sqrt(dmats.shape[0])
     
-    
\ No newline at end of file
+    
+
+def test_gower_center_many():
+    import numpy as np
+    from CPAC.cwas.mdmr import gower_center, gower_center_many
+    
+    nobs   = 12
+    ntests = 5
+    dmats  = np.random.random((nobs**2, ntests))
+    
+    Gs = gower_center_many(dmats)
+    for i in range(ntests):
+        G = gower_center(dmats[:,i].reshape(nobs,nobs))
+        assert np.allclose(Gs[:,i], G.flatten())
+
+def test_calc_mdmrs_batched():
+    """batched MDMR should match running mdmr on each voxel with the same perms"""
+    import numpy as np
+    from CPAC.cwas.mdmr import mdmr, gen_perms
+    from CPAC.cwas.utils import calc_mdmrs
+    
+    nobs    = 20
+    nvoxs   = 7
+    D       = np.random.random((nvoxs, nobs, nobs))
+    D       = D + D.transpose(0,2,1)
+    x       = np.hstack((np.ones((nobs,1)), np.random.random((nobs,2))))
+    cols    = [1]
+    perms   = gen_perms(50, nobs)
+    
+    F_set, p_set = calc_mdmrs(D, x, cols, perms, batch_size=3)
+    
+    for i in range(nvoxs):
+        ps, Fs, _, _ = mdmr(D[i].reshape(nobs**2,1), x, cols, perms)
+        assert np.allclose(F_set[i], Fs[0])
+        assert np.allclose(p_set[i], ps[0])
+
+def test_calc_subdists_blocked():
+    """blocked distances should match the voxel by voxel computation"""
+    import numpy as np
+    from CPAC.cwas.subdist import norm_subjects, ncor_subjects, \
+                                  fischers_transform, compute_distances
+    from CPAC.cwas.utils import calc_subdists
+    
+    nsubs   = 6
+    nvoxs   = 40
+    subjects_data = [ np.random.random((30, nvoxs)) for i in range(nsubs) ]
+    voxel_range   = (5, 25)
+    
+    D = calc_subdists(subjects_data, voxel_range, memory_limit=1e-5)
+    
+    normed = norm_subjects(subjects_data)
+    for i,v in enumerate(range(*voxel_range)):
+        S    = ncor_subjects(normed, [v])
+        S0   = np.delete(S[:,0,:], v, 1)
+        ref  = compute_distances(fischers_transform(S0))
+        assert np.allclose(D[i], ref)
+
+def test_calc_subdists_normed_store():
+    """distances from a float32 normalized group store match the raw data"""
+    import os
+    import tempfile
+    import numpy as np
+    from CPAC.cwas.subdist import norm_subjects
+    from CPAC.cwas.utils import calc_subdists
+    from CPAC.utils import load_group_store
+    
+    subjects_data = [ np.random.random((30, 40)) for i in range(6) ]
+    
+    store_dir   = tempfile.mkdtemp()
+    store_files = []
+    for i,Y in enumerate(norm_subjects(subjects_data)):
+        store_files.append(os.path.join(store_dir, 'subject_%04i.npy' % i))
+        np.save(store_files[-1], Y.astype('float32'))
+    
+    D_raw   = calc_subdists(subjects_data, (0, 40))
+    D_store = calc_subdists(load_group_store(store_files), (0, 40), normed=True)
+    
+    assert np.allclose(D_raw, D_store, atol=1e-4)
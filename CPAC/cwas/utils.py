@@ -2,7 +2,8 @@ import numpy as np
 from mdmr import *
 from subdist import *
 
-def calc_cwas(subjects_data, regressor, cols, iter, voxel_range, strata=None):
+def calc_cwas(subjects_data, regressor, cols, iter, voxel_range, strata=None, 
+              memory_limit=None, normed=False):
     """
     Performs Connectome-Wide Association Studies (CWAS) [1]_ for every voxel.  Implementation based on
     [2]_.
@@ -14,12 +15,18 @@ def calc_cwas(subjects_data, regressor, cols, iter, voxel_range, strata=None):
         of timepoints `T` can vary between subjects.
     regressor : ndarray
         Matrix of shape (`S`, `R`), `S` subjects and `R` regressors
-    iter : integer
-        Number of permutations to derive significance tests
+    iter : integer or ndarray
+        Number of permutations to derive significance tests or an array of
+        permuted indices of shape (`iter`, `S`)
     voxel_range : tuple
         (start, end) tuple specify the range of voxels (inside the mask) to perform cwas on.    
     strata : None or list
         todo
+    memory_limit : None or float
+        Memory (in GB) used for each block of subject distances
+    normed : boolean
+        Whether the columns of `subjects_data` are already centered and scaled
+        to unit norm (e.g. memory-mapped from a group store)
         
     Returns
     -------
@@ -40,41 +47,68 @@ def calc_cwas(subjects_data, regressor, cols, iter, voxel_range, strata=None):
     
     """
     
-    D            = calc_subdists(subjects_data, voxel_range)
+    D            = calc_subdists(subjects_data, voxel_range, memory_limit, normed)
     F_set, p_set = calc_mdmrs(D, regressor, cols, iter, strata)
     
     return F_set, p_set
 
-def calc_subdists(subjects_data, voxel_range):
+def calc_subdists(subjects_data, voxel_range, memory_limit=None, normed=False):
+    """
+    Subject distance matrices for every voxel in `voxel_range`
+    
+    Seed voxels are processed in blocks whose size is set by `memory_limit`
+    (in GB, see `calc_subdist_blocksize`). If `normed` is True the subjects'
+    data are used as is instead of being normalized (copied) first.
+    """
     nSubjects   = len(subjects_data)
-    vox_inds    = range(*voxel_range)
+    vox_inds    = np.arange(*voxel_range)
     nVoxels     = len(vox_inds)
     #Number of timepoints may be consistent between subjects
     
-    subjects_normed_data = norm_subjects(subjects_data)
+    block_size  = calc_subdist_blocksize(nSubjects, subjects_data[0].shape[1], 
+                                         memory_limit)
+    
+    if normed:
+        subjects_normed_data = subjects_data
+    else:
+        subjects_normed_data = norm_subjects(subjects_data)
     
     # Distance matrices for every voxel
     D = np.zeros((nVoxels, nSubjects, nSubjects))
-        
-    # For a particular voxel v, its spatial correlation map for every subject
-    S = np.zeros((nSubjects, 1, nVoxels))
     
-    for i in range(nVoxels):
-        S    = ncor_subjects(subjects_normed_data, [vox_inds[i]])
-        S0   = np.delete(S[:,0,:], vox_inds[i], 1)    # remove autocorrelations
-        S0   = fischers_transform(S0)
-        D[i] = compute_distances(S0)
+    for start in range(0, nVoxels, block_size):
+        stop = min(start + block_size, nVoxels)
+        D[start:stop] = subdists_block(subjects_normed_data, vox_inds[start:stop])
     
     return D
 
-def calc_mdmrs(D, regressor, cols, iter, strata=None):
+def calc_mdmrs(D, regressor, cols, iter, strata=None, batch_size=None):
+    """
+    MDMR for every voxel's distance matrix
+    
+    The permutations and the permuted hat matrices are generated once and
+    shared by all voxels in `D`. Voxels are Gower centered and tested in
+    batches of `batch_size` (all voxels at once by default) so the F
+    statistics of a whole batch come from two matrix products.
+    """
     nVoxels = D.shape[0]
     nSubjects = D.shape[1]
     
+    if batch_size is None:
+        batch_size = nVoxels
+    
     F_set = np.zeros(nVoxels)
     p_set = np.zeros(nVoxels)
     
-    for i in range(nVoxels):
-        p_set[i], F_set[i], _, _ = mdmr(D[i].reshape(nSubjects**2,1), regressor, cols, iter, strata)
+    perms, H2perms, IHperms, df_among, df_resid = mdmr_hats(regressor, cols, 
+                                                            iter, strata)
+    
+    for start in range(0, nVoxels, batch_size):
+        stop     = min(start + batch_size, nVoxels)
+        ys       = D[start:stop].reshape(stop-start, nSubjects**2).T
+        Gs       = gower_center_many(ys)
+        F_perms  = ftest_fast(H2perms, IHperms, Gs, df_among, df_resid)
+        F_set[start:stop] = F_perms[0,:]
+        p_set[start:stop] = fperms_to_pvals(F_perms[0,:], F_perms)
     
     return F_set, p_set
@@ -9,6 +9,10 @@ from generate_motion_statistics import  motion_power_statistics,\
                                  fristons_twenty_four, \
                                  calc_friston_twenty_four
 
+from motion_qc import power_fd, \
+                      jenkinson_fd, \
+                      dvars
+
 __all__ = ['motion_power_statistics', \
            'calculate_FD_P', \
            'calculate_FD_J', \
@@ -18,4 +22,7 @@ __all__ = ['motion_power_statistics', \
            'gen_power_parameters', \
            'calculate_DVARS', \
            'fristons_twenty_four', \
-           'calc_friston_twenty_four' ]
+           'calc_friston_twenty_four', \
+           'power_fd', \
+           'jenkinson_fd', \
+           'dvars' ]
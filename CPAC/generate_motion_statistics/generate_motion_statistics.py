@@ -568,160 +568,46 @@ def calculate_FD_P(in_file):
     
     import os
     import numpy as np
+    from CPAC.generate_motion_statistics.motion_qc import power_fd
 
     out_file = os.path.join(os.getcwd(), 'FD.1D') 
 
-    lines = open(in_file, 'r').readlines()
-    rows = [[float(x) for x in line.split()] for line in lines]
-    cols = np.array([list(col) for col in zip(*rows)])
-    
-    translations = np.transpose(np.abs(np.diff(cols[3:6, :])))
-    rotations = np.transpose(np.abs(np.diff(cols[0:3, :])))
+    FD_power = power_fd(np.loadtxt(in_file, ndmin=2))
 
-    FD_power = np.sum(translations, axis = 1) + (50*3.141/180)*np.sum(rotations, axis =1)
-    
-    #FD is zero for the first time point
-    FD_power = np.insert(FD_power, 0, 0)
-    
     np.savetxt(out_file, FD_power)
     
     return out_file
     
 
 def calculate_FD_J(in_file):
-    
-    '''
-    @ Krsna
-    May 2013
-    compute 
-    1) Jenkinson FD from 3dvolreg's *.affmat12.1D file from -1Dmatrix_save option
-	
-    input: subject ID, rest_number, name of 6 parameter motion correction file (an output of 3dvolreg)
-    output: FD_J.1D file
-    Assumptions:    1) subject is available in BASE_DIR
-    2) 3dvolreg is already performed and the 1D motion parameter and 1D_matrix file file is present in sub?/rest_? called as --->'lfo_mc_affmat.1D'
-
-    '''
-
-    import numpy as np
-    import os
-    import sys
-    import math
-   
     """
     Method to calculate Framewise Displacement (FD) calculations
     (Jenkinson et al., 2002)
-    
-    Parameters; in_file : string
-    Returns; out_file : string
-    NOTE: infile should have one 3dvolreg affine matrix in one row - NOT the motion parameters
- 
-    """
-
-    out_file = os.path.join(os.getcwd(), 'FD_J.1D')
-        
-    f = open(out_file, 'w')
-    #print in_file
-    pm_ = np.genfromtxt(in_file)
-        
-    pm = np.zeros((pm_.shape[0],pm_.shape[1]+4))
-    pm[:,:12]=pm_
-    pm[:,12:]=[0.0, 0.0, 0.0, 1.0]
-       
-    flag = 0
-
-    #The default radius (as in FSL) of a sphere represents the brain
-    rmax = 80.0
-
-    #rigid body transformation matrix 
-    T_rb_prev = np.matrix(np.eye(4))
-    
-    for i in range(0, pm.shape[0]):
-	T_rb = np.matrix(pm[i].reshape(4,4)) # making use of the fact that the order of aff12 matrix is "row-by-row"
-        
-	if flag == 0:
-            flag = 1
-            # first timepoint
-            print >> f, 0 
-        else:
-            M = np.dot(T_rb, T_rb_prev.I) - np.eye(4)
-            A = M[0:3, 0:3]
-            b = M[0:3, 3]
-
-            FD_J = math.sqrt((rmax*rmax/5)*np.trace(np.dot(A.T, A)) + np.dot(b.T, b))
-            print >> f, '%.8f'%FD_J
-                
-        T_rb_prev = T_rb
-    
-    f.close()
-    
-    return out_file
-
-
 
-
-    """
-    Method to calculate Framewise Displacement (FD) calculations
-    (Jenkinson et al., 2002)
-    
     Parameters
     ----------
     in_file : string
-        movement parameters vector file path
-    
+        3dvolreg's affine matrices file (-1Dmatrix_save option), with one
+        matrix per row - NOT the motion parameters
+
     Returns
     -------
     out_file : string
-        Frame -wise displalcement mat 
-        file path
-    
+        Frame-wise displacement 1D file path
+
     """
-    
-    '''
+
     import os
     import numpy as np
-    import math
+    from CPAC.generate_motion_statistics.motion_qc import jenkinson_fd
 
-    out_file = os.path.join(os.getcwd(), 'FD_jenkinson.1D')
-    
-    f = open(out_file, 'w')
-    
-    pm = np.loadtxt(in_file)
-    
-    flag = 0
+    out_file = os.path.join(os.getcwd(), 'FD_J.1D')
 
-    #The default radius (as in FSL) of a sphere represents the brain
-    rmax = 80.0
+    FD_J = jenkinson_fd(np.genfromtxt(in_file))
 
-    #rigid body transformation matrix 
-    T_rb_prev = np.matrix(np.eye(4))
-    
-    for i in range(0, pm.shape[0]):
+    np.savetxt(out_file, FD_J, fmt='%.8f')
 
-        t1 = np.matrix([[1,0,0,pm[i][0]], [0,1,0, pm[i][1]], [0,0,1,pm[i][2]], [0,0,0,1]] )
-        t2 = np.matrix([[1,0,0,0], [0, math.cos(pm[i][3]), math.sin(pm[i][3]),0], [0, - math.sin(pm[i][3]), math.cos(pm[i][3]), 0], [0,0,0,1]])
-        t3 = np.matrix([[math.cos(pm[i][4]), 0, math.sin(pm[i][4]),0], [0,1,0,0], [-math.sin(pm[i][4]), 0, math.cos(pm[i][4]), 0], [0,0,0,1]])
-        t4 = np.matrix([[math.cos(pm[i][5]), math.sin(pm[i][5]), 0, 0], [-math.sin(pm[i][5]), math.cos(pm[i][5]), 0, 0], [0,0,1,0], [0,0,0,1]])
-        T_rb  = np.dot(np.dot(t1,t2), np.dot(t3,t4))
-        
-        if flag == 0:
-            flag = 1
-            # first timepoint
-            print >> f, 0 
-        else:
-            M = np.dot(T_rb, T_rb_prev.I) - np.eye(4)
-            A = M[0:3, 0:3]
-            b = M[0:3, 3]
-
-            FD_J = math.sqrt((rmax*rmax/5)*np.trace(np.dot(A.T, A)) + np.dot(b.T, b))
-            print >> f, '%.4f'%FD_J
-                
-        T_rb_prev = T_rb
-    
-    f.close()
-    
     return out_file
-    '''
 
 
 def set_frames_in(in_file, threshold, exclude_list):
@@ -1010,20 +896,16 @@ def calculate_DVARS(rest, mask):
     import numpy as np
     import nibabel as nib
     import os
+    from CPAC.utils import extract_masked_data
+    from CPAC.generate_motion_statistics.motion_qc import dvars
     
     out_file = os.path.join(os.getcwd(), 'DVARS.npy')
     
-    rest_data = nib.load(rest).get_data().astype(np.float32)
     mask_data = nib.load(mask).get_data().astype('bool')
     
-    #square of relative intensity value for each voxel across
-    #every timepoint 
-    data = np.square(np.diff(rest_data, axis = 3))
-    #applying mask, getting the data in the brain only
-    data = data[mask_data]
-    #square root and mean across all timepoints inside mask
-    DVARS = np.sqrt(np.mean(data, axis=0))
-    
+    #time-series of the voxels in the brain only, from the data cache,
+    #differenced a chunk of voxels at a time
+    DVARS = dvars(extract_masked_data(rest, mask_data))
     
     np.save(out_file, DVARS)
     
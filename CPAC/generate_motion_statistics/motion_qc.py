@@ -0,0 +1,99 @@
+def power_fd(params):
+    """
+    Framewise Displacement (FD) of every frame (Power et al., 2012)
+
+    Parameters
+    ----------
+    params : numpy.ndarray
+        (timepoints x 6) motion parameters, rotations (in degrees) in the
+        first three columns and translations (in mm) in the last three
+
+    Returns
+    -------
+    fd : numpy.ndarray
+        FD of every timepoint, zero for the first one
+    """
+    import numpy as np
+
+    params = np.atleast_2d(np.asarray(params, dtype=np.float64))
+
+    deltas = np.abs(np.diff(params[:, :6], axis=0))
+
+    fd = np.zeros(params.shape[0])
+    fd[1:] = deltas[:, 3:6].sum(1) + (50*3.141/180)*deltas[:, 0:3].sum(1)
+
+    return fd
+
+
+def jenkinson_fd(affmats, rmax=80.0):
+    """
+    Framewise Displacement (FD) of every frame (Jenkinson et al., 2002),
+    computed for all frames at once on the stack of 4x4 rigid body
+    transformation matrices
+
+    Parameters
+    ----------
+    affmats : numpy.ndarray
+        (timepoints x 12) affine matrices, one per row, as written
+        row-by-row by 3dvolreg's -1Dmatrix_save option
+    rmax : float, optional
+        radius (in mm) of the sphere representing the brain (default of FSL)
+
+    Returns
+    -------
+    fd : numpy.ndarray
+        FD of every timepoint, zero for the first one
+    """
+    import numpy as np
+
+    affmats = np.atleast_2d(np.asarray(affmats, dtype=np.float64))
+    ntpts = affmats.shape[0]
+
+    T = np.zeros((ntpts, 4, 4))
+    T[:, :3, :] = affmats[:, :12].reshape(ntpts, 3, 4)
+    T[:, 3, 3] = 1.0
+
+    # M_i = T_i inv(T_i-1) - I, solved as T_i-1' M_i' = T_i' for all
+    # frames at once
+    M = np.linalg.solve(T[:-1].transpose(0, 2, 1),
+                        T[1:].transpose(0, 2, 1)).transpose(0, 2, 1)
+    M -= np.eye(4)
+    A = M[:, :3, :3]
+    b = M[:, :3, 3]
+
+    fd = np.zeros(ntpts)
+    # trace(A'A) is the sum of the squares of A
+    fd[1:] = np.sqrt((rmax*rmax/5)*(A**2).sum(axis=(1, 2)) + (b**2).sum(1))
+
+    return fd
+
+
+def dvars(data, chunk_size=10000):
+    """
+    DVARS of every frame (Power et al., 2012): root mean square, over
+    voxels, of the backward differences of the time-series. Differences
+    are taken `chunk_size` voxels at a time, so only a chunk of them is in
+    memory at once.
+
+    Parameters
+    ----------
+    data : numpy.ndarray
+        (voxels x timepoints) time-series of the voxels in the brain mask
+    chunk_size : integer, optional
+        number of voxels differenced at a time
+
+    Returns
+    -------
+    dvars : numpy.ndarray
+        DVARS of every timepoint but the first
+    """
+    import numpy as np
+
+    nvoxs, ntpts = data.shape
+
+    sum_sq = np.zeros(max(ntpts - 1, 0))
+    for start in range(0, nvoxs, chunk_size):
+        diff = np.diff(data[start:start+chunk_size], axis=1)
+        sum_sq += np.einsum('ij,ij->j', diff, diff, dtype=np.float64)
+
+    return np.sqrt(sum_sq / nvoxs)
@@ -0,0 +1,87 @@
+"""
+This tests the functions in generate_motion_statistics/motion_qc.py
+"""
+
+import os
+import numpy as np
+import nibabel as nib
+from numpy.testing import *
+
+
+def random_rigid_affmats(ntpts):
+    # Small random rotations and translations, as 3dvolreg's 12 column rows
+    affmats = np.zeros((ntpts, 12))
+    for i in range(ntpts):
+        a, b, c = np.random.uniform(-0.05, 0.05, 3)
+        Rx = np.array([[1, 0, 0], [0, np.cos(a), -np.sin(a)],
+                       [0, np.sin(a), np.cos(a)]])
+        Ry = np.array([[np.cos(b), 0, np.sin(b)], [0, 1, 0],
+                       [-np.sin(b), 0, np.cos(b)]])
+        Rz = np.array([[np.cos(c), -np.sin(c), 0],
+                       [np.sin(c), np.cos(c), 0], [0, 0, 1]])
+        T = np.hstack((Rx.dot(Ry).dot(Rz), np.random.uniform(-2, 2, (3, 1))))
+        affmats[i] = T.ravel()
+    return affmats
+
+
+def test_jenkinson_fd():
+    from CPAC.generate_motion_statistics import jenkinson_fd
+    
+    affmats = random_rigid_affmats(40)
+    fd = jenkinson_fd(affmats)
+    
+    # Reference: one matrix inverse per timepoint
+    rmax = 80.0
+    ref = [0]
+    for i in range(1, affmats.shape[0]):
+        T_prev = np.vstack((affmats[i-1].reshape(3, 4), [0, 0, 0, 1]))
+        T = np.vstack((affmats[i].reshape(3, 4), [0, 0, 0, 1]))
+        M = np.dot(T, np.linalg.inv(T_prev)) - np.eye(4)
+        A = M[0:3, 0:3]
+        b = M[0:3, 3]
+        ref.append(np.sqrt((rmax*rmax/5)*np.trace(np.dot(A.T, A)) + 
+                           np.dot(b.T, b)))
+    
+    assert_allclose(fd, ref, rtol=1e-10, atol=1e-12)
+
+
+def test_power_fd():
+    from CPAC.generate_motion_statistics import power_fd
+    
+    params = np.random.standard_normal((30, 6))
+    fd = power_fd(params)
+    
+    ref = np.zeros(30)
+    for i in range(1, 30):
+        d = np.abs(params[i] - params[i-1])
+        ref[i] = d[3:6].sum() + (50*3.141/180)*d[0:3].sum()
+    
+    assert_allclose(fd, ref)
+
+
+def test_calculate_DVARS():
+    import tempfile
+    from CPAC.generate_motion_statistics import calculate_DVARS, dvars
+    
+    data = np.random.standard_normal((6, 7, 5, 20)).astype('float32')
+    mask = np.random.randint(0, 2, (6, 7, 5)).astype('float32')
+    
+    cwd = os.getcwd()
+    tmpdir = tempfile.mkdtemp()
+    os.chdir(tmpdir)
+    try:
+        nib.Nifti1Image(data, np.eye(4)).to_filename('rest.nii.gz')
+        nib.Nifti1Image(mask, np.eye(4)).to_filename('mask.nii.gz')
+        
+        DVARS = np.load(calculate_DVARS('rest.nii.gz', 'mask.nii.gz'))
+    finally:
+        os.chdir(cwd)
+    
+    # Reference: differences of the whole 4D volume, then masked
+    ref = np.sqrt(np.mean(np.square(np.diff(data, axis=3))[mask > 0], 
+                          axis=0))
+    assert_allclose(DVARS, ref, rtol=1e-5)
+    
+    # Chunking does not change the result
+    ts = data[mask > 0]
+    assert_allclose(dvars(ts, chunk_size=7), dvars(ts), rtol=1e-12)
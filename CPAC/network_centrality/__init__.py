@@ -1,8 +1,10 @@
 from resting_state_centrality import create_resting_state_graphs,\
                                      load,\
                                      calc_centrality,\
+                                     calc_centrality_multi,\
                                      get_centrality_by_rvalue,\
                                      get_centrality_by_sparsity,\
+                                     get_centrality_multi,\
                                      get_centrality_fast
 
 from z_score import get_cent_zscore
@@ -15,23 +17,29 @@ from utils import convert_pvalue_to_r,\
                   merge_lists
 
 from core import degree_centrality, \
+                 tiled_degree_centrality, \
                  fast_degree_centrality, \
                  eigenvector_centrality, \
+                 matrix_free_eigenvector_centrality, \
                  fast_eigenvector_centrality
 
 __all__ = ['create_resting_state_graphs',\
            'load',\
            'get_centrality_by_rvalue',\
            'get_centrality_by_sparsity',\
+           'get_centrality_multi',\
            'get_centrality_fast',\
            'map_centrality_matrix',\
            'get_cent_zscore',\
            'calc_corrcoef',\
            'calc_centrality', \
+           'calc_centrality_multi', \
            'convert_pvalue_to_r',\
            'calc_blocksize',\
            'degree_centrality',\
+           'tiled_degree_centrality',\
            'fast_degree_centrality',\
            'eigenvector_centrality',\
+           'matrix_free_eigenvector_centrality',\
            'fast_eigenvector_centrality']
 
@@ -12,6 +12,7 @@ import numpy as np
 #import pyximport
 #pyximport.install(setup_args={'include_dirs': [np.get_include()]})
 from CPAC.network_centrality.thresh_and_sum import *
+from CPAC.network_centrality.lfcd_bfs import *
 
 
 def degree_centrality(corr_matrix, r_value, method, out=None):
@@ -60,6 +61,96 @@ def degree_centrality(corr_matrix, r_value, method, out=None):
     return out
 
 
+def tiled_degree_centrality(ts_normd, r_value, block_size, num_threads=1,
+                            tile_func=None):
+    """
+    Calculate the binarized and weighted degree centrality of every voxel
+    using a correlation threshold, from tiles of the correlation matrix.
+    
+    Only the tiles on and above the diagonal are computed (the matrix is
+    symmetric). Each tile updates both degrees of its row and column voxels
+    as soon as it is computed, so the matrix is never held in memory. The
+    tiles are divided between `num_threads` threads, each with its own
+    degree sums.
+    
+    Paramaters
+    ---------
+    ts_normd : numpy.ndarray
+        timeseries of shape (ntpts x nvoxs) that is normalized; i.e. the data 
+        is demeaned and divided by its L2-norm
+    r_value : float or list of floats
+        correlation threshold; with a list, the degrees of every threshold
+        are summed from the same tiles
+    block_size : integer
+        number of voxels on each side of a tile
+    num_threads : integer
+        number of threads the tiles are divided between
+    tile_func : function (optional)
+        called as `tile_func(rmat, n, p)` with every tile `rmat`, of the
+        rows from voxel `n` and the columns from voxel `p`, by the thread
+        that computed it
+    
+    Returns
+    -------
+    degree_bin : numpy.ndarray
+    degree_wght : numpy.ndarray
+        degrees, without the self-correlation of the voxels; a list of
+        (degree_bin, degree_wght) for a list of thresholds
+    """
+    from multiprocessing.pool import ThreadPool
+    
+    nvoxs = ts_normd.shape[1]
+    
+    r_values = r_value
+    if np.isscalar(r_value):
+        r_values = [r_value]
+    
+    if ts_normd.dtype.itemsize == 8:
+        dtype    = "double"
+        r_values = [np.float64(r) for r in r_values]
+    else:
+        dtype    = "float"
+        r_values = [np.float32(r) for r in r_values]
+    
+    func = globals()["degree_tile_%s" % dtype]
+    
+    starts = range(0, nvoxs, block_size)
+    tiles  = [(n, p) for n in starts for p in starts if p >= n]
+    
+    def tiles_degree(tile_list):
+        degrees = [(np.zeros(nvoxs), np.zeros(nvoxs)) for r in r_values]
+        for n, p in tile_list:
+            rmat = np.dot(ts_normd[:,n:n+block_size].T, 
+                          ts_normd[:,p:p+block_size])
+            for r, (degree_bin, degree_wght) in zip(r_values, degrees):
+                func(rmat, n, p, r, degree_bin, degree_wght)
+            if tile_func is not None:
+                tile_func(rmat, n, p)
+        return degrees
+    
+    if num_threads > 1:
+        pool = ThreadPool(num_threads)
+        try:
+            sums = pool.map(tiles_degree, 
+                            [tiles[k::num_threads] for k in range(num_threads)])
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        sums = [tiles_degree(tiles)]
+    
+    degrees = []
+    for k in range(len(r_values)):
+        degree_bin  = np.sum([s[k][0] for s in sums], axis=0)
+        degree_wght = np.sum([s[k][1] for s in sums], axis=0)
+        degrees.append((degree_bin.astype(ts_normd.dtype),
+                        degree_wght.astype(ts_normd.dtype)))
+    
+    if np.isscalar(r_value):
+        return degrees[0]
+    return degrees
+
+
 def fast_degree_centrality(m):
     from numpy import linalg as LA
     
@@ -74,6 +165,80 @@ def fast_degree_centrality(m):
 
 
 
+####
+# Local Functional Connectivity Density
+####
+
+def local_functional_connectivity_density(ts_normd, template, r_value, 
+                                          num_threads=1):
+    """
+    Calculate the binarized and weighted lFCD of every voxel, i.e. the size
+    (and summed correlation) of the connected cluster of voxels correlated
+    with the seed above `r_value` that contains the seed.
+    
+    Each seed's cluster is grown with a breadth-first search over a
+    26-neighbour index built once for all voxels, so only the correlations
+    of the visited voxels are computed.
+    
+    Paramaters
+    ---------
+    ts_normd : numpy.ndarray
+        timeseries of shape (ntpts x nvoxs) that is normalized; i.e. the data 
+        is demeaned and divided by its L2-norm
+    template : numpy.ndarray
+        three dimensional array with non-zero elements corresponding to the
+        voxels (columns) of `ts_normd`
+    r_value : float
+    num_threads : integer
+        number of threads the seeds are divided between
+    
+    Returns
+    -------
+    lfcd_bin : numpy.ndarray
+    lfcd_wght : numpy.ndarray
+    """
+    from multiprocessing.pool import ThreadPool
+    from CPAC.network_centrality.utils import neighbour_index
+    
+    # Each voxel's timeseries is contiguous for the correlations
+    ts = np.ascontiguousarray(ts_normd.T)
+    nvoxs = ts.shape[0]
+    
+    if ts.dtype.itemsize == 8:
+        dtype   = "double"
+        r_value = np.float64(r_value)
+    else:
+        dtype   = "float"
+        r_value = np.float32(r_value)
+    
+    indptr, indices = neighbour_index(np.argwhere(template), k=26)
+    
+    lfcd_bin  = np.zeros(nvoxs, dtype=ts.dtype)
+    lfcd_wght = np.zeros(nvoxs, dtype=ts.dtype)
+    
+    func = globals()["lfcd_%s" % dtype]
+    
+    def lfcd_seeds(seed_range):
+        func(ts, indptr, indices, seed_range[0], seed_range[1], r_value,
+             lfcd_bin, lfcd_wght)
+    
+    if num_threads > 1:
+        # Several ranges per thread to even out the cluster sizes
+        nranges = 4*num_threads
+        bounds  = np.linspace(0, nvoxs, nranges+1).astype('int')
+        pool    = ThreadPool(num_threads)
+        try:
+            pool.map(lfcd_seeds, zip(bounds[:-1], bounds[1:]))
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        lfcd_seeds((0, nvoxs))
+    
+    return lfcd_bin, lfcd_wght
+
+
+
 ####
 # Eigenvector Centrality
 ####
@@ -141,6 +306,116 @@ def eigenvector_centrality(corr_matrix,
         return np.abs(eigenVector)
 
 
+def eigenvector_centrality_operator(ts_normd, r_value, method, 
+                                    block_size=1000, pool=None):
+    """
+    Matrix-free thresholded correlation matrix, for eigenvector centrality
+    
+    The correlation matrix is never stored: on each product with a vector,
+    blocks of `block_size` rows are recomputed from the normalized
+    timeseries, thresholded and multiplied with the vector. Only
+    O(nvoxs*ntpts + block_size*nvoxs) memory is used (per worker).
+    
+    Paramaters
+    ---------
+    ts_normd : numpy.ndarray
+        timeseries of shape (ntpts x nvoxs) that is normalized; i.e. the data 
+        is demeaned and divided by its L2-norm
+    r_value : float
+    method : str
+        Can be 'binarize' or 'weighted'
+    block_size : integer
+        number of rows of the correlation matrix computed at a time
+    pool : multiprocessing.pool.ThreadPool (optional)
+        If specified, blocks are computed in parallel by its workers
+    
+    Returns
+    -------
+    operator : scipy.sparse.linalg.LinearOperator
+        `nvoxs` x `nvoxs` operator that can be passed to `eigsh`
+    """
+    from scipy.sparse.linalg import LinearOperator
+
+    if method not in ["binarize", "weighted"]:
+        raise Exception("Method must be one of binarize or weighted and not %s" % method)
+    
+    if ts_normd.dtype.itemsize == 8:
+        dtype   = "double"
+        r_value = np.float64(r_value)
+    else:
+        dtype   = "float"
+        r_value = np.float32(r_value)
+    
+    thresh_func = globals()["thresh_%s_%s" % (method, dtype)]
+    
+    nvoxs  = ts_normd.shape[1]
+    blocks = [ (n, min(n+block_size, nvoxs)) for n in range(0, nvoxs, block_size) ]
+    
+    def matvec(x):
+        x = np.asarray(x, dtype=ts_normd.dtype).ravel()
+        
+        def block_matvec(block):
+            n, m = block
+            rmat_block = np.dot(ts_normd[:,n:m].T, ts_normd)
+            thresh_func(rmat_block, r_value)
+            return rmat_block.dot(x)
+        
+        if pool is None:
+            y_blocks = map(block_matvec, blocks)
+        else:
+            y_blocks = pool.map(block_matvec, blocks)
+        
+        return np.concatenate(list(y_blocks))
+    
+    return LinearOperator((nvoxs, nvoxs), matvec=matvec, dtype=ts_normd.dtype)
+
+
+def matrix_free_eigenvector_centrality(ts_normd, r_value, method, 
+                                       block_size=1000, num_threads=1):
+    """
+    Eigenvector centrality of the thresholded correlation matrix without
+    storing the matrix (see `eigenvector_centrality_operator`)
+    
+    Paramaters
+    ---------
+    ts_normd : numpy.ndarray
+        normalized timeseries of shape (ntpts x nvoxs)
+    r_value : float
+    method : str
+        Can be 'binarize' or 'weighted'
+    block_size : integer
+        number of rows of the correlation matrix computed at a time
+    num_threads : integer
+        number of blocks computed in parallel, each holding its own block
+    
+    Returns
+    -------
+    eigenVector : numpy.ndarray
+        (nvoxs x 1) absolute value of the leading eigenvector
+    """
+    from multiprocessing.pool import ThreadPool
+    from scipy.sparse import linalg as LA
+    
+    pool = None
+    if num_threads > 1:
+        pool = ThreadPool(num_threads)
+    
+    try:
+        operator = eigenvector_centrality_operator(ts_normd, r_value, method,
+                                                   block_size, pool)
+        # Start from a fixed vector (not ARPACK's random one) so the same
+        # data always gives the same map
+        v0 = np.ones(ts_normd.shape[1], dtype=ts_normd.dtype)
+        eigenValue, eigenVector = LA.eigsh(operator, k=1, which='LM', maxiter=1000,
+                                           v0=v0)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    
+    return np.abs(eigenVector)
+
+
 def fast_eigenvector_centrality(m, maxiter=99, verbose=True):
     """
     The output here is based on a transfered correlation matrix of m.
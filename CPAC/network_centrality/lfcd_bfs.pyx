@@ -0,0 +1,104 @@
+cimport cython
+import numpy as np
+cimport numpy as np
+
+
+###
+# Local Functional Connectivity Density (lFCD)
+#
+# For every seed, the connected cluster of supra-threshold voxels holding
+# the seed is grown with a breadth-first search over the (precomputed)
+# neighbours of each voxel. Correlations with the seed are only computed
+# for the voxels that are visited. The loops release the GIL so ranges of
+# seeds can be processed by parallel threads.
+###
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def lfcd_float(float[:, ::1] ts, int[::1] indptr, int[::1] indices,
+               int start, int stop, float thresh,
+               float[::1] lfcd_bin, float[::1] lfcd_wght):
+    cdef int nvoxs = ts.shape[0]
+    cdef int ntpts = ts.shape[1]
+    cdef int[::1] queue = np.empty(nvoxs, dtype=np.int32)
+    cdef int[::1] visited = np.empty(nvoxs, dtype=np.int32)
+    cdef int seed, head, tail, u, v, e, t
+    cdef double r, wght
+
+    visited[:] = -1
+    with nogil:
+        for seed in range(start, stop):
+            visited[seed] = seed
+            queue[0] = seed
+            head = 0
+            tail = 1
+            wght = 0
+            for t in range(ntpts):
+                wght = wght + ts[seed,t]*ts[seed,t]
+            while head < tail:
+                u = queue[head]
+                head = head + 1
+                for e in range(indptr[u], indptr[u+1]):
+                    v = indices[e]
+                    if visited[v] == seed:
+                        continue
+                    visited[v] = seed
+                    r = 0
+                    for t in range(ntpts):
+                        r = r + ts[seed,t]*ts[v,t]
+                    if r > thresh:
+                        queue[tail] = v
+                        tail = tail + 1
+                        wght = wght + r
+            # Seeds without supra-threshold neighbours count themselves
+            if tail > 1:
+                lfcd_bin[seed] = tail
+                lfcd_wght[seed] = wght
+            else:
+                lfcd_bin[seed] = 1
+                lfcd_wght[seed] = 1
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def lfcd_double(double[:, ::1] ts, int[::1] indptr, int[::1] indices,
+                int start, int stop, double thresh,
+                double[::1] lfcd_bin, double[::1] lfcd_wght):
+    cdef int nvoxs = ts.shape[0]
+    cdef int ntpts = ts.shape[1]
+    cdef int[::1] queue = np.empty(nvoxs, dtype=np.int32)
+    cdef int[::1] visited = np.empty(nvoxs, dtype=np.int32)
+    cdef int seed, head, tail, u, v, e, t
+    cdef double r, wght
+
+    visited[:] = -1
+    with nogil:
+        for seed in range(start, stop):
+            visited[seed] = seed
+            queue[0] = seed
+            head = 0
+            tail = 1
+            wght = 0
+            for t in range(ntpts):
+                wght = wght + ts[seed,t]*ts[seed,t]
+            while head < tail:
+                u = queue[head]
+                head = head + 1
+                for e in range(indptr[u], indptr[u+1]):
+                    v = indices[e]
+                    if visited[v] == seed:
+                        continue
+                    visited[v] = seed
+                    r = 0
+                    for t in range(ntpts):
+                        r = r + ts[seed,t]*ts[v,t]
+                    if r > thresh:
+                        queue[tail] = v
+                        tail = tail + 1
+                        wght = wght + r
+            # Seeds without supra-threshold neighbours count themselves
+            if tail > 1:
+                lfcd_bin[seed] = tail
+                lfcd_wght[seed] = wght
+            else:
+                lfcd_bin[seed] = 1
+                lfcd_wght[seed] = 1
@@ -9,7 +9,7 @@ used in C-PAC
 
 # Function to create the network centrality workflow
 def create_resting_state_graphs(wf_name='resting_state_graph', 
-                                allocated_memory=None):
+                                allocated_memory=None, num_threads=1):
     '''
     Workflow to calculate degree and eigenvector centrality as well as 
     local functional connectivity density (lfcd) measures for the 
@@ -23,6 +23,10 @@ def create_resting_state_graphs(wf_name='resting_state_graph',
         matrix and stores it in a .mat file. By default its False
     wf_name : string
         name of the workflow
+    allocated_memory : float
+        memory (in GB) allocated to the centrality calculation
+    num_threads : integer
+        number of correlation blocks computed in parallel
         
     Returns 
     -------
@@ -134,13 +138,15 @@ def create_resting_state_graphs(wf_name='resting_state_graph',
                                                               'method_option',
                                                               'threshold_option',
                                                               'threshold',
-                                                              'allocated_memory'],
+                                                              'allocated_memory',
+                                                              'num_threads'],
                                                  output_names=['out_list'],
                                                  function=calc_centrality),
                                    name='calculate_centrality')
 
-    # Specify memory to interface for resource profiling
+    # Specify memory and threads to interface for resource profiling
     calculate_centrality.interface.estimated_memory_gb = allocated_memory
+    calculate_centrality.interface.num_threads = num_threads
 
     # Connect inputspec node to main function node
     wf.connect(inputspec, 'in_file', 
@@ -156,6 +162,7 @@ def create_resting_state_graphs(wf_name='resting_state_graph',
 
     # Specify allocated memory for calculating block size in function
     calculate_centrality.inputs.allocated_memory = allocated_memory
+    calculate_centrality.inputs.num_threads = num_threads
     
     # Instantiate outputspec node
     outputspec = pe.Node(util.IdentityInterface(fields=['centrality_outputs',
@@ -212,20 +219,22 @@ def load(datafile, template=None):
     import os
     import nibabel as nib
     import numpy as np
+    from CPAC.utils.data_cache import load_masked_data, select_masked_data
 
     try:
         if isinstance(datafile, list):
-            img = nib.load(datafile[0])
-        else:
-            img = nib.load(datafile) 
+            datafile = datafile[0]
+        img = nib.load(datafile)
         
-        data = img.get_data().astype(np.float32)
+        # Only the voxels of the data mask varying over time are kept
+        data_mask, data = load_masked_data(datafile)
         aff = img.get_affine()    
-        scans = data.shape[3]
+        scans = img.shape[3]
         
-        datmask = data.var(axis=3).astype('bool')
+        datmask = np.zeros(data_mask.shape, dtype='bool')
+        datmask[data_mask] = data.var(axis=1).astype('bool')
         if template is None:
-            mask = np.ones((data.shape[:3]))
+            mask = np.ones((data_mask.shape))
         else:
             mask = nib.load(template).get_data().astype(np.float32)
         
@@ -234,7 +243,7 @@ def load(datafile, template=None):
         raise Exception(err_msg)
     
     
-    if mask.shape != data.shape[:3]:
+    if mask.shape != img.shape[:3]:
         raise Exception('Invalid Shape Error. mask and data file have'\
                         'different shape please check the voxel size of the two files')
 
@@ -249,7 +258,8 @@ def load(datafile, template=None):
         flag=1
         for n in nodes:
             if n > 0:
-                node_array = data[(mask == n) & datmask]
+                node_array = select_masked_data(data_mask, data,
+                                                (mask == n) & datmask)
                 avg = np.mean(node_array, axis =0)
                 if flag:
                     timeseries = avg
@@ -264,13 +274,14 @@ def load(datafile, template=None):
         template_type = 0
         mask = mask.astype('bool')
         final_mask = mask & datmask
-        timeseries = data[final_mask]
+        timeseries = select_masked_data(data_mask, data, final_mask)
 
     return timeseries, aff, final_mask, template_type, scans
 
 
 # Function to calculate centrality using a correlation threshold 
-def get_centrality_by_rvalue(ts_normd, template, method_option, r_value, block_size):
+def get_centrality_by_rvalue(ts_normd, template, method_option, r_value, block_size,
+                             num_threads=1):
     '''
     Method to calculate degree/eigenvector centrality and lFCD
     via correlation (r-value) threshold
@@ -292,6 +303,9 @@ def get_centrality_by_rvalue(ts_normd, template, method_option, r_value, block_s
     block_size : an integer
         the number of rows (voxels) to compute timeseries correlation over
         at any one time
+    num_threads : an integer
+        the number of tiles (degree), blocks (eigenvector) or seed ranges
+        (lFCD) computed in parallel
 
     Returns
     -------
@@ -302,12 +316,9 @@ def get_centrality_by_rvalue(ts_normd, template, method_option, r_value, block_s
     '''
     
     # Import packages
-    import copy
     import numpy as np
-    import copy
     from nipype import logging
 
-    from CPAC.network_centrality.utils import cluster_data
     import CPAC.network_centrality.core as core
 
     # Init variables
@@ -325,7 +336,6 @@ def get_centrality_by_rvalue(ts_normd, template, method_option, r_value, block_s
         out_list.append(('degree_centrality_weighted', degree_weighted))
     # Init eigenvector centrality outputs
     if method_option == 'eigenvector':
-        r_matrix = np.zeros((nvoxs,nvoxs), dtype=ts_normd.dtype)
         # Init output map
         eigen_binarize = np.zeros(nvoxs, dtype=ts_normd.dtype)
         out_list.append(('eigenvector_centrality_binarize', eigen_binarize))
@@ -341,89 +351,47 @@ def get_centrality_by_rvalue(ts_normd, template, method_option, r_value, block_s
         lfcd_weighted = np.zeros(nvoxs, dtype=ts_normd.dtype)
         out_list.append(('lfcd_weighted', lfcd_weighted))
 
-    # Prepare to loop through and calculate correlation matrix
-    n = 0
-    m = block_size
-    block_no = 1
-    # Run as long as our last row index is <= nvoxs
-    while m <= nvoxs:
-        # First, compute block of correlation matrix
-        logger.info('running block %d: rows %d thru %d' % (block_no, n, m))
-        rmat_block = np.dot(ts_normd[:,n:m].T, ts_normd)
-
-        # Degree centrality calculation
-        if method_option == 'degree':
-            core.degree_centrality(rmat_block, r_value, method='binarize', 
-                              out=degree_binarize[n:m])
-            core.degree_centrality(rmat_block, r_value, method='weighted', 
-                              out=degree_weighted[n:m])
-
-        # Eigenvector centrality - append global corr. matrix
-        if method_option == 'eigenvector':
-            r_matrix[n:m] = rmat_block
-
-        # lFCD - perform lFCD algorithm
-        if method_option == 'lfcd':
-            xyz_a = np.argwhere(template)
-            krange = rmat_block.shape[0]
-            logger.info('...iterating through seeds in block - lfcd')
-            for k in range (0,krange):
-                corr_seed = rmat_block[k,:]
-                labels = cluster_data(corr_seed,r_value,xyz_a)
-                seed_label = labels[n+k]
-                # Binarized lFCD
-                if seed_label > 0:
-                    lfcd_bin = np.sum(labels==seed_label)
-                    lfcd_wght = np.sum(corr_seed*(labels==seed_label))
-                else:
-                    lfcd_bin = lfcd_wght = 1
-                lfcd_binarize[n+k] = lfcd_bin
-                lfcd_weighted[n+k] = lfcd_wght
-
-        # Delete block of corr matrix and increment indices
-        del rmat_block
-
-        # Move next block start point up to last block finish point
-        n = m
-        # If we finished at nvoxs last time, break the loop
-        if n == nvoxs:
-            break
-        # Else, if our next block runs over nvoxs, limit it to nvoxs
-        elif (m+block_size) > nvoxs:
-            m = nvoxs
-        # Else, just increment end of next block by block_size
-        else:
-            m += block_size
-        # Increment block number
-        block_no += 1
-
-    # Correct for self-correlation in degree centrality
+    # Degree - tiles of the upper triangle of the correlation matrix,
+    # thresholded and summed as they are computed
+    # (eigenvector and lFCD compute their own correlations, see below)
     if method_option == 'degree':
-        idx = np.where(degree_binarize)
-        degree_binarize[idx] = degree_binarize[idx]-1
-        idx = np.where(degree_weighted)
-        degree_weighted[idx] = degree_weighted[idx]-1
+        # Each thread holds one tile, within the memory of one block
+        tile_size = min(block_size, max(nvoxs//num_threads, 1))
+        logger.info('...calculating degree over tiles of %d voxels' \
+                    % tile_size)
+        degree_binarize[:], degree_weighted[:] = \
+            core.tiled_degree_centrality(ts_normd, r_value, tile_size,
+                                         num_threads)
+
+    # lFCD - grow each seed's cluster over the voxel grid
+    if method_option == 'lfcd':
+        logger.info('...iterating through seeds - lfcd')
+        lfcd_binarize[:], lfcd_weighted[:] = \
+            core.local_functional_connectivity_density(ts_normd, template,
+                                                       r_value, num_threads)
 
     # Perform eigenvector measures
     if method_option == 'eigenvector':
+        # The thresholded correlation matrix is recomputed blockwise on each
+        # iteration of the eigensolver instead of being held in memory
         logger.info('...calculating binarize eigenvector')
-        # Have to deepcopy the r_matrix because thresh and sum overwrites
-        # its values via pass-by-reference
         eigen_binarize[:] = \
-            core.eigenvector_centrality(copy.deepcopy(r_matrix), r_value,
-                                        method='binarize').squeeze()
+            core.matrix_free_eigenvector_centrality(ts_normd, r_value,
+                                                    'binarize', block_size,
+                                                    num_threads).squeeze()
         logger.info('...calculating weighted eigenvector')
         eigen_weighted[:] = \
-            core.eigenvector_centrality(r_matrix, r_value,
-                                        method='weighted').squeeze()
-        del r_matrix
+            core.matrix_free_eigenvector_centrality(ts_normd, r_value,
+                                                    'weighted', block_size,
+                                                    num_threads).squeeze()
 
     # Return list of outputs
     return out_list
 
 
 # Function to calculate centrality with a sparsity threhold
-def get_centrality_by_sparsity(ts_normd, method_option, threshold, block_size):
+def get_centrality_by_sparsity(ts_normd, method_option, threshold, block_size,
+                               num_threads=1):
     '''
     Method to calculate degree/eigenvector centrality via sparsity threshold
 
@@ -441,6 +409,9 @@ def get_centrality_by_sparsity(ts_normd, method_option, threshold, block_size):
     block_size : an integer
         the number of rows (voxels) to compute timeseries correlation over
         at any one time
+    num_threads : an integer
+        the number of tiles (sparsity threshold) or blocks (eigenvector)
+        computed in parallel
 
     Returns
     -------
@@ -452,11 +423,13 @@ def get_centrality_by_sparsity(ts_normd, method_option, threshold, block_size):
 
     # Import packages
     import copy
+    import threading
     import numpy as np
     import scipy as sp
     from nipype import logging
 
     import CPAC.network_centrality.core as core
+    from CPAC.network_centrality.utils import update_top_connections
 
     # Init variables
     logger = logging.getLogger('workflow')
@@ -472,7 +445,6 @@ def get_centrality_by_sparsity(ts_normd, method_option, threshold, block_size):
 
     # Init eigenvector centrality outputs
     if method_option == 'eigenvector':
-        r_matrix = np.zeros((nvoxs,nvoxs), dtype = ts_normd.dtype)
         # Init output map
         eigen_binarize = np.zeros(nvoxs, dtype=ts_normd.dtype)
         out_list.append(('eigenvector_centrality_binarize', eigen_binarize))
@@ -480,100 +452,39 @@ def get_centrality_by_sparsity(ts_normd, method_option, threshold, block_size):
         eigen_weighted = np.zeros(nvoxs, dtype=ts_normd.dtype)
         out_list.append(('eigenvector_centrality_weighted', eigen_weighted))
 
-    # Get the number of connections to keep
-    sparse_num = np.round((nvoxs**2-nvoxs)*threshold/2.0)
-
-    # Prepare to loop through and calculate correlation matrix
-    n = 0
-    m = block_size
-    block_no = 1
-    r_value = -1
-
-    # Init wij list
-    z = np.array([])
-    wij_global = np.rec.fromarrays([z.astype(ts_normd.dtype),
-                                    z.astype('int32'),
-                                    z.astype('int32')])
-    # Form the initial blockwise mask (to only grab upper triangle of data)
-    block_triu = np.triu(np.ones((block_size,block_size)), k=1).astype('bool')
-    block_rect = np.ones((block_size,nvoxs-block_size), dtype='bool')
-    block_mask = np.concatenate((block_triu,block_rect), axis=1)
-
-    # Delete matrices to save memory
-    del block_triu, block_rect
-    # Calculate correlations step - prune connections for degree
-    while n <= nvoxs:
-        # First, compute block of correlation matrix
-        logger.info('running block %d: rows %d thru %d' % (block_no, n, m-1))
-        # Calculate wij over entire matrix by block
-        # Do this for both deg and eig, more efficient way to compute r_value
-        rmat_block = np.dot(ts_normd[:,n:m].T,
-                            ts_normd[:,n:])
-        # Shrink block_mask down on every iteration after the first block
-        if n > 0:
-            block_mask = block_mask[:,:-block_size]
-
-        # Get elements as an array
-        rmat_block = rmat_block[block_mask]
-        thr_idx = np.where(rmat_block >= r_value)
-        rmat_block = rmat_block[thr_idx]
-        logger.info('number of passing correlations is %d' % len(rmat_block))
-
-        # Add global offset to indicies
-        idx = np.where(block_mask)
-        i = idx[0][thr_idx].astype('int32') + n
-        j = idx[1][thr_idx].astype('int32') + n
-
-        # Free some memory
-        del idx, thr_idx
-        w_global = np.concatenate([wij_global.f0,rmat_block])
-        i_global = np.concatenate([wij_global.f1,i])
-        j_global = np.concatenate([wij_global.f2,j])
-        # Free some memory
-        del i,j,rmat_block
-        # Grab indices and weights that pass and combine into list
-        wij_global = np.rec.fromarrays([w_global,i_global,j_global])
-        # Free some memory
-        del w_global, i_global, j_global
-
-        # Pass these into the global set and sort (ascending) by correlation
-        logger.info('sorting list...')
-        wij_global.sort()
-        # And trim list if it's greater than the number of connections we want
-        if len(wij_global) > sparse_num:
-            wij_global = wij_global[-sparse_num:]
-        r_value = wij_global[0][0]
-
-        # If we're doing eigen, store block into full matrix
-        if method_option == 'eigenvector':
-            r_matrix[n:m] = np.dot(ts_normd[:,n:m].T, ts_normd)
-
-        # Move next block start point up to last block finish point
-        n = m
-        # If we finished at nvoxs last time, break the loop
-        if n == nvoxs:
-            break
-        # Else, if our next block runs over nvoxs, limit it to nvoxs
-        elif (m+block_size) > nvoxs:
-            m = nvoxs
-        # Else, just increment end of next block by block_size
-        else:
-            m += block_size
-        # Increment block number
-        block_no += 1
+    # Init the fixed-capacity list of the top sparse_num (w,i,j) connections
+    conns = {
+        'sparse_num' : int(np.round((nvoxs**2-nvoxs)*threshold/2.0)),
+        'r_value' : -1,
+        'w' : np.array([], dtype=ts_normd.dtype),
+        'i' : np.array([], dtype='int32'),
+        'j' : np.array([], dtype='int32')
+    }
+    conns_lock = threading.Lock()
+
+    def collect_top_conns(rmat, n, p):
+        with conns_lock:
+            update_top_connections(conns, rmat, n, p)
+
+    # Calculate correlations step - prune connections for degree over the
+    # tiles of the upper triangle of the correlation matrix
+    # Do this for both deg and eig, more efficient way to compute r_value
+    tile_size = min(block_size, max(nvoxs//num_threads, 1))
+    logger.info('...calculating sparsity threshold over tiles of %d voxels'
+                % tile_size)
+    core.tiled_degree_centrality(ts_normd, [], tile_size, num_threads,
+                                 collect_top_conns)
+    r_value = conns['r_value']
+    w_top, i_top, j_top = conns.pop('w'), conns.pop('i'), conns.pop('j')
 
     # Calculate centrality step
     # Degree - use ijw list to create a sparse matrix
     if method_option == 'degree':
         # Create sparse (symmetric) matrix of all correlations that survived
         logger.info('creating sparse matrix')
-        # Extract the weights and indices from the global list
-        w = wij_global.f0
-        i = wij_global.f1
-        j = wij_global.f2
-        del wij_global
         # Create sparse correlation matrix (upper tri) from wij's
-        Rsp = sp.sparse.coo_matrix((w,(i,j)), shape=(nvoxs,nvoxs))
+        Rsp = sp.sparse.coo_matrix((w_top,(i_top,j_top)), shape=(nvoxs,nvoxs))
+        del w_top, i_top, j_top
         Rsp = Rsp + Rsp.T
         # And compute degree centrality on compressed row matrix
         Rcsr = Rsp.tocsr()
@@ -584,22 +495,198 @@ def get_centrality_by_sparsity(ts_normd, method_option, threshold, block_size):
 
     # Eigenvector - compute the r value from entire matrix
     if method_option == 'eigenvector':
-        del wij_global
-        # Finally compute centrality using full matrix and r_value
+        del w_top, i_top, j_top
+        # Finally compute centrality using the r_value over the whole matrix
         logger.info('...calculating binarize eigenvector')
         eigen_binarize[:] = \
-            core.eigenvector_centrality(copy.deepcopy(r_matrix), r_value,
-                                        method='binarize').squeeze()
+            core.matrix_free_eigenvector_centrality(ts_normd, r_value,
+                                                    'binarize', block_size,
+                                                    num_threads).squeeze()
         logger.info('...calculating weighted eigenvector')
         eigen_weighted[:] = \
-            core.eigenvector_centrality(r_matrix, r_value,
-                                        method='weighted').squeeze()
-        del r_matrix
+            core.matrix_free_eigenvector_centrality(ts_normd, r_value,
+                                                    'weighted', block_size,
+                                                    num_threads).squeeze()
 
     # Return list of outputs
     return out_list
 
 
+# Function to calculate several centrality measures in one pass
+def get_centrality_multi(ts_normd, template, measures, block_size,
+                         num_threads=1):
+    '''
+    Method to calculate degree/eigenvector centrality and lFCD for several
+    (method, threshold) pairs, computing each tile of the correlation
+    matrix only once
+
+    Every tile of the upper triangle feeds the binarized and weighted degree
+    of each correlation threshold (see `core.tiled_degree_centrality`) and
+    the running top connections of each sparsity threshold. Eigenvector
+    centrality and lFCD, which compute their own correlations, are run once
+    the tile pass has found their r-values.
+
+    Parameters
+    ----------
+    ts_normd : ndarray
+        timeseries of shape (ntpts x nvoxs) that is normalized; i.e. the data
+        is demeaned and divided by its L2-norm
+    template : ndarray
+        three dimensional array with non-zero elements corresponding to the
+        indices at which the lFCD metric is analyzed
+    measures : list of tuples (string, string, float)
+        (method_option, threshold_option, threshold) of each measure;
+        method_option is 'degree', 'eigenvector' or 'lfcd' and
+        threshold_option is 'correlation' or 'sparsity'
+    block_size : an integer
+        the number of rows (voxels) to compute timeseries correlation over
+        at any one time
+    num_threads : an integer
+        the number of tiles (degree and sparsity), blocks (eigenvector) or
+        seed ranges (lFCD) computed in parallel
+
+    Returns
+    -------
+    out_lists : list of lists (string, ndarray)
+        for each measure, the output of `get_centrality_by_rvalue` or
+        `get_centrality_by_sparsity` with the same arguments
+    '''
+
+    # Import packages
+    import threading
+    import numpy as np
+    import scipy as sp
+    from nipype import logging
+
+    import CPAC.network_centrality.core as core
+    from CPAC.network_centrality.utils import update_top_connections
+
+    # Init variables
+    logger = logging.getLogger('workflow')
+    nvoxs = ts_normd.shape[1]
+
+    # Correlation thresholds of degree and sparsity levels of all measures
+    degree_rvalues = sorted(set([threshold for method_option, threshold_option,
+                                 threshold in measures
+                                 if method_option == 'degree' and
+                                 threshold_option == 'correlation']))
+    sparsities = sorted(set([threshold for method_option, threshold_option,
+                             threshold in measures
+                             if threshold_option == 'sparsity']))
+
+    # Init the top (w,i,j) connections and running r-value of each sparsity
+    top_conns = {}
+    for sparsity in sparsities:
+        top_conns[sparsity] = {
+            'sparse_num' : int(np.round((nvoxs**2-nvoxs)*sparsity/2.0)),
+            'r_value' : -1,
+            'w' : np.array([], dtype=ts_normd.dtype),
+            'i' : np.array([], dtype='int32'),
+            'j' : np.array([], dtype='int32')
+        }
+    conns_lock = threading.Lock()
+
+    def collect_top_conns(rmat, n, p):
+        with conns_lock:
+            for sparsity in sparsities:
+                update_top_connections(top_conns[sparsity], rmat, n, p)
+
+    # Calculate each tile of the upper triangle of the correlation matrix
+    # once, with the tiles of get_centrality_by_rvalue: each tile is
+    # thresholded and summed for the degree of every r-value, as in the
+    # separate runs, then feeds the top connections of every sparsity
+    # (eigenvector and lFCD compute their own correlations, see below)
+    degree_maps = {}
+    if degree_rvalues or sparsities:
+        tile_size = min(block_size, max(nvoxs//num_threads, 1))
+        logger.info('...calculating degree and sparsity thresholds over '
+                    'tiles of %d voxels' % tile_size)
+        degrees = core.tiled_degree_centrality(ts_normd, degree_rvalues,
+                                               tile_size, num_threads,
+                                               collect_top_conns
+                                               if sparsities else None)
+        degree_maps = dict(zip(degree_rvalues, degrees))
+
+    # Sparsity degree - use ijw list to create a sparse matrix
+    for sparsity in sparsities:
+        if ('degree', 'sparsity', sparsity) not in \
+           [tuple(measure) for measure in measures]:
+            continue
+        conns = top_conns[sparsity]
+        logger.info('creating sparse matrix')
+        Rsp = sp.sparse.coo_matrix((conns['w'],(conns['i'],conns['j'])),
+                                   shape=(nvoxs,nvoxs))
+        Rsp = Rsp + Rsp.T
+        Rcsr = Rsp.tocsr()
+        del Rsp
+        degree_maps[('sparsity', sparsity)] = \
+            (np.array((Rcsr > 0).sum(axis=0), dtype=ts_normd.dtype).ravel(),
+             np.array(Rcsr.sum(axis=0), dtype=ts_normd.dtype).ravel())
+        del Rcsr
+    # Only the r-values of the sparsity levels are needed from now on
+    sparsity_rvalues = dict([(sparsity, top_conns[sparsity]['r_value'])
+                             for sparsity in sparsities])
+    top_conns.clear()
+
+    # Gather the outputs of each measure
+    out_lists = []
+    eigen_maps = {}
+    lfcd_maps = {}
+    for method_option, threshold_option, threshold in measures:
+        if threshold_option == 'sparsity':
+            r_value = sparsity_rvalues[threshold]
+        else:
+            r_value = threshold
+
+        if method_option == 'degree':
+            if threshold_option == 'sparsity':
+                degree_binarize, degree_weighted = \
+                    degree_maps[('sparsity', threshold)]
+            else:
+                degree_binarize, degree_weighted = degree_maps[r_value]
+            out_lists.append([('degree_centrality_binarize', degree_binarize),
+                              ('degree_centrality_weighted', degree_weighted)])
+
+        elif method_option == 'eigenvector':
+            if r_value not in eigen_maps:
+                logger.info('...calculating binarize eigenvector')
+                eigen_binarize = \
+                    core.matrix_free_eigenvector_centrality(ts_normd, r_value,
+                                                            'binarize',
+                                                            block_size,
+                                                            num_threads)
+                logger.info('...calculating weighted eigenvector')
+                eigen_weighted = \
+                    core.matrix_free_eigenvector_centrality(ts_normd, r_value,
+                                                            'weighted',
+                                                            block_size,
+                                                            num_threads)
+                eigen_maps[r_value] = \
+                    (eigen_binarize.squeeze().astype(ts_normd.dtype),
+                     eigen_weighted.squeeze().astype(ts_normd.dtype))
+            eigen_binarize, eigen_weighted = eigen_maps[r_value]
+            out_lists.append([('eigenvector_centrality_binarize', eigen_binarize),
+                              ('eigenvector_centrality_weighted', eigen_weighted)])
+
+        elif method_option == 'lfcd':
+            if r_value not in lfcd_maps:
+                logger.info('...iterating through seeds - lfcd')
+                lfcd_binarize, lfcd_weighted = \
+                    core.local_functional_connectivity_density(ts_normd,
+                                                               template,
+                                                               r_value,
+                                                               num_threads)
+                lfcd_maps[r_value] = \
+                    (lfcd_binarize.astype(ts_normd.dtype),
+                     lfcd_weighted.astype(ts_normd.dtype))
+            lfcd_binarize, lfcd_weighted = lfcd_maps[r_value]
+            out_lists.append([('lfcd_binarize', lfcd_binarize),
+                              ('lfcd_weighted', lfcd_weighted)])
+
+    # Return list of outputs of each measure
+    return out_lists
+
+
 # Function to calculated a quick centrality measure
 def get_centrality_fast(timeseries,
                         method_options):
@@ -675,7 +762,7 @@ def get_centrality_fast(timeseries,
 
 # Main centrality function utilized by the centrality workflow
 def calc_centrality(in_file, template, method_option, threshold_option,
-                    threshold, allocated_memory):
+                    threshold, allocated_memory, num_threads=1):
     '''
     Function to calculate centrality and map them to a nifti file
     
@@ -694,6 +781,8 @@ def calc_centrality(in_file, template, method_option, threshold_option,
         pvalue/sparsity_threshold/threshold value
     allocated_memory : string
         amount of memory allocated to degree centrality
+    num_threads : integer
+        number of correlation blocks computed in parallel (eigenvector)
     
     Returns
     -------
@@ -724,10 +813,11 @@ def calc_centrality(in_file, template, method_option, threshold_option,
     if method_option == 'degree' and threshold_option == 'sparsity':
         block_size = calc_blocksize(ts, memory_allocated=allocated_memory,
                                     sparsity_thresh=threshold)
-    # Otherwise
+    # Eigenvector is matrix-free, but holds one block per thread
     elif method_option == 'eigenvector':
         block_size = calc_blocksize(ts, memory_allocated=allocated_memory,
-                                    include_full_matrix=True)
+                                    include_full_matrix=False)
+        block_size = max(block_size//num_threads, 1)
     # Otherwise, compute blocksize with regards to available memory
     else:
         block_size = calc_blocksize(ts, memory_allocated=allocated_memory,
@@ -742,20 +832,23 @@ def calc_centrality(in_file, template, method_option, threshold_option,
                                                      mask,
                                                      method_option,
                                                      r_value,
-                                                     block_size)
+                                                     block_size,
+                                                     num_threads)
     # Sparsity threshold
     elif threshold_option == 'sparsity':
         centrality_matrix = get_centrality_by_sparsity(ts_normd,
                                                        method_option,
                                                        threshold,
-                                                       block_size)
+                                                       block_size,
+                                                       num_threads)
     # R-value threshold centrality
     elif threshold_option == 'correlation':
         centrality_matrix = get_centrality_by_rvalue(ts_normd,
                                                      mask,
                                                      method_option,
                                                      threshold,
-                                                     block_size)
+                                                     block_size,
+                                                     num_threads)
     # For fast approach (no thresholding)
     elif threshold_option == 3:
         centrality_matrix = get_centrality_fast(ts, method_option)
@@ -773,3 +866,92 @@ def calc_centrality(in_file, template, method_option, threshold_option,
 
     # Finally return
     return out_list
+
+
+# Centrality function for several measures/thresholds of the same data
+def calc_centrality_multi(in_file, template, measures, allocated_memory,
+                          num_threads=1):
+    '''
+    Function to calculate several centrality measures in a single pass over
+    the correlation matrix and map them to nifti files
+
+    Parameters
+    ----------
+    in_file : string (nifti file)
+        path to subject data file
+    template : string (nifti file)
+        path to mask/parcellation unit
+    measures : list of tuples
+        (method_option, threshold_option, threshold) of each measure, as
+        accepted by `calc_centrality`
+    allocated_memory : string
+        amount of memory allocated to degree centrality
+    num_threads : integer
+        number of correlation blocks computed in parallel (eigenvector)
+
+    Returns
+    -------
+    out_list : list
+        list containing out mapped centrality images; the threshold option
+        and value are appended to the name of each image
+    '''
+
+    # Import packages
+    from CPAC.network_centrality import load,\
+                                        get_centrality_multi,\
+                                        map_centrality_matrix,\
+                                        calc_blocksize,\
+                                        convert_pvalue_to_r
+    from CPAC.network_centrality.utils import check_centrality_params
+    from CPAC.cwas.subdist import norm_cols
+
+    # First check input parameters and get proper formatted method/thr options
+    checked_measures = []
+    for method_option, threshold_option, threshold in measures:
+        method_option, threshold_option = \
+            check_centrality_params(method_option, threshold_option, threshold)
+        checked_measures.append((method_option, threshold_option, threshold))
+
+    # Init variables
+    out_list = []
+    ts, aff, mask, t_type, scans = load(in_file, template)
+
+    # Every sparsity level keeps its own list of top connections
+    sparsity_thresh = sum(set([threshold for method_option, threshold_option,
+                               threshold in checked_measures
+                               if threshold_option == 'sparsity']))
+    block_size = calc_blocksize(ts, memory_allocated=allocated_memory,
+                                sparsity_thresh=sparsity_thresh)
+    # Eigenvector is matrix-free, but holds one block per thread
+    if 'eigenvector' in [measure[0] for measure in checked_measures]:
+        eigen_block_size = calc_blocksize(ts, memory_allocated=allocated_memory,
+                                          include_full_matrix=False)
+        block_size = min(block_size, max(eigen_block_size//num_threads, 1))
+    # Normalize the timeseries for easy dot-product correlation calc.
+    ts_normd = norm_cols(ts.T)
+
+    # P-value thresholds are converted to correlation thresholds
+    rvalue_measures = []
+    for method_option, threshold_option, threshold in checked_measures:
+        if threshold_option == 'significance':
+            r_value = convert_pvalue_to_r(in_file, threshold, two_tailed=False)
+            rvalue_measures.append((method_option, 'correlation', r_value))
+        else:
+            rvalue_measures.append((method_option, threshold_option, threshold))
+
+    centrality_matrices = get_centrality_multi(ts_normd, mask,
+                                               rvalue_measures, block_size,
+                                               num_threads)
+
+    # Map the arrays back to images, named after their threshold
+    for measure, centrality_matrix in zip(checked_measures,
+                                          centrality_matrices):
+        method_option, threshold_option, threshold = measure
+        suffix = ('_%s_%s' % (threshold_option, str(threshold))).replace('.', 'p')
+        for name, matrix in centrality_matrix:
+            centrality_image = map_centrality_matrix((name + suffix, matrix),
+                                                     aff, mask, t_type)
+            out_list.append(centrality_image)
+
+    # Finally return
+    return out_list
@@ -0,0 +1,160 @@
+"""
+This tests the functions in network_centrality/resting_state_centrality.py
+"""
+
+import numpy as np
+from numpy.testing import *
+
+from nose.plugins.attrib import attr    # http://nose.readthedocs.org/en/latest/plugins/attrib.html
+
+
+def simulate_normd_timeseries(ntpts=50, nvoxs=300, dtype='float32'):
+    ts_normd = np.random.standard_normal((ntpts, nvoxs)).astype(dtype)
+    ts_normd -= ts_normd.mean(0)
+    ts_normd /= np.sqrt((ts_normd**2).sum(0))
+    return ts_normd
+
+
+@attr('degree', 'sparsity')
+def test_degree_centrality_by_sparsity():
+    from CPAC.network_centrality import get_centrality_by_sparsity
+    
+    nvoxs       = 300
+    threshold   = 0.05
+    ts_normd    = simulate_normd_timeseries(nvoxs=nvoxs)
+    
+    # Reference: keep the top connections of the full (upper tri) matrix
+    r_matrix    = ts_normd.T.dot(ts_normd)
+    iu          = np.triu_indices(nvoxs, 1)
+    sparse_num  = int(np.round((nvoxs**2-nvoxs)*threshold/2.0))
+    top         = np.argsort(r_matrix[iu])[-sparse_num:]
+    ref         = np.zeros((nvoxs, nvoxs))
+    ref[iu[0][top],iu[1][top]] = r_matrix[iu][top]
+    ref         = ref + ref.T
+    
+    for block_size in [17, 100, nvoxs]:
+        comp = dict(get_centrality_by_sparsity(ts_normd, 'degree', threshold,
+                                               block_size))
+        assert_equal(comp['degree_centrality_binarize'], (ref > 0).sum(0))
+        assert_allclose(comp['degree_centrality_weighted'], ref.sum(0),
+                        rtol=1e-4)
+
+
+@attr('degree', 'correlation')
+def test_degree_centrality_by_rvalue():
+    from CPAC.network_centrality import get_centrality_by_rvalue
+    
+    nvoxs       = 300
+    r_value     = 0.2
+    
+    for dtype in ['float32', 'float64']:
+        ts_normd = simulate_normd_timeseries(nvoxs=nvoxs, dtype=dtype)
+        
+        # Reference: threshold the full matrix, without the diagonal
+        r_matrix = ts_normd.T.astype('float64').dot(ts_normd)
+        np.fill_diagonal(r_matrix, 0)
+        ref      = r_matrix*(r_matrix > r_value)
+        
+        for block_size in [17, 100, nvoxs]:
+            for num_threads in [1, 3]:
+                comp = dict(get_centrality_by_rvalue(ts_normd, None, 'degree',
+                                                     r_value, block_size,
+                                                     num_threads))
+                assert comp['degree_centrality_weighted'].dtype == dtype
+                # (single precision may flip a pair at the threshold)
+                assert_allclose(comp['degree_centrality_binarize'], 
+                                (ref > 0).sum(0), 
+                                atol=(dtype == 'float32'))
+                assert_allclose(comp['degree_centrality_weighted'], 
+                                ref.sum(0), rtol=1e-5, atol=0.3)
+
+
+@attr('eigenvector', 'centrality')
+def test_matrix_free_eigenvector_centrality():
+    from CPAC.network_centrality import eigenvector_centrality, \
+                                        matrix_free_eigenvector_centrality
+    
+    r_value     = 0.1
+    ts_normd    = simulate_normd_timeseries(dtype='float64')
+    
+    for method in ['binarize', 'weighted']:
+        r_matrix = ts_normd.T.dot(ts_normd)
+        ref  = eigenvector_centrality(r_matrix, r_value, method)
+        for num_threads in [1, 3]:
+            comp = matrix_free_eigenvector_centrality(ts_normd, r_value, 
+                                                      method, block_size=70,
+                                                      num_threads=num_threads)
+            assert_allclose(comp, ref, rtol=1e-6, atol=1e-8)
+
+
+@attr('lfcd', 'centrality')
+def test_local_functional_connectivity_density():
+    from scipy import ndimage
+    from CPAC.network_centrality.core import \
+        local_functional_connectivity_density
+    
+    r_value     = 0.05
+    template    = np.random.random((7, 8, 6)) > 0.2
+    xyz         = np.argwhere(template)
+    nvoxs       = len(xyz)
+    ts_normd    = simulate_normd_timeseries(ntpts=20, nvoxs=nvoxs, 
+                                            dtype='float64')
+    
+    # Reference: label the supra-threshold voxels of each seed's map
+    ref_bin     = np.zeros(nvoxs)
+    ref_wght    = np.zeros(nvoxs)
+    for seed in range(nvoxs):
+        corr_seed = ts_normd[:,seed].dot(ts_normd)
+        vol = np.zeros(template.shape, dtype='bool')
+        vol[template] = corr_seed > r_value
+        labels, nlabels = ndimage.label(vol, np.ones((3,3,3)))
+        cluster = labels[template] == labels[tuple(xyz[seed])]
+        if cluster.sum() > 1:
+            ref_bin[seed]  = cluster.sum()
+            ref_wght[seed] = corr_seed[cluster].sum()
+        else:
+            ref_bin[seed] = ref_wght[seed] = 1
+    
+    for num_threads in [1, 3]:
+        comp_bin, comp_wght = local_functional_connectivity_density(
+            ts_normd, template, r_value, num_threads)
+        assert_equal(comp_bin, ref_bin)
+        assert_allclose(comp_wght, ref_wght)
+
+
+@attr('degree', 'eigenvector', 'lfcd', 'centrality')
+def test_centrality_multi():
+    from CPAC.network_centrality import get_centrality_by_rvalue, \
+                                        get_centrality_by_sparsity, \
+                                        get_centrality_multi
+    
+    template    = np.random.random((7, 8, 6)) > 0.2
+    nvoxs       = template.sum()
+    # (float32, as loaded from the functional files)
+    ts_normd    = simulate_normd_timeseries(ntpts=20, nvoxs=nvoxs, 
+                                            dtype='float32')
+    measures    = [('degree', 'correlation', 0.1), 
+                   ('degree', 'correlation', 0.3), 
+                   ('degree', 'sparsity', 0.05), 
+                   ('eigenvector', 'sparsity', 0.05), 
+                   ('eigenvector', 'correlation', 0.3), 
+                   ('lfcd', 'correlation', 0.3)]
+    
+    for num_threads in [1, 3]:
+        comps = get_centrality_multi(ts_normd, template, measures, 23,
+                                     num_threads)
+        assert_equal(len(comps), len(measures))
+        
+        # Same maps, bit for bit, as the separate runs
+        for (method, thresh_option, thresh), comp in zip(measures, comps):
+            if thresh_option == 'sparsity':
+                ref = get_centrality_by_sparsity(ts_normd, method, thresh, 23,
+                                                 num_threads)
+            else:
+                ref = get_centrality_by_rvalue(ts_normd, template, method,
+                                               thresh, 23, num_threads)
+            assert_equal([ name for name,_ in comp ], 
+                         [ name for name,_ in ref ])
+            for (_, comp_map), (_, ref_map) in zip(comp, ref):
+                assert_equal(comp_map.dtype, ref_map.dtype)
+                assert_array_equal(comp_map, ref_map)
@@ -1,3 +1,5 @@
+cimport cython
+import numpy as np
 cimport numpy as np
 
 
@@ -89,16 +91,82 @@ def centrality_weighted_double(np.ndarray[double, ndim=2] cmat, np.ndarray[doubl
             cent[i] += cmat[i,j]*(cmat[i,j] > thresh)
 
 # Both - Unweighted & Weighted
-def centrality_both_float(np.ndarray[float, ndim=2] cmat, np.ndarray[float, ndim=1] cent_uwt, np.ndarray[float, ndim=1] cent_wt, float thresh):
+def centrality_both_float(np.ndarray[float, ndim=2] cmat, np.ndarray[float, ndim=1] cent_bin, np.ndarray[float, ndim=1] cent_wt, float thresh):
     cdef unsigned int i,j
     for i in xrange(cmat.shape[0]):
         for j in xrange(cmat.shape[1]):
-            cent_uwt[i] += cmat[i,j]*(cmat[i,j] > thresh)
-            cent_wt[i]  += 1.0*(cmat[i,j] > thresh)
+            cent_bin[i] += 1.0*(cmat[i,j] > thresh)
+            cent_wt[i]  += cmat[i,j]*(cmat[i,j] > thresh)
 
 def centrality_both_double(np.ndarray[double, ndim=2] cmat, np.ndarray[double, ndim=1] cent_bin, np.ndarray[double, ndim=1] cent_wt, double thresh):
     cdef unsigned int i,j
     for i in xrange(cmat.shape[0]):
         for j in xrange(cmat.shape[1]):
-            cent_bin[i] += cmat[i,j]*(cmat[i,j] > thresh)
-            cent_wt[i]  += 1.0*(cmat[i,j] > thresh)
+            cent_bin[i] += 1.0*(cmat[i,j] > thresh)
+            cent_wt[i]  += cmat[i,j]*(cmat[i,j] > thresh)
+
+
+###
+# Threshold and Sum of a tile of the correlation matrix (Degree Centrality)
+#
+# The tile holds the correlations of voxels row_start.. with voxels
+# col_start.. . Only the pairs in the upper triangle of the full matrix
+# (column voxel after row voxel) are counted, and each pair updates the
+# binarized and weighted degrees of both of its voxels, so the tiles on
+# and above the diagonal cover the whole matrix. The loops release the GIL
+# so tiles can be processed by parallel threads (with their own sums).
+###
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def degree_tile_float(float[:, ::1] rmat, int row_start, int col_start,
+                      float thresh, double[::1] cent_bin,
+                      double[::1] cent_wght):
+    cdef int nrows = rmat.shape[0]
+    cdef int ncols = rmat.shape[1]
+    cdef int i, j, j0
+    cdef double r, row_bin, row_wght
+
+    with nogil:
+        for i in range(nrows):
+            j0 = row_start + i + 1 - col_start
+            if j0 < 0:
+                j0 = 0
+            row_bin = 0
+            row_wght = 0
+            for j in range(j0, ncols):
+                r = rmat[i,j]
+                if r > thresh:
+                    row_bin = row_bin + 1
+                    row_wght = row_wght + r
+                    cent_bin[col_start+j] += 1
+                    cent_wght[col_start+j] += r
+            cent_bin[row_start+i] += row_bin
+            cent_wght[row_start+i] += row_wght
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def degree_tile_double(double[:, ::1] rmat, int row_start, int col_start,
+                       double thresh, double[::1] cent_bin,
+                       double[::1] cent_wght):
+    cdef int nrows = rmat.shape[0]
+    cdef int ncols = rmat.shape[1]
+    cdef int i, j, j0
+    cdef double r, row_bin, row_wght
+
+    with nogil:
+        for i in range(nrows):
+            j0 = row_start + i + 1 - col_start
+            if j0 < 0:
+                j0 = 0
+            row_bin = 0
+            row_wght = 0
+            for j in range(j0, ncols):
+                r = rmat[i,j]
+                if r > thresh:
+                    row_bin = row_bin + 1
+                    row_wght = row_wght + r
+                    cent_bin[col_start+j] += 1
+                    cent_wght[col_start+j] += r
+            cent_bin[row_start+i] += row_bin
+            cent_wght[row_start+i] += row_wght
@@ -60,6 +60,11 @@ def calc_blocksize(timeseries, memory_allocated=None,
     else:
         memory_for_full_matrix = 0
 
+    # Number of connections kept by sparsity thresholding
+    sparse_num = int(np.round((nvoxs**2-nvoxs)*sparsity_thresh/2.0))
+    memory_for_top_k = 0
+    memory_per_corr = nbytes
+
     # Memory variables
     memory_for_timeseries   = nvoxs * ntpts * nbytes
     memory_for_output       = 2 * nvoxs * nbytes    # bin and wght outputs
@@ -73,33 +78,20 @@ def calc_blocksize(timeseries, memory_allocated=None,
         block_size = int( (available_memory - needed_memory)/(nvoxs*nbytes) )
         # If we're doing degree/sparisty thresholding, calculate block_size
         if sparsity_thresh:
-            # k - block_size, v - nvoxs, d - nbytes, m - memory_allocated
-            # Polynomial for sparsity algorithm memory usage
-            # Solve for k: (-d/2 - 20.5)*k^2 + (41*v + d*v -d/2 - 20.5)*k - m = 0
-            coeffs = np.zeros(3)
-            coeffs[0] = -nbytes/2 - 20.5
-            coeffs[1] = 41*nvoxs + nbytes*nvoxs - nbytes/2 - 20.5
-            coeffs[2] = -(available_memory - needed_memory)
-            roots = np.roots(coeffs)
-            # If roots are complex, then the block_size needed to occupy all of
-            # the available memory is bigger than the number of voxels.
-            # So set block_size = nvoxs
-            if np.iscomplex(roots[0]):
-                block_size = nvoxs
-            # If the roots are real, test the roots for condition
-            else:
-                root = roots[np.where(roots <= nvoxs)]
-                root = root[np.where(root > 0)]
-                if len(root) == 1:
-                    block_size = np.floor(root[0])
-                else:
-                    block_size = 1000
+            # The top-k list of (w,i,j) connections is kept at all times
+            memory_for_top_k = sparse_num * (nbytes + 4 + 4)
+            # Per correlation in a block: the correlation, the threshold mask,
+            # its (64-bit) flat index and the passing (w,i,j) candidates
+            memory_per_corr = 2*nbytes + 1 + 8 + 4 + 4
+            block_size = int( (available_memory - needed_memory - \
+                               memory_for_top_k)/(nvoxs*memory_per_corr) )
 
     # Test if calculated block size is beyond max/min limits
     if block_size > nvoxs:
         block_size = nvoxs
     elif block_size < 1:
-        memory_usage = (needed_memory + 2.0*nvoxs*nbytes)/1024.0**3
+        memory_usage = (needed_memory + memory_for_top_k + \
+                        2.0*nvoxs*memory_per_corr)/1024.0**3
         raise MemoryError('Not enough memory available to perform degree '\
                           'centrality. Need a minimum of %.2fGB' % memory_usage)
 
@@ -108,16 +100,8 @@ def calc_blocksize(timeseries, memory_allocated=None,
 
     # Return memory usage and block size
     if sparsity_thresh:
-        # Calculate RAM usage by blocking algorithm
-        m = (-nbytes/2 - 20.5)*block_size**2 + \
-            (41*nvoxs + nbytes*nvoxs - nbytes/2 - 20.5)*block_size
-        # Calculate RAM usage by sparse matrix at end
-        max_conns = nvoxs**2-nvoxs
-        # Max number of connections * i + j (32-bit ints) + w
-        m2 = np.round(max_conns*sparsity_thresh)*(4 + 4 + nbytes)
-        if m2 > m:
-            m = m2
-        memory_usage = (needed_memory + m)/1024.0**3
+        memory_usage = (needed_memory + memory_for_top_k + \
+                        block_size*nvoxs*memory_per_corr)/1024.0**3
     else:
         memory_usage = (needed_memory + block_size*nvoxs*nbytes)/1024.0**3
 
@@ -173,6 +157,84 @@ def calc_corrcoef(X, Y=None):
     return r
 
 
+# Method to select the strongest connections (used in sparsity thresholding)
+def select_top_k(weights, k):
+    '''
+    Method to find the indices of the `k` largest weights, using a
+    partial selection instead of sorting the whole array
+
+    Parameters
+    ----------
+    weights : numpy array
+        one dimensional array of connection weights
+    k : integer
+        number of weights to select
+
+    Returns
+    -------
+    top_idx : numpy array
+        (unordered) indices of the `k` largest weights
+    '''
+
+    # Import packages
+    import numpy as np
+
+    nweights = len(weights)
+
+    if k <= 0:
+        return np.array([], dtype='int64')
+    elif k >= nweights:
+        return np.arange(nweights)
+
+    return np.argpartition(weights, nweights-k)[nweights-k:]
+
+
+def update_top_connections(conns, rmat, n, p):
+    '''
+    Method to add the connections of a tile of the correlation matrix to
+    the running list of the top connections of a sparsity threshold
+
+    Parameters
+    ----------
+    conns : dictionary
+        top connections, with keys 'sparse_num' (number of connections to
+        keep), 'r_value' (running threshold) and 'w', 'i', 'j' (weights and
+        row/column indices of the connections); updated in place
+    rmat : numpy array
+        tile of the correlation matrix, starting at row `n` and column `p`;
+        on the diagonal (`n` == `p`), its lower triangle is set to -inf so
+        only the upper triangle (without the diagonal) is used
+    n : integer
+        first row of the tile
+    p : integer
+        first column of the tile
+    '''
+
+    # Import packages
+    import numpy as np
+
+    if p == n:
+        rmat[np.tril_indices(rmat.shape[0])] = -np.inf
+
+    # Get the connections passing the running threshold
+    i, j = np.nonzero(rmat >= conns['r_value'])
+    conns['w'] = np.concatenate([conns['w'], rmat[i,j]])
+    conns['i'] = np.concatenate([conns['i'], i.astype('int32') + n])
+    conns['j'] = np.concatenate([conns['j'], j.astype('int32') + p])
+    del i, j
+
+    # Keep the top sparse_num connections (partial selection, no sort)
+    if len(conns['w']) > conns['sparse_num']:
+        keep = select_top_k(conns['w'], conns['sparse_num'])
+        conns['w'] = conns['w'][keep]
+        conns['i'] = conns['i'][keep]
+        conns['j'] = conns['j'][keep]
+        del keep
+    # Once the list is full, only stronger connections can get in
+    if len(conns['w']) == conns['sparse_num'] and conns['sparse_num'] > 0:
+        conns['r_value'] = conns['w'].min()
+
+
 # Method to cluster the data (used in lFCD)
 def cluster_data(img, thr, xyz_a, k=26):
     '''docstring for cluster_data'''
@@ -199,6 +261,45 @@ def cluster_data(img, thr, xyz_a, k=26):
     return lbl_img
 
 
+# Method to build the neighbour index of the voxels (used in lFCD)
+def neighbour_index(xyz, k=26):
+    '''
+    Method to build a compressed (CSR-like) neighbour index of the voxels
+    of a grid, so that the neighbours of voxel `v` are
+    `indices[indptr[v]:indptr[v+1]]`
+
+    Parameters
+    ----------
+    xyz : numpy array
+        array of shape (nvoxs, 3); grid coordinates of the voxels
+    k : integer
+        neighboring system, equal to 6, 18, or 26
+
+    Returns
+    -------
+    indptr : numpy array
+        int32 array of shape (nvoxs+1)
+    indices : numpy array
+        int32 array with the neighbours of every voxel
+    '''
+
+    # Import packages
+    import numpy as np
+
+    nvoxs = xyz.shape[0]
+    edges = graph_3d_grid(xyz, k=k)
+    if edges is None:
+        return np.zeros(nvoxs+1, dtype='int32'), np.array([], dtype='int32')
+    i, j, d = edges
+
+    order = np.argsort(i, kind='mergesort')
+    indices = j[order].astype('int32')
+    indptr = np.zeros(nvoxs+1, dtype='int32')
+    indptr[1:] = np.cumsum(np.bincount(i, minlength=nvoxs))
+
+    return indptr, indices
+
+
 # Convert probability threshold value to correlation threshold
 def convert_pvalue_to_r(datafile, p_value, two_tailed=False):
     '''
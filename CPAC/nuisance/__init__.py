@@ -1,14 +1,28 @@
 from utils import calc_compcor_components, \
-                  erode_mask
+                  erode_mask, \
+                  bandpass_frequency_mask, \
+                  ideal_bandpass, \
+                  masked_timeseries, \
+                  nuisance_basis, \
+                  regress_out, \
+                  pca_components
 
 from nuisance import create_nuisance, \
                      calc_residuals, \
+                     regress_nuisance, \
                      bandpass_voxels, \
                      extract_tissue_data
 
 __all__ = ['create_nuisance', \
            'calc_residuals', \
+           'regress_nuisance', \
            'bandpass_voxels', \
            'calc_compcor_components', \
            'erode_mask', \
+           'bandpass_frequency_mask', \
+           'ideal_bandpass', \
+           'masked_timeseries', \
+           'nuisance_basis', \
+           'regress_out', \
+           'pca_components', \
            'extract_tissue_data']
\ No newline at end of file
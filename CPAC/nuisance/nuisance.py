@@ -6,7 +6,8 @@ import nipype.interfaces.ants as ants
 #from nipype import logging
 #logger = logging.getLogger('workflow')
 
-def bandpass_voxels(realigned_file, bandpass_freqs, sample_period = None):
+def bandpass_voxels(realigned_file, bandpass_freqs, sample_period = None,
+                    memory_limit = None, dtype = None):
     """
     Performs ideal bandpass filtering on each voxel time-series.
     
@@ -19,6 +20,13 @@ def bandpass_voxels(realigned_file, bandpass_freqs, sample_period = None):
     sample_period : float, optional
         Length of sampling period in seconds.  If not specified,
         this value is read from the nifti file provided.
+    memory_limit : float, optional
+        Memory in GB used to filter each chunk of voxels
+        (see `CPAC.nuisance.utils.ideal_bandpass`).
+    dtype : string, optional
+        Precision of the filtering and of the output file, 'float64' or
+        'float32'. By default, the data is filtered in double precision and
+        written with the data type of the input file.
         
     Returns
     -------
@@ -30,56 +38,16 @@ def bandpass_voxels(realigned_file, bandpass_freqs, sample_period = None):
     import os
     import nibabel as nb
     import numpy as np
+    from CPAC.nuisance.utils import ideal_bandpass
+    from CPAC.utils.data_cache import load_masked_data
 
-    def ideal_bandpass(data, sample_period, bandpass_freqs):
-        #Derived from YAN Chao-Gan 120504 based on REST.
-        from scipy.fftpack import fft, ifft
-        
-    #    sample_period = T
-    #    LowCutoff = 10.
-    #    HighCutoff = 15.
-    #    data = x
-        
-        def nextpow2(n):
-            x = np.log2(n)
-            return 2**np.ceil(x)
-        
-        sample_freq = 1./sample_period
-        sample_length = data.shape[0]
-        
-        data_p = np.zeros(nextpow2(sample_length))
-        data_p[:sample_length] = data
-        
-        LowCutoff, HighCutoff = bandpass_freqs
-        
-        if(LowCutoff is None): #No lower cutoff (low-pass filter)
-            low_cutoff_i = 0
-        elif(LowCutoff > sample_freq/2.): #Cutoff beyond fs/2 (all-stop filter)
-            low_cutoff_i = int(data_p.shape[0]/2)
-        else:
-            low_cutoff_i = np.ceil(LowCutoff*data_p.shape[0]*sample_period).astype('int')
-        
-        if(HighCutoff > sample_freq/2. or HighCutoff is None): #Cutoff beyond fs/2 or unspecified (become a highpass filter)
-            high_cutoff_i = int(data_p.shape[0]/2)
-        else:
-            high_cutoff_i = np.fix(HighCutoff*data_p.shape[0]*sample_period).astype('int')
-        
-        freq_mask = np.zeros_like(data_p, dtype='bool')
-        freq_mask[low_cutoff_i:high_cutoff_i+1] = True
-        freq_mask[data_p.shape[0]-high_cutoff_i:data_p.shape[0]+1-low_cutoff_i] = True
-        
-        
-        f_data = fft(data_p)
-        f_data[freq_mask != True] = 0.
-        data_bp = np.real_if_close(ifft(f_data)[:sample_length])
-        
-        return data_bp
-
+    # Demean and filter only the timeseries of the voxels in the data mask
     nii = nb.load(realigned_file)
-    data = nii.get_data().astype('float64')
-    mask = (data != 0).sum(-1) != 0
-    Y = data[mask].T
-    Yc = Y - np.tile(Y.mean(0), (Y.shape[0], 1))
+    out_dtype = dtype or nii.get_data_dtype()
+    dtype = dtype or 'float64'
+    mask, Y = load_masked_data(realigned_file)
+    Y = np.array(Y.T, dtype=dtype)
+    Y -= Y.mean(0)
     
     if not sample_period:
         hdr = nii.get_header()
@@ -90,12 +58,14 @@ def bandpass_voxels(realigned_file, bandpass_freqs, sample_period = None):
 
     print 'Frequency filtering using sample period: ', sample_period, 'sec'
 
-    Y_bp = np.zeros_like(Y)
-    for j in range(Y.shape[1]):
-        Y_bp[:,j] = ideal_bandpass(Yc[:,j], sample_period, bandpass_freqs)
+    Y_bp = ideal_bandpass(Y, sample_period, bandpass_freqs, memory_limit)
+    del Y
         
+    data = np.zeros(nii.shape, dtype=dtype)
     data[mask] = Y_bp.T
+    del Y_bp
     img = nb.Nifti1Image(data, header=nii.get_header(), affine=nii.get_affine())
+    img.set_data_dtype(out_dtype)
     bandpassed_file = os.path.join(os.getcwd(), 'bandpassed_demeaned_filtered.nii.gz')
     img.to_filename(bandpassed_file)
     
@@ -107,7 +77,8 @@ def calc_residuals(subject,
                    csf_sig_file = None,
                    gm_sig_file = None,
                    motion_file = None,
-                   compcor_ncomponents = 0):
+                   compcor_ncomponents = 0,
+                   dtype = None):
     """
     Calculates residuals of nuisance regressors for every voxel for a subject.
     
@@ -126,6 +97,10 @@ def calc_residuals(subject,
         Path to subject's grey matter mask (in the same space as the subject's functional file)
     compcor_ncomponents : integer, optional
         The first `n` principal of CompCor components to use as regressors.  Default is 0.
+    dtype : string, optional
+        Precision of the regression and of the residual file, 'float64' or
+        'float32'. By default, the regression is done in double precision
+        and the residuals are written with the data type of the input file.
         
     Returns
     -------
@@ -134,6 +109,9 @@ def calc_residuals(subject,
     regressors_file : string
         Path of csv file of regressors used.  Filename corresponds to the name of each
         regressor in each column.
+    basis_file : string
+        Path of the orthonormal basis of the regressors (npy file), to apply
+        the same design to other files with `regress_nuisance`.
         
     Notes
     -----
@@ -157,44 +135,51 @@ def calc_residuals(subject,
     import os
     import scipy
     from CPAC.nuisance import calc_compcor_components
+    from CPAC.nuisance.utils import nuisance_basis, \
+                                    regress_out, \
+                                    pca_components
+    from CPAC.utils.data_cache import load_masked_data
     
     
+    # Regress the nuisance signals out of the voxels in the data mask
     nii = nb.load(subject)
-    data = nii.get_data().astype(np.float64)
-    global_mask = (data != 0).sum(-1) != 0
+    out_dtype = dtype or nii.get_data_dtype()
+    dtype = dtype or 'float64'
+    global_mask, Y = load_masked_data(subject)
+    Y = np.array(Y.T, dtype=dtype)
     
     
     #Check and define regressors which are provided from files
     if wm_sig_file is not None:
-        wm_sigs = np.load(wm_sig_file)
-        if wm_sigs.shape[1] != data.shape[3]:
-            raise ValueError('White matter signals length %d do not match data timepoints %d' % (wm_sigs.shape[1], data.shape[3]))
+        wm_sigs = np.load(wm_sig_file).astype(np.float64)
+        if wm_sigs.shape[1] != nii.shape[3]:
+            raise ValueError('White matter signals length %d do not match data timepoints %d' % (wm_sigs.shape[1], nii.shape[3]))
         if wm_sigs.size == 0:
             raise ValueError('White matter signal file %s is empty'%(wm_sig_file))
     if csf_sig_file is not None:
-        csf_sigs = np.load(csf_sig_file)
-        if csf_sigs.shape[1] != data.shape[3]:
-            raise ValueError('CSF signals length %d do not match data timepoints %d' % (csf_sigs.shape[1], data.shape[3]))
+        csf_sigs = np.load(csf_sig_file).astype(np.float64)
+        if csf_sigs.shape[1] != nii.shape[3]:
+            raise ValueError('CSF signals length %d do not match data timepoints %d' % (csf_sigs.shape[1], nii.shape[3]))
         if csf_sigs.size == 0:
             raise ValueError('CSF signal file %s is empty'%(csf_sig_file))
     if gm_sig_file is not None:
-        gm_sigs = np.load(gm_sig_file)
-        if gm_sigs.shape[1] != data.shape[3]:
-            raise ValueError('Grey matter signals length %d do not match data timepoints %d' % (gm_sigs.shape[1], data.shape[3]))
+        gm_sigs = np.load(gm_sig_file).astype(np.float64)
+        if gm_sigs.shape[1] != nii.shape[3]:
+            raise ValueError('Grey matter signals length %d do not match data timepoints %d' % (gm_sigs.shape[1], nii.shape[3]))
         if gm_sigs.size == 0:
             raise ValueError('Grey matter signal file %s is empty'%(gm_sig_file))
     if motion_file is not None:
         motion = np.genfromtxt(motion_file)
-        if motion.shape[0] != data.shape[3]:
-            raise ValueError('Motion parameters %d do not match data timepoints %d' % (motion.shape[0], data.shape[3]) )
+        if motion.shape[0] != nii.shape[3]:
+            raise ValueError('Motion parameters %d do not match data timepoints %d' % (motion.shape[0], nii.shape[3]) )
         if motion.size == 0:
             raise ValueError('Motion signal file %s is empty'%(motion_file))
 
     #Calculate regressors
-    regressor_map = {'constant' : np.ones((data.shape[3],1))}
+    regressor_map = {'constant' : np.ones((nii.shape[3],1))}
     if(selector['compcor']):
         print 'compcor_ncomponents ', compcor_ncomponents
-        regressor_map['compcor'] = calc_compcor_components(data, compcor_ncomponents, wm_sigs, csf_sigs)
+        regressor_map['compcor'] = calc_compcor_components(Y, compcor_ncomponents, wm_sigs, csf_sigs)
     
     if(selector['wm']):
         regressor_map['wm'] = wm_sigs.mean(0)
@@ -206,33 +191,25 @@ def calc_residuals(subject,
         regressor_map['gm'] = gm_sigs.mean(0)
         
     if(selector['global']):
-        regressor_map['global'] = data[global_mask].mean(0)
+        regressor_map['global'] = Y.mean(1, dtype=np.float64)
         
     if(selector['pc1']):
-        bdata = data[global_mask].T
-        bdatac = bdata - np.tile(bdata.mean(0), (bdata.shape[0], 1))
-        U, S, Vh = np.linalg.svd(bdatac, full_matrices=False)
-        regressor_map['pc1'] = U[:,0]
+        regressor_map['pc1'] = pca_components(Y, 1, center=True)[:,0]
         
     if(selector['motion']):
         regressor_map['motion'] = motion
         
     if(selector['linear']):
-        regressor_map['linear'] = np.arange(0, data.shape[3])
+        regressor_map['linear'] = np.arange(0, nii.shape[3])
     
     if(selector['quadratic']):
-        regressor_map['quadratic'] = np.arange(0, data.shape[3])**2
+        regressor_map['quadratic'] = np.arange(0, nii.shape[3])**2
     
     print 'Regressors include: ', regressor_map.keys()
     
-    X = np.zeros((data.shape[3], 1))
-    csv_filename = ''
-    for rname, rval in regressor_map.items():
-        X = np.hstack((X, rval.reshape(rval.shape[0],-1)))
-        csv_filename += '_' + rname
-    X = X[:,1:]
-    
-    csv_filename = csv_filename[1:]
+    X = np.hstack([ rval.reshape(rval.shape[0],-1) 
+                    for rval in regressor_map.values() ])
+    csv_filename = '_'.join(regressor_map.keys())
     csv_filename += '.csv'
     csv_filename = os.path.join(os.getcwd(), csv_filename)
     np.savetxt(csv_filename, X, delimiter='\t')
@@ -242,14 +219,19 @@ def calc_residuals(subject,
     if np.isnan(X).any() or np.isnan(X).any():
         raise ValueError('Regressor file contains NaN')
 
-    Y = data[global_mask].T
-    B = np.linalg.inv(X.T.dot(X)).dot(X.T).dot(Y)
-    Y_res = Y - X.dot(B)
+    # Factorize the design once, then residualize the voxels in place
+    Q = nuisance_basis(X)
+    basis_file = os.path.join(os.getcwd(), 'nuisance_basis.npy')
+    np.save(basis_file, Q)
+    regress_out(Y, Q, out=Y)
     
-    data[global_mask] = Y_res.T
+    res_data = np.zeros(nii.shape, dtype=dtype)
+    res_data[global_mask] = Y.T
+    del Y
     
     print 'Writing residual and regressors'
-    img = nb.Nifti1Image(data, header=nii.get_header(), affine=nii.get_affine())
+    img = nb.Nifti1Image(res_data, header=nii.get_header(), affine=nii.get_affine())
+    img.set_data_dtype(out_dtype)
     residual_file = os.path.join(os.getcwd(), 'residual.nii.gz')
     img.to_filename(residual_file)
     
@@ -261,7 +243,59 @@ def calc_residuals(subject,
     else:
         scipy.io.savemat(regressors_file, regressor_map, oned_as='column')   ### for scipy v0.12: OK
     
-    return residual_file, regressors_file
+    return residual_file, regressors_file, basis_file
+
+
+def regress_nuisance(in_file, basis_file, dtype = None):
+    """
+    Regresses a nuisance design, factorized by `calc_residuals`, out of
+    every voxel time-series of another file (e.g. a differently filtered
+    derivative of the same subject).
+    
+    Parameters
+    ----------
+    in_file : string
+        Path of a nifti file with the same time points as the design.
+    basis_file : string
+        Path of the orthonormal basis of the design (`basis_file` output of
+        `calc_residuals`).
+    dtype : string, optional
+        Precision of the regression and of the residual file, 'float64' or
+        'float32'. By default, the regression is done in double precision
+        and the residuals are written with the data type of the input file.
+    
+    Returns
+    -------
+    residual_file : string
+        Path of residual file in nifti format
+    """
+    import os
+    import numpy as np
+    import nibabel as nb
+    from CPAC.nuisance.utils import regress_out
+    from CPAC.utils.data_cache import load_masked_data
+    
+    Q = np.load(basis_file)
+    
+    nii = nb.load(in_file)
+    if Q.shape[0] != nii.shape[3]:
+        raise ValueError('Nuisance design length %d does not match data timepoints %d' % (Q.shape[0], nii.shape[3]))
+    out_dtype = dtype or nii.get_data_dtype()
+    dtype = dtype or 'float64'
+    mask, Y = load_masked_data(in_file)
+    Y = np.array(Y.T, dtype=dtype)
+    regress_out(Y, Q, out=Y)
+    
+    res_data = np.zeros(nii.shape, dtype=dtype)
+    res_data[mask] = Y.T
+    del Y
+    
+    img = nb.Nifti1Image(res_data, header=nii.get_header(), affine=nii.get_affine())
+    img.set_data_dtype(out_dtype)
+    residual_file = os.path.join(os.getcwd(), 'residual.nii.gz')
+    img.to_filename(residual_file)
+    
+    return residual_file
 
 
 def extract_tissue_data(data_file,
@@ -272,41 +306,42 @@ def extract_tissue_data(data_file,
     import os    
     from CPAC.nuisance import erode_mask
     from CPAC.utils import safe_shape
+    from CPAC.utils.data_cache import load_masked_data, \
+                                      select_masked_data_list
 
+    # The tissue signals are selected among the voxels in the data mask
     try:
-        data = nb.load(data_file).get_data().astype('float64')
+        data = nb.load(data_file)
+        data_mask, data_sigs = load_masked_data(data_file)
     except:
         raise MemoryError('Unable to load %s' % data_file)
 
 
     try:
-        lat_ventricles_mask = nb.load(ventricles_mask_file).get_data().astype('float64')
+        lat_ventricles_mask = nb.load(ventricles_mask_file).get_data()
     except:
-        raise MemoryError('Unable to load %s' % lat_ventricles_mask)
+        raise MemoryError('Unable to load %s' % ventricles_mask_file)
 
 
     if not safe_shape(data, lat_ventricles_mask):
         raise ValueError('Spatial dimensions for data and the lateral ventricles mask do not match')
 
     try:
-        wm_seg = nb.load(wm_seg_file).get_data().astype('float64')
+        wm_seg = nb.load(wm_seg_file).get_data()
     except:
-        raise MemoryError('Unable to load %s' % wm_seg)
+        raise MemoryError('Unable to load %s' % wm_seg_file)
 
 
     if not safe_shape(data, wm_seg):
         raise ValueError('Spatial dimensions for data, white matter segment do not match')
 
     wm_mask = erode_mask(wm_seg > 0)
-    wm_sigs = data[wm_mask]
-    file_wm = os.path.join(os.getcwd(), 'wm_signals.npy')
-    np.save(file_wm, wm_sigs)
-    del wm_sigs
+    del wm_seg
 
     try:
-        csf_seg = nb.load(csf_seg_file).get_data().astype('float64')
+        csf_seg = nb.load(csf_seg_file).get_data()
     except:
-        raise MemoryError('Unable to load %s' % csf_seg)
+        raise MemoryError('Unable to load %s' % csf_seg_file)
 
 
     if not safe_shape(data, csf_seg):
@@ -315,16 +350,13 @@ def extract_tissue_data(data_file,
     # Only take the CSF at the lateral ventricles as labeled in the Harvard
     # Oxford parcellation regions 4 and 43
     csf_mask = (csf_seg > 0)*(lat_ventricles_mask==1)
-    csf_sigs = data[csf_mask]
-    file_csf = os.path.join(os.getcwd(), 'csf_signals.npy')
-    np.save(file_csf, csf_sigs)
-    del csf_sigs
+    del csf_seg, lat_ventricles_mask
 
 
     try:
-        gm_seg = nb.load(gm_seg_file).get_data().astype('float64')
+        gm_seg = nb.load(gm_seg_file).get_data()
     except:
-        raise MemoryError('Unable to load %s' % gm_seg)
+        raise MemoryError('Unable to load %s' % gm_seg_file)
 
 
     if not safe_shape(data, gm_seg):
@@ -332,12 +364,23 @@ def extract_tissue_data(data_file,
 
 
     gm_mask = erode_mask(gm_seg > 0)
-    gm_sigs = data[gm_mask]
-    file_gm = os.path.join(os.getcwd(), 'gm_signals.npy')
-    np.save(file_gm, gm_sigs)
-    del gm_sigs
+    del gm_seg
 
 
+    # Signals of the three tissues, in a single pass over the data, stored
+    # as float32 (the precision of the cached data)
+    tissue_sigs = select_masked_data_list(data_mask, data_sigs,
+                                          [wm_mask, csf_mask, gm_mask])
+
+    tissue_files = []
+    for tissue, sigs in zip(['wm', 'csf', 'gm'], tissue_sigs):
+        tissue_file = os.path.join(os.getcwd(), '%s_signals.npy' % tissue)
+        np.save(tissue_file, sigs)
+        tissue_files.append(tissue_file)
+    del tissue_sigs
+
+    file_wm, file_csf, file_gm = tissue_files
+
 
     nii = nb.load(wm_seg_file)
     wm_mask_file = os.path.join(os.getcwd(), 'wm_mask.nii.gz')
@@ -351,7 +394,8 @@ def extract_tissue_data(data_file,
 
 
 
-def create_nuisance(use_ants, name='nuisance'):
+def create_nuisance(use_ants, name='nuisance', data_size_gb=None,
+                    voxel_volume=None):
     """
     Workflow for the removal of various signals considered to be noise in resting state
     fMRI data.  The residual signals for linear regression denoising is performed in a single
@@ -361,6 +405,12 @@ def create_nuisance(use_ants, name='nuisance'):
     ----------
     name : string, optional
         Name of the workflow.
+    data_size_gb : float, optional
+        Size of the subject's float32 functional data, from which the memory
+        of the nodes is estimated (see `CPAC.utils.functional_size_gb`).
+    voxel_volume : float, optional
+        Volume (in mm^3) of the voxels of the functional data, from which
+        the size of the data resampled to 2mm is estimated.
     
     Returns
     -------
@@ -399,6 +449,9 @@ def create_nuisance(use_ants, name='nuisance'):
         outputspec.regressors : string (mat file)
             Path of csv file of regressors used.  Filename corresponds to the name of each
             regressor in each column.
+        outputspec.basis : string (npy file)
+            Orthonormal basis of the regressors, to regress the same design
+            out of other files (see `regress_nuisance`).
             
     Nuisance Procedure:
     
@@ -417,7 +470,11 @@ def create_nuisance(use_ants, name='nuisance'):
         :width: 500    
     
     """
+    from CPAC.utils import estimate_memory_gb, resampled_size_factor, \
+                           set_node_resources
+
     nuisance = pe.Workflow(name=name)
+    factor_2mm = resampled_size_factor(voxel_volume)
     
     inputspec = pe.Node(util.IdentityInterface(fields=['subject',
                                                        'wm_mask',
@@ -435,7 +492,8 @@ def create_nuisance(use_ants, name='nuisance'):
                                                        'template_brain']),
                         name='inputspec')
     outputspec = pe.Node(util.IdentityInterface(fields=['subject',
-                                                        'regressors']),
+                                                        'regressors',
+                                                        'basis']),
                          name='outputspec')
 
 
@@ -466,7 +524,10 @@ def create_nuisance(use_ants, name='nuisance'):
 
     func_to_2mm = pe.Node(interface=fsl.FLIRT(), name='func_to_2mm_flirt_applyxfm')
     func_to_2mm.inputs.args = '-applyisoxfm 2'
-    func_to_2mm.interface.estimated_memory_gb = 2.0
+    # Data and its copy in 2mm
+    set_node_resources(func_to_2mm,
+                       memory_gb=estimate_memory_gb(data_size_gb,
+                                                    1 + factor_2mm, 2.0))
 
     nuisance.connect(inputspec, 'subject', func_to_2mm, 'in_file')
     nuisance.connect(inputspec, 'csf_mask', func_to_2mm, 'reference')
@@ -513,7 +574,10 @@ def create_nuisance(use_ants, name='nuisance'):
                                          output_names=['file_wm', 'file_csf', 'file_gm'],
                                          function=extract_tissue_data),
                            name='tissue_masks')
-    tissue_masks._interface.estimated_memory_gb = 3.0
+    # 2mm data and the signals of its tissue voxels
+    set_node_resources(tissue_masks,
+                       memory_gb=estimate_memory_gb(data_size_gb,
+                                                    1 + factor_2mm, 3.0))
 
 
     nuisance.connect(func_to_2mm, 'out_file', tissue_masks, 'data_file')
@@ -537,9 +601,13 @@ def create_nuisance(use_ants, name='nuisance'):
                                                 'motion_file',
                                                 'compcor_ncomponents'],
                                    output_names=['residual_file',
-                                                'regressors_file'],
+                                                'regressors_file',
+                                                'basis_file'],
                                    function=calc_residuals),
                      name='residuals')
+    # float64 data and residuals
+    set_node_resources(calc_r,
+                       memory_gb=estimate_memory_gb(data_size_gb, 4, 2.0))
     nuisance.connect(inputspec, 'subject',
                      calc_r, 'subject')
     nuisance.connect(tissue_masks, 'file_wm',
@@ -558,5 +626,7 @@ def create_nuisance(use_ants, name='nuisance'):
                      outputspec, 'subject')
     nuisance.connect(calc_r, 'regressors_file',
                      outputspec, 'regressors')
+    nuisance.connect(calc_r, 'basis_file',
+                     outputspec, 'basis')
     
     return nuisance
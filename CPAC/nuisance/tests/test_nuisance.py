@@ -104,3 +104,214 @@ def test_nuisance():
     cn.inputs.inputspec.harvard_oxford_mask = '/usr/share/fsl/4.1/data/atlases/HarvardOxford/HarvardOxford-sub-maxprob-thr25-2mm.nii.gz'
     cn.inputs.inputspec.subject = '/home/data/PreProc/ABIDE_CPAC_test_1/pipeline_0/0050102_session_1/preprocessed/_scan_rest_1_rest/rest_3dc_RPI_3dv_3dc_maths.nii.gz'
     cn.base_dir = '/home/bcheung/cn_run'
+
+
+def test_ideal_bandpass():
+    import numpy as np
+    from numpy.testing import assert_allclose
+    from scipy.fftpack import fft, ifft
+    from CPAC.nuisance import ideal_bandpass
+    
+    # Reference: filter each voxel with the full (padded) spectrum
+    def ideal_bandpass_voxel(data, sample_period, bandpass_freqs):
+        sample_freq = 1./sample_period
+        sample_length = data.shape[0]
+        data_p = np.zeros(int(2**np.ceil(np.log2(sample_length))))
+        data_p[:sample_length] = data
+        LowCutoff, HighCutoff = bandpass_freqs
+        if(LowCutoff is None):
+            low_cutoff_i = 0
+        elif(LowCutoff > sample_freq/2.):
+            low_cutoff_i = int(data_p.shape[0]/2)
+        else:
+            low_cutoff_i = np.ceil(LowCutoff*data_p.shape[0]*sample_period).astype('int')
+        if(HighCutoff is None or HighCutoff > sample_freq/2.):
+            high_cutoff_i = int(data_p.shape[0]/2)
+        else:
+            high_cutoff_i = np.fix(HighCutoff*data_p.shape[0]*sample_period).astype('int')
+        freq_mask = np.zeros_like(data_p, dtype='bool')
+        freq_mask[low_cutoff_i:high_cutoff_i+1] = True
+        freq_mask[data_p.shape[0]-high_cutoff_i:data_p.shape[0]+1-low_cutoff_i] = True
+        f_data = fft(data_p)
+        f_data[freq_mask != True] = 0.
+        return np.real_if_close(ifft(f_data)[:sample_length])
+    
+    Y = np.random.standard_normal((150, 50))
+    Y -= Y.mean(0)
+    
+    for bandpass_freqs in [(0.01, 0.1), (None, 0.1), (0.01, None), (0.3, 0.5)]:
+        ref = np.array([ ideal_bandpass_voxel(Y[:,j], 2.0, bandpass_freqs) 
+                         for j in range(Y.shape[1]) ]).T
+        # All voxels at once and in chunks of 3 voxels
+        for memory_limit in [None, 3*1024*(8+16+8)/1024.0**3]:
+            comp = ideal_bandpass(Y, 2.0, bandpass_freqs, memory_limit)
+            assert_allclose(comp, ref, atol=1e-10)
+        comp = ideal_bandpass(Y.astype('float32'), 2.0, bandpass_freqs)
+        assert comp.dtype == np.float32
+        assert_allclose(comp, ref, atol=1e-5)
+
+
+def test_bandpass_voxels():
+    import os
+    import tempfile
+    import numpy as np
+    import nibabel as nb
+    from numpy.testing import assert_allclose, assert_equal
+    from CPAC.nuisance import bandpass_voxels, ideal_bandpass
+    
+    data = np.random.standard_normal((5, 6, 4, 60)).astype('float32')
+    data[0] = 0
+    img = nb.Nifti1Image(data, np.eye(4))
+    img.header.set_zooms((3., 3., 3., 2.))
+    
+    cwd = os.getcwd()
+    os.chdir(tempfile.mkdtemp())
+    try:
+        img.to_filename('func.nii.gz')
+        mask = (data != 0).any(-1)
+        Y = data[mask].T.astype('float64')
+        ref = np.zeros(data.shape)
+        ref[mask] = ideal_bandpass(Y - Y.mean(0), 2.0, (0.01, 0.1)).T
+        
+        # Filtered in double precision, written with the input's dtype
+        bandpassed = nb.load(bandpass_voxels('func.nii.gz', (0.01, 0.1)))
+        assert_equal(bandpassed.get_data_dtype(), np.float32)
+        assert_allclose(bandpassed.get_data(), ref, atol=1e-5)
+        
+        bandpassed = nb.load(bandpass_voxels('func.nii.gz', (0.01, 0.1),
+                                             memory_limit=1e-4,
+                                             dtype='float64'))
+        assert_equal(bandpassed.get_data_dtype(), np.float64)
+        assert_allclose(bandpassed.get_data(), ref, atol=1e-10)
+    finally:
+        os.chdir(cwd)
+
+
+def test_regress_out():
+    import numpy as np
+    from numpy.testing import assert_allclose, assert_equal
+    from CPAC.nuisance import masked_timeseries, nuisance_basis, regress_out
+    
+    data = np.random.standard_normal((5, 6, 4, 40))
+    data[np.random.random((5, 6, 4)) > 0.7] = 0
+    mask, Y = masked_timeseries(data)
+    assert_equal(mask, (data != 0).sum(-1) != 0)
+    assert_equal(Y, data[mask].T)
+    
+    X = np.column_stack([np.ones(40), np.arange(40), np.random.random((40, 3))])
+    ref = Y - X.dot(np.linalg.inv(X.T.dot(X)).dot(X.T).dot(Y))
+    Q = nuisance_basis(X)
+    for chunk_size in [7, 10000]:
+        assert_allclose(regress_out(Y, Q, chunk_size), ref, atol=1e-10)
+    Y32 = Y.astype('float32')
+    regress_out(Y32, Q, out=Y32)
+    assert_allclose(Y32, ref, atol=1e-5)
+    
+    # Duplicated regressors do not change the residuals
+    Q = nuisance_basis(np.column_stack([X, X[:,1:3]]))
+    assert_equal(Q.shape, (40, 5))
+    assert_allclose(regress_out(Y, Q), ref, atol=1e-10)
+
+
+def test_regress_nuisance():
+    import os
+    import tempfile
+    import numpy as np
+    import nibabel as nb
+    from numpy.testing import assert_allclose, assert_equal
+    from CPAC.nuisance import calc_residuals, regress_nuisance
+    
+    data = np.random.standard_normal((5, 6, 4, 40)).astype('float32')
+    data += np.arange(40, dtype='float32')
+    data[0] = 0
+    
+    selector = dict((regressor, False)
+                    for regressor in ['compcor', 'wm', 'csf', 'gm', 'global',
+                                      'pc1', 'motion', 'linear', 'quadratic'])
+    selector['linear'] = True
+    selector['quadratic'] = True
+    
+    cwd = os.getcwd()
+    os.chdir(tempfile.mkdtemp())
+    try:
+        nb.Nifti1Image(data, np.eye(4)).to_filename('func.nii.gz')
+        mask = (data != 0).any(-1)
+        Y = data[mask].T.astype('float64')
+        X = np.column_stack([np.ones(40), np.arange(40), np.arange(40)**2])
+        ref = np.zeros(data.shape)
+        ref[mask] = (Y - X.dot(np.linalg.lstsq(X, Y, rcond=-1)[0])).T
+        
+        # Regressed in double precision, written with the input's dtype
+        residual_file, regressors_file, basis_file = \
+            calc_residuals('func.nii.gz', selector)
+        residuals = nb.load(residual_file)
+        assert_equal(residuals.get_data_dtype(), np.float32)
+        assert_allclose(residuals.get_data(), ref, atol=1e-4)
+        
+        # The same design, applied to another file from its basis
+        other = np.random.standard_normal(data.shape).astype('float32')
+        other[0] = 0
+        nb.Nifti1Image(other, np.eye(4)).to_filename('other.nii.gz')
+        Y = other[mask].T.astype('float64')
+        ref[mask] = (Y - X.dot(np.linalg.lstsq(X, Y, rcond=-1)[0])).T
+        residuals = nb.load(regress_nuisance('other.nii.gz', basis_file,
+                                             dtype='float64'))
+        assert_equal(residuals.get_data_dtype(), np.float64)
+        assert_allclose(residuals.get_data(), ref, atol=1e-10)
+    finally:
+        os.chdir(cwd)
+
+
+def test_erode_mask():
+    import numpy as np
+    from numpy.testing import assert_equal
+    from CPAC.nuisance import erode_mask
+    
+    data = np.random.random((9, 8, 7))
+    data[data < 0.2] = 0
+    data[2:7, 2:6, 2:5] = 1
+    
+    # Reference: every voxel and its 6 neighbours, away from the border
+    ref = np.zeros_like(data)
+    for x, y, z in zip(*np.nonzero(data)):
+        if 0 < x < 8 and 0 < y < 7 and 0 < z < 6 and \
+           data[x-1:x+2, y, z].all() and data[x, y-1:y+2, z].all() and \
+           data[x, y, z-1:z+2].all():
+            ref[x, y, z] = data[x, y, z]
+    
+    eroded = erode_mask(data)
+    assert_equal(eroded, ref)
+    assert eroded[3:6, 3:5, 3:4].all()
+    assert_equal(erode_mask(data > 0), ref > 0)
+
+
+def test_pca_components():
+    import numpy as np
+    from numpy.testing import assert_allclose, assert_equal
+    from CPAC.nuisance import pca_components, calc_compcor_components
+    
+    # Data with a few dominant components
+    T, V = 60, 500
+    Y = np.random.standard_normal((T, 5)).dot(
+            np.diag([10, 8, 6, 4, 2])).dot(np.random.standard_normal((5, V)))
+    Y += np.random.standard_normal((T, V))
+    Y += np.random.standard_normal(V)
+    
+    # Reference: full SVD of the centered data (components up to sign)
+    U, S, Vh = np.linalg.svd(Y - Y.mean(0), full_matrices=False)
+    for chunk_size in [37, 10000]:
+        comp = pca_components(Y, 5, center=True, chunk_size=chunk_size)
+        assert_equal(comp.shape, (T, 5))
+        assert_allclose(np.abs((comp*U[:,:5]).sum(0)), np.ones(5), 
+                        atol=1e-8)
+    
+    # CompCor, against the full SVD of the detrended, normalized signals
+    import scipy.signal as signal
+    wm_sigs = Y[:, :300].T.astype('float32')
+    csf_sigs = Y[:, 300:].T.astype('float32')
+    Yd = signal.detrend(Y.astype('float32').astype('float64'), axis=0)
+    Yd = (Yd - Yd.mean(0)) / Yd.std(0)
+    U, S, Vh = np.linalg.svd(Yd)
+    comp = calc_compcor_components(None, 3, wm_sigs, csf_sigs)
+    assert_equal(comp.shape, (T, 3))
+    assert_allclose(np.abs((comp*U[:,:3]).sum(0)), np.ones(3), atol=1e-8)
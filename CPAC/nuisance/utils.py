@@ -14,38 +14,280 @@ def calc_compcor_components(data, nComponents, wm_sigs, csf_sigs):
         raise IndexError
     
     print 'Detrending and centering data'
-    Y = signal.detrend(wmcsf_sigs, axis=1, type='linear').T
-    Yc = Y - np.tile(Y.mean(0), (Y.shape[0], 1))
-    Yc = Yc / np.tile(np.array(Y.std(0)).reshape(1,Y.shape[1]), (Y.shape[0],1))
+    Y = signal.detrend(wmcsf_sigs.astype(np.float64), axis=1, type='linear').T
+    del wmcsf_sigs
+    Y -= Y.mean(0)
+    Y /= Y.std(0)
     
-    print 'Calculating SVD decomposition of Y*Y\''
-    U, S, Vh = np.linalg.svd(Yc)
+    print 'Calculating leading components from the eigendecomposition of Y*Y\''
+    return pca_components(Y, nComponents)
+
+
+def pca_components(Y, n_components, center=False, chunk_size=10000):
+    """
+    Leading left singular vectors of a (timepoints x voxels) array, i.e.
+    the leading principal components of the voxel time-series.
+    
+    Only the `n_components` leading eigenvectors of the (`T`, `T`) matrix
+    Y*Y' are computed, instead of a full SVD of Y. Y*Y' is accumulated
+    `chunk_size` voxels at a time, in double precision.
+    
+    Parameters
+    ----------
+    Y : numpy.ndarray
+        Array of shape (`T`, `V`).
+    n_components : integer
+        Number of components (at most `T`).
+    center : boolean, optional
+        Compute the components of Y with the time-series of its voxels
+        centered (Y is not modified).
+    chunk_size : integer, optional
+        Number of voxels multiplied at a time.
+    
+    Returns
+    -------
+    U : numpy.ndarray
+        Array of shape (`T`, `n_components`), components in decreasing
+        order of singular value (the sign of each is arbitrary).
+    """
+    ntpts, nvoxs = Y.shape
+    n_components = min(n_components, ntpts)
+    
+    G = np.zeros((ntpts, ntpts))
+    for start in range(0, nvoxs, chunk_size):
+        Y_chunk = np.asarray(Y[:, start:start+chunk_size], dtype=np.float64)
+        G += Y_chunk.dot(Y_chunk.T)
     
-    return U[:,:nComponents]
+    if center:
+        # (J*Y)*(J*Y)' = J*(Y*Y')*J, J centering the columns of Y
+        J = np.eye(ntpts) - 1./ntpts
+        G = J.dot(G).dot(J)
+    
+    # eigh returns the eigenvalues in increasing order
+    evals, evecs = np.linalg.eigh(G)
+    
+    return evecs[:, ::-1][:, :n_components]
 
 def erode_mask(data):
+    """
+    Erodes the non-zero voxels of a 3D volume with a 6-connected structuring
+    element: a voxel is kept if it and its 6 face neighbours are non-zero.
+    Voxels on the border of the volume are removed.
+    
+    Parameters
+    ----------
+    data : numpy.ndarray
+        3D volume
+    
+    Returns
+    -------
+    eroded_data : numpy.ndarray
+        `data` with the eroded voxels set to zero
+    """
     mask = data != 0
-    eroded_mask = np.zeros_like(data, dtype='bool')
-    max_x, max_y, max_z = data.shape
-    x,y,z = np.where(data != 0)
-    for i in range(x.shape[0]):
-        if (max_x-1) == x[i] or \
-           (max_y-1) == y[i] or \
-           (max_z-1) == z[i] or \
-           x[i] == 0 or \
-           y[i] == 0 or \
-           z[i] == 0:
-            eroded_mask[x[i],y[i],z[i]] = False
-        else:
-            eroded_mask[x[i],y[i],z[i]] = mask[x[i], y[i], z[i]] * \
-                                          mask[x[i] + 1, y[i], z[i]] * \
-                                          mask[x[i], y[i] + 1, z[i]] * \
-                                          mask[x[i], y[i], z[i] + 1] * \
-                                          mask[x[i] - 1, y[i], z[i]] * \
-                                          mask[x[i], y[i] - 1, z[i]] * \
-                                          mask[x[i], y[i], z[i] - 1]
+    eroded_mask = np.zeros_like(mask)
+    
+    # AND the interior of the mask with the mask shifted by one voxel
+    # along each axis, in both directions
+    interior = [slice(1, n - 1) for n in mask.shape]
+    eroded = mask[tuple(interior)].copy()
+    for axis in range(3):
+        for shift in (-1, 1):
+            shifted = list(interior)
+            shifted[axis] = slice(1 + shift, mask.shape[axis] - 1 + shift)
+            eroded &= mask[tuple(shifted)]
+    eroded_mask[tuple(interior)] = eroded
 
     eroded_data = np.zeros_like(data)
     eroded_data[eroded_mask] = data[eroded_mask]
     
     return eroded_data
+
+
+def bandpass_frequency_mask(n_fft, sample_period, bandpass_freqs):
+    """
+    Returns the (boolean) mask of the rfft frequency bins of an `n_fft`
+    point signal passed by an ideal bandpass filter.
+    
+    Parameters
+    ----------
+    n_fft : integer
+        Number of points of the (zero-padded) signal.
+    sample_period : float
+        Length of sampling period in seconds.
+    bandpass_freqs : tuple
+        Tuple containing the bandpass frequencies. (LowCutoff, HighCutoff)
+    
+    Returns
+    -------
+    freq_mask : numpy.ndarray
+        Boolean array of length `n_fft//2 + 1`.
+    """
+    #Derived from YAN Chao-Gan 120504 based on REST.
+    sample_freq = 1./sample_period
+    LowCutoff, HighCutoff = bandpass_freqs
+    
+    if(LowCutoff is None): #No lower cutoff (low-pass filter)
+        low_cutoff_i = 0
+    elif(LowCutoff > sample_freq/2.): #Cutoff beyond fs/2 (all-stop filter)
+        low_cutoff_i = int(n_fft/2)
+    else:
+        low_cutoff_i = np.ceil(LowCutoff*n_fft*sample_period).astype('int')
+    
+    if(HighCutoff is None or HighCutoff > sample_freq/2.): #Cutoff beyond fs/2 or unspecified (become a highpass filter)
+        high_cutoff_i = int(n_fft/2)
+    else:
+        high_cutoff_i = np.fix(HighCutoff*n_fft*sample_period).astype('int')
+    
+    # The negative frequencies of the full spectrum mirror these bins
+    freq_mask = np.zeros(n_fft//2 + 1, dtype='bool')
+    freq_mask[low_cutoff_i:high_cutoff_i+1] = True
+    
+    return freq_mask
+
+def ideal_bandpass(Y, sample_period, bandpass_freqs, memory_limit=None):
+    """
+    Performs ideal bandpass filtering on each column (voxel) of `Y`.
+    
+    The frequency mask is built once and the (zero-padded) columns are
+    filtered with a real FFT along time, in chunks of voxels.
+    
+    Parameters
+    ----------
+    Y : numpy.ndarray
+        (`T` x `V`) array of demeaned time-series. A float32 array is
+        filtered (chunk by chunk) and returned as float32.
+    sample_period : float
+        Length of sampling period in seconds.
+    bandpass_freqs : tuple
+        Tuple containing the bandpass frequencies. (LowCutoff, HighCutoff)
+    memory_limit : float, optional
+        Memory in GB used by the FFT of each chunk. By default, chunks of
+        10000 voxels are filtered at a time.
+    
+    Returns
+    -------
+    Y_bp : numpy.ndarray
+        (`T` x `V`) array of filtered time-series, of the dtype of `Y`.
+    """
+    sample_length, nvoxs = Y.shape
+    n_fft = int(2**np.ceil(np.log2(sample_length)))
+    freq_mask = bandpass_frequency_mask(n_fft, sample_period, bandpass_freqs)
+    
+    # Padded signal, its spectrum and the filtered signal (double precision)
+    if memory_limit:
+        bytes_per_voxel = n_fft*8 + freq_mask.shape[0]*16 + n_fft*8
+        chunk_size = int(memory_limit*1024.0**3 / bytes_per_voxel)
+        if chunk_size < 1:
+            raise MemoryError('Not enough memory to bandpass filter one '
+                              'voxel. Need a minimum of %.2fMB' % 
+                              (bytes_per_voxel/1024.0**2))
+    else:
+        chunk_size = 10000
+    
+    Y_bp = np.empty_like(Y)
+    for start in range(0, nvoxs, chunk_size):
+        stop = min(start + chunk_size, nvoxs)
+        f_data = np.fft.rfft(Y[:,start:stop], n=n_fft, axis=0)
+        f_data[~freq_mask] = 0.
+        Y_bp[:,start:stop] = np.fft.irfft(f_data, n=n_fft, axis=0)[:sample_length]
+        del f_data
+    
+    return Y_bp
+
+def masked_timeseries(data, dtype='float64'):
+    """
+    Extracts the time-series of the voxels with any non-zero time point.
+    
+    The 4D data is read one slab (first axis) at a time, so a
+    memory-mapped image is streamed rather than loaded whole.
+    
+    Parameters
+    ----------
+    data : numpy.ndarray or numpy.memmap
+        4D (x, y, z, `T`) data.
+    dtype : string, optional
+        dtype of the returned time-series.
+    
+    Returns
+    -------
+    mask : numpy.ndarray
+        3D boolean mask of the non-zero voxels.
+    Y : numpy.ndarray
+        (`T` x `V`) time-series of the `V` voxels in the mask.
+    """
+    mask = np.zeros(data.shape[:3], dtype='bool')
+    for i in range(data.shape[0]):
+        mask[i] = (np.asarray(data[i]) != 0).any(-1)
+    
+    Y = np.empty((mask.sum(), data.shape[3]), dtype=dtype)
+    start = 0
+    for i in range(data.shape[0]):
+        stop = start + mask[i].sum()
+        Y[start:stop] = np.asarray(data[i])[mask[i]]
+        start = stop
+    
+    return mask, Y.T
+
+def nuisance_basis(X):
+    """
+    Computes an orthonormal basis of the columns of a design matrix with a
+    (column pivoted) QR factorization. Columns that are linearly dependent
+    on the others are dropped.
+    
+    Parameters
+    ----------
+    X : numpy.ndarray
+        (`T` x `p`) design matrix of nuisance regressors.
+    
+    Returns
+    -------
+    Q : numpy.ndarray
+        (`T` x `r`) orthonormal basis, `r` being the rank of `X`.
+    """
+    from scipy.linalg import qr
+    
+    Q, R, P = qr(X, mode='economic', pivoting=True)
+    
+    diag = np.abs(np.diag(R))
+    if not diag.size or diag[0] == 0:
+        return Q[:,:0]
+    tol = diag[0] * max(X.shape) * np.finfo(R.dtype).eps
+    rank = (diag > tol).sum()
+    if rank < X.shape[1]:
+        print 'Design matrix is rank deficient, using %i of %i columns' % \
+              (rank, X.shape[1])
+    
+    return Q[:,:rank]
+
+def regress_out(Y, Q, chunk_size=10000, out=None):
+    """
+    Residualizes each column (voxel) of `Y` against the orthonormal basis `Q`
+    of a design (see `nuisance_basis`), in chunks of voxels.
+    
+    Parameters
+    ----------
+    Y : numpy.ndarray
+        (`T` x `V`) time-series.
+    Q : numpy.ndarray
+        (`T` x `r`) orthonormal basis of the design.
+    chunk_size : integer, optional
+        Number of voxels residualized at a time.
+    out : numpy.ndarray, optional
+        (`T` x `V`) array for the residuals, can be `Y` itself.
+    
+    Returns
+    -------
+    out : numpy.ndarray
+        Residuals, of the dtype of `out` (or of `Y`).
+    """
+    if out is None:
+        out = np.empty_like(Y)
+    Q = Q.astype(out.dtype)
+    
+    for start in range(0, Y.shape[1], chunk_size):
+        stop = min(start + chunk_size, Y.shape[1])
+        Y_chunk = Y[:,start:stop]
+        out[:,start:stop] = Y_chunk - Q.dot(Q.T.dot(Y_chunk))
+    
+    return out
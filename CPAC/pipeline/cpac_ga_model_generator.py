@@ -43,41 +43,105 @@ def create_dir(dir_path, description):
 
 
 
-def create_merged_copefile(list_of_output_files, merged_outfile):
+def create_merged_copefile(list_of_output_files, merged_outfile,
+                           mask_outfile=None):
+
+    # merge the participants' 3D maps into a 4D file, in-process: each map
+    # is appended to the (compressed) output as soon as it is read, as the
+    # volumes of a nifti file are contiguous, so only one map is in memory
+    # at a time. The group mask (voxels non-zero in every map, as with
+    # "fslmaths -abs -Tmin -bin") and a hash of each volume written are
+    # computed in the same pass
+
+    import gzip
+    import hashlib
+    import numpy as np
+    import nibabel as nb
+
+    try:
+        first_hdr = nb.load(list_of_output_files[0]).get_header()
+    except Exception as e:
+        err = "\n\n[!] Could not read the first file to merge for group " \
+              "analysis.\n\nFile: %s\n\nError details: %s\n\n" \
+              % (list_of_output_files[0], e)
+        raise Exception(err)
 
-    import subprocess
+    shape = first_hdr.get_data_shape()[:3]
 
-    merge_string = ["fslmerge", "-t", merged_outfile]
+    hdr = nb.Nifti1Header()
+    hdr.set_data_shape(shape + (len(list_of_output_files),))
+    hdr.set_data_dtype(np.float32)
+    hdr.set_zooms(first_hdr.get_zooms()[:3] + (1.0,))
+    hdr.set_xyzt_units(*first_hdr.get_xyzt_units())
+    hdr.set_qform(*first_hdr.get_qform(coded=True))
+    hdr.set_sform(*first_hdr.get_sform(coded=True))
+    hdr.set_data_offset(352)
 
-    merge_string = merge_string + list_of_output_files
+    mask = np.ones(shape, dtype=bool)
+    volume_hashes = []
+
+    if merged_outfile.endswith(".gz"):
+        merged = gzip.open(merged_outfile, "wb")
+    else:
+        merged = open(merged_outfile, "wb")
 
     try:
-        retcode = subprocess.check_output(merge_string)
-    except Exception as e:
-        err = "\n\n[!] Something went wrong with FSL's fslmerge during the " \
-              "creation of the 4D merged file for group analysis.\n\n" \
-              "Attempted to create file: %s\n\nLength of list of files to " \
-              "merge: %d\n\nError details: %s\n\n" \
-              % (merged_outfile, len(list_of_output_files), e)
-        raise Exception(err)
+        hdr.write_to(merged)
+        merged.write(b"\x00" * (352 - merged.tell()))
+
+        for output_file in list_of_output_files:
+            data = nb.load(output_file).get_data()
+            if data.ndim == 4 and data.shape[3] == 1:
+                data = data[..., 0]
+
+            if data.shape != shape:
+                err = "\n\n[!] The file %s (shape %s) cannot be merged " \
+                      "with the other files for group analysis (shape %s)." \
+                      "\n\n" % (output_file, str(data.shape), str(shape))
+                raise Exception(err)
+
+            volume = np.asarray(data, dtype=np.float32)
+            mask &= (volume != 0)
+
+            volume_bytes = volume.tobytes(order="F")
+            volume_hashes.append(hashlib.md5(volume_bytes).hexdigest())
+            merged.write(volume_bytes)
+            del data, volume, volume_bytes
+    finally:
+        merged.close()
+
+    if mask_outfile is not None:
+        mask_img = nb.Nifti1Image(mask.astype(np.float32), hdr.get_best_affine())
+        mask_img.to_filename(mask_outfile)
 
-    return merged_outfile
+    return merged_outfile, mask_outfile, volume_hashes
 
 
 
 def create_merge_mask(merged_file, mask_outfile):
 
-    import subprocess
+    # voxels non-zero in every volume, as with "fslmaths -abs -Tmin -bin",
+    # read one volume at a time
 
-    mask_string = ["fslmaths", merged_file, "-abs", "-Tmin", "-bin", \
-                   mask_outfile]
+    import numpy as np
+    import nibabel as nb
 
     try:
-        retcode = subprocess.check_output(mask_string)
+        img = nb.load(merged_file)
+        shape = img.shape
+        if len(shape) < 4:
+            mask = (img.get_data() != 0)
+        else:
+            mask = np.ones(shape[:3], dtype=bool)
+            for i in range(shape[3]):
+                mask &= (np.asarray(img.dataobj[..., i]) != 0)
+
+        mask_img = nb.Nifti1Image(mask.astype(np.float32), img.get_affine())
+        mask_img.to_filename(mask_outfile)
     except Exception as e:
-        err = "\n\n[!] Something went wrong with FSL's fslmaths during the " \
-              "creation of the merged copefile group mask.\n\nAttempted to " \
-              "create file: %s\n\nMerged file: %s\n\nError details: %s\n\n" \
+        err = "\n\n[!] Something went wrong during the creation of the " \
+              "merged copefile group mask.\n\nAttempted to create file: " \
+              "%s\n\nMerged file: %s\n\nError details: %s\n\n" \
               % (mask_outfile, merged_file, e)
         raise Exception(err)
 
@@ -85,80 +149,258 @@ def create_merge_mask(merged_file, mask_outfile):
 
 
 
-def check_merged_file(list_of_output_files, merged_outfile):
+def check_merged_file(list_of_output_files, merged_outfile, volume_hashes):
 
-    import subprocess
+    import gzip
+    import hashlib
+    import nibabel as nb
 
     # make sure the order is correct
-    #   we are ensuring each volume of the merge file correlates perfectly
-    #   with the output file it should correspond to
-    i = 0
-    for output_file in list_of_output_files:
-        test_string = ["3ddot", "-demean", output_file, \
-            merged_outfile + "[" + str(i) + "]"]
+    #   we are ensuring each volume of the merge file is identical to the
+    #   output file it should correspond to, by comparing the hash of each
+    #   volume with the one of the map written to it (see
+    #   create_merged_copefile), in a single pass over the merge file
+    if merged_outfile.endswith(".gz"):
+        merged = gzip.open(merged_outfile, "rb")
+    else:
+        merged = open(merged_outfile, "rb")
 
-        try:
-            retcode = subprocess.check_output(test_string)
-        except Exception as e:
-            err = "\n\n[!] Something went wrong while trying to run AFNI's " \
-                  "3ddot for the purpose of testing the merge file output." \
-                  "\n\nError details: %s\n\n" % e
+    try:
+        hdr = nb.Nifti1Header.from_fileobj(merged)
+        shape = hdr.get_data_shape()
+        volume_size = hdr.get_data_dtype().itemsize * \
+                          shape[0] * shape[1] * shape[2]
+
+        if len(shape) < 4 or shape[3] != len(list_of_output_files):
+            err = "\n\n[!] The merged file does not have one volume per " \
+                  "output file described in the phenotype matrix.\n\n" \
+                  "Merged file: %s\n\nNumber of output files: %d\n\n" \
+                  % (merged_outfile, len(list_of_output_files))
             raise Exception(err)
 
-        retcode = retcode.rstrip("\n").rstrip("\t")
-
-        if retcode != "1":
-            err = "\n\n[!] The volumes of the merged file do not correspond "\
-                  "to the correct order of output files as described in the "\
-                  "phenotype matrix. If you are seeing this error, " \
-                  "something possibly went wrong with FSL's fslmerge.\n\n" \
-                  "Merged file: %s\n\nMismatch between merged file volume " \
-                  "%d and derivative file %s\n\nEach volume should " \
-                  "correspond to the derivative output file for each " \
-                  "participant in the model.\n\n" \
-                  % (merged_outfile, i, output_file)
-            raise Exception(err)
+        # skip to the data
+        merged.read(int(hdr.get_data_offset()) - merged.tell())
+
+        i = 0
+        for output_file in list_of_output_files:
+            volume_hash = hashlib.md5(merged.read(volume_size)).hexdigest()
+
+            if volume_hash != volume_hashes[i]:
+                err = "\n\n[!] The volumes of the merged file do not " \
+                      "correspond to the correct order of output files as " \
+                      "described in the phenotype matrix. If you are seeing " \
+                      "this error, something possibly went wrong while " \
+                      "writing the merged file.\n\n" \
+                      "Merged file: %s\n\nMismatch between merged file " \
+                      "volume %d and derivative file %s\n\nEach volume " \
+                      "should correspond to the derivative output file for " \
+                      "each participant in the model.\n\n" \
+                      % (merged_outfile, i, output_file)
+                raise Exception(err)
 
-        i += 1
+            i += 1
+    finally:
+        merged.close()
 
 
 
-def calculate_measure_mean_in_df(model_df, merge_mask):
+_covariate_labels = {}
 
-    import subprocess
-    import pandas as pd
 
-    mm_dict_list = []
-    
-    for raw_file in list(model_df["Raw_Filepath"]):
-    
-        mask_string = ["3dmaskave", "-mask", merge_mask, raw_file]
-        
-        # calculate
-        try:
-            retcode = subprocess.check_output(mask_string)
-        except Exception as e:
-            err = "\n\n[!] AFNI's 3dMaskAve failed for raw output: %s\n" \
-                  "Error details: %s\n\n" % (raw_file, e)
+def _init_covariate_worker(shape, voxels, bins, counts):
+
+    # the voxels and label bins of the covariate masks, shared by all the
+    # maps a (pool) process reduces
+    _covariate_labels["shape"] = shape
+    _covariate_labels["voxels"] = voxels
+    _covariate_labels["bins"] = bins
+    _covariate_labels["counts"] = counts
+
+
+def _covariate_means(raw_file):
+
+    import numpy as np
+    import nibabel as nb
+
+    data = nb.load(raw_file).get_data()
+    if data.ndim == 4:
+        data = data[..., 0]
+
+    if data.shape != _covariate_labels["shape"]:
+        err = "\n\n[!] The raw output file %s (shape %s) does not match " \
+              "the shape of the masks used to calculate the measure and " \
+              "custom ROI means (shape %s).\n\n" \
+              % (raw_file, str(data.shape), str(_covariate_labels["shape"]))
+        raise Exception(err)
+
+    values = np.asarray(data, dtype=np.float64).ravel()
+    values = values[_covariate_labels["voxels"]]
+
+    # the sums of every label at once
+    sums = np.bincount(_covariate_labels["bins"], weights=values,
+                       minlength=len(_covariate_labels["counts"]))
+
+    return sums / _covariate_labels["counts"]
+
+
+def calculate_covariate_means(raw_files, mean_mask=None, roi_mask=None,
+                              num_processes=1, cache_file=None):
+
+    # mean of each raw output file in mean_mask (as 3dmaskave) and in each
+    # ROI of roi_mask (as 3dROIstats, in increasing order of ROI values),
+    # loading every file once and reducing all the labels at once; files
+    # are spread over num_processes processes, and the means are cached in
+    # cache_file (a pickle) by file path, modification time and mask, so
+    # that later calls (and model generations) with either mask reuse them
+
+    import os
+    import hashlib
+    import cPickle as pickle
+    import numpy as np
+    import nibabel as nb
+    from multiprocessing import Pool
+
+    shape = None
+    voxels = []
+    bins = []
+    mask_keys = []
+    mask_bins = []
+    num_bins = 0
+
+    for mask_file, labelled in [(mean_mask, False), (roi_mask, True)]:
+        if mask_file is None:
+            continue
+
+        mask_data = nb.load(mask_file).get_data()
+        if mask_data.ndim == 4:
+            mask_data = mask_data[..., 0]
+
+        if shape is not None and mask_data.shape != shape:
+            err = "\n\n[!] The measure mean mask %s and the custom ROI " \
+                  "mask %s do not have the same shape.\n\n" \
+                  % (mean_mask, roi_mask)
             raise Exception(err)
-        
-        # if this breaks, 3dmaskave output to STDOUT has changed
+        shape = mask_data.shape
+
+        mask_data = mask_data.ravel()
+        mask_voxels = np.flatnonzero(mask_data)
+
+        if labelled:
+            labels, labels_bins = np.unique(mask_data[mask_voxels],
+                                            return_inverse=True)
+            num_labels = len(labels)
+        else:
+            labels_bins = np.zeros(len(mask_voxels), dtype=np.intp)
+            num_labels = 1
+
+        mask_keys.append(hashlib.md5(np.asarray(shape).tobytes() +
+                                     mask_voxels.tobytes() +
+                                     labels_bins.tobytes()).hexdigest())
+        mask_bins.append(slice(num_bins, num_bins + num_labels))
+
+        voxels.append(mask_voxels)
+        bins.append(num_bins + labels_bins)
+        num_bins += num_labels
+
+    voxels = np.concatenate(voxels)
+    bins = np.concatenate(bins)
+    counts = np.bincount(bins, minlength=num_bins).astype(np.float64)
+
+    if (counts == 0).any():
+        err = "\n\n[!] The mask used for the measure means or one of the " \
+              "custom ROIs is empty.\n\nMask: %s\n\nCustom ROI mask: %s" \
+              "\n\n" % (mean_mask, roi_mask)
+        raise Exception(err)
+
+    def cache_key(raw_file, mask_key):
+        return (os.path.abspath(raw_file), os.path.getmtime(raw_file),
+                mask_key)
+
+    cache = {}
+    if cache_file is not None and os.path.exists(cache_file):
         try:
-            mean = retcode.split(" ")[0]
-        except Exception as e:
-            err = "\n\n[!] Something went wrong with parsing the output of " \
-                  "AFNI's 3dMaskAve - this is used in calculating the " \
-                  "Measure Mean in group analysis.\n\nError details: %s\n\n" \
-                  % e
-            raise Exception(err)
-        
-        mm_dict = {}
-        mm_dict["Raw_Filepath"] = raw_file
-        mm_dict["Measure_Mean"] = mean
-        mm_dict_list.append(mm_dict)
-        
-    mm_df = pd.DataFrame(mm_dict_list)
-    
+            with open(cache_file, "rb") as f:
+                cache = pickle.load(f)
+        except Exception:
+            cache = {}
+
+    missing = []
+    for raw_file in raw_files:
+        if raw_file in missing:
+            continue
+        for mask_key in mask_keys:
+            if cache_key(raw_file, mask_key) not in cache:
+                missing.append(raw_file)
+                break
+
+    if len(missing) > 0:
+        init_args = (shape, voxels, bins, counts)
+
+        if num_processes > 1 and len(missing) > 1:
+            pool = Pool(min(num_processes, len(missing)),
+                        _init_covariate_worker, init_args)
+            try:
+                means_list = pool.map(_covariate_means, missing)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            _init_covariate_worker(*init_args)
+            means_list = map(_covariate_means, missing)
+
+        new_entries = {}
+        for raw_file, means in zip(missing, means_list):
+            for mask_key, mask_slice in zip(mask_keys, mask_bins):
+                new_entries[cache_key(raw_file, mask_key)] = means[mask_slice]
+        cache.update(new_entries)
+
+        if cache_file is not None:
+            # other models may be updating the cache at the same time: add
+            # the new entries to its latest version, and swap it in
+            latest_cache = {}
+            if os.path.exists(cache_file):
+                try:
+                    with open(cache_file, "rb") as f:
+                        latest_cache = pickle.load(f)
+                except Exception:
+                    latest_cache = {}
+            latest_cache.update(new_entries)
+
+            tmp_file = "%s.%d.tmp" % (cache_file, os.getpid())
+            with open(tmp_file, "wb") as f:
+                pickle.dump(latest_cache, f, pickle.HIGHEST_PROTOCOL)
+            os.rename(tmp_file, cache_file)
+
+    means_list = []
+    for mask_key in mask_keys:
+        means_list.append(np.array([cache[cache_key(raw_file, mask_key)]
+                                    for raw_file in raw_files]))
+
+    measure_means = None
+    if mean_mask is not None:
+        measure_means = means_list.pop(0)[:, 0]
+
+    roi_means = None
+    if roi_mask is not None:
+        roi_means = means_list.pop(0)
+
+    return measure_means, roi_means
+
+
+
+def calculate_measure_mean_in_df(model_df, merge_mask, num_processes=1,
+                                 cache_file=None):
+
+    import pandas as pd
+
+    raw_files = list(model_df["Raw_Filepath"])
+
+    measure_means = calculate_covariate_means(raw_files, merge_mask, None,
+                                              num_processes, cache_file)[0]
+
+    mm_df = pd.DataFrame({"Raw_Filepath": raw_files,
+                          "Measure_Mean": measure_means})
+
     # demean!
     mm_df["Measure_Mean"] = mm_df["Measure_Mean"].astype(float)
     mm_df["Measure_Mean"] = \
@@ -174,8 +416,8 @@ def check_mask_file_resolution(data_file, roi_mask, group_mask, out_dir, \
     output_id=None):
 
     import os
-    import subprocess
     import nibabel as nb
+    from nibabel.processing import resample_from_to
 
     # let's check if we need to resample the custom ROI mask
     raw_file_img = nb.load(data_file)
@@ -183,8 +425,8 @@ def check_mask_file_resolution(data_file, roi_mask, group_mask, out_dir, \
     roi_mask_img = nb.load(roi_mask)
     roi_mask_hdr = roi_mask_img.get_header()
 
-    raw_file_dims = raw_file_hdr.get_zooms()
-    roi_mask_dims = roi_mask_hdr.get_zooms()
+    raw_file_dims = raw_file_hdr.get_zooms()[:3]
+    roi_mask_dims = roi_mask_hdr.get_zooms()[:3]
 
     if raw_file_dims != roi_mask_dims:
         print "\n\nWARNING: The custom ROI mask file is a different " \
@@ -196,17 +438,21 @@ def check_mask_file_resolution(data_file, roi_mask, group_mask, out_dir, \
                                          "resampled_%s" \
                                          % os.path.basename(roi_mask))
 
-        resample_str = ["flirt", "-in", roi_mask, "-ref", group_mask, \
-                        "-applyisoxfm", str(raw_file_dims[0]), "-interp", \
-                        "nearestneighbour", "-out", resampled_outfile]
-
+        # nearest neighbour, onto the grid of the group mask (which has the
+        # resolution of the output data), as "flirt -applyisoxfm" did
         try:
-            retcode = subprocess.check_output(resample_str)
+            group_mask_img = nb.load(group_mask)
+            resampled_img = resample_from_to(roi_mask_img,
+                                             (group_mask_img.shape[:3],
+                                              group_mask_img.get_affine()),
+                                             order=0)
+            resampled_img.set_data_dtype(roi_mask_hdr.get_data_dtype())
+            resampled_img.to_filename(resampled_outfile)
         except Exception as e:
-            err = "\n\n[!] Something went wrong with running FSL FLIRT for " \
-                  "the purpose of resampling the custom ROI mask to match " \
-                  "the original output file's resolution.\n\nCustom ROI " \
-                  "mask file: %s\n\nError details: %s\n\n" % (roi_mask, e)
+            err = "\n\n[!] Something went wrong with resampling the custom " \
+                  "ROI mask to match the original output file's " \
+                  "resolution.\n\nCustom ROI mask file: %s\n\nError " \
+                  "details: %s\n\n" % (roi_mask, e)
             raise Exception(err)
 
         roi_mask = resampled_outfile
@@ -217,92 +463,72 @@ def check_mask_file_resolution(data_file, roi_mask, group_mask, out_dir, \
 
 def trim_mask(input_mask, ref_mask, output_mask_path):
 
-    import os
-    import subprocess
-
-    # mask the mask
-    mask_string = ["fslmaths", input_mask, "-mul", ref_mask, output_mask_path]
+    import numpy as np
+    import nibabel as nb
 
+    # mask the mask, as "fslmaths -mul"
     try:
-        retcode = subprocess.check_output(mask_string)
+        input_img = nb.load(input_mask)
+        input_data = input_img.get_data()
+        ref_data = nb.load(ref_mask).get_data()
+        if ref_data.ndim == 4:
+            ref_data = ref_data[..., 0]
+
+        if input_data.shape[:3] != ref_data.shape:
+            raise Exception("the masks have different shapes (%s and %s)"
+                            % (str(input_data.shape), str(ref_data.shape)))
+
+        trimmed = np.array(input_data)
+        trimmed[ref_data == 0] = 0
+
+        trimmed_img = nb.Nifti1Image(trimmed, input_img.get_affine(),
+                                     input_img.get_header())
+        trimmed_img.to_filename(output_mask_path)
     except Exception as e:
-        err = "\n\n[!] Something went wrong with running FSL's fslmaths for "\
-              "the purpose of trimming the custom ROI masks to fit within " \
-              "the merged group mask.\n\nCustom ROI mask file: %s\n\nMerged "\
-              "group mask file: %s\n\nError details: %s\n\n" \
-              % (input_mask, ref_mask, e)
+        err = "\n\n[!] Something went wrong with trimming the custom ROI " \
+              "masks to fit within the merged group mask.\n\nCustom ROI " \
+              "mask file: %s\n\nMerged group mask file: %s\n\nError " \
+              "details: %s\n\n" % (input_mask, ref_mask, e)
         raise Exception(err)
 
     return output_mask_path
 
 
 
-def calculate_custom_roi_mean_in_df(model_df, roi_mask):   
+def prepare_custom_roi_mask(data_file, custom_roi_mask, group_mask, out_dir,
+                            output_id=None):
 
     import os
-    import subprocess
-    import pandas as pd
 
-    # calculate the ROI means
-    roi_dict_list = []
-    
-    for raw_file in list(model_df["Raw_Filepath"]):
-        
-        roi_string = ["3dROIstats", "-mask", roi_mask, raw_file]
+    # make sure the custom ROI mask file is the same resolution as the
+    # output files - if not, resample and warn the user
+    roi_mask = check_mask_file_resolution(data_file, custom_roi_mask,
+                                          group_mask, out_dir, output_id)
 
-        try:
-            retcode = subprocess.check_output(roi_string)
-        except Exception as e:
-            err = "\n\n[!] Something went wrong with running AFNI's " \
-                  "3dROIstats while calculating the custom ROI means.\n\n" \
-                  "Custom ROI mask file: %s\n\nRaw output filepath: %s\n\n" \
-                  "Error details: %s\n\n" % (roi_mask, raw_file, e)
-            raise Exception(err)
+    # trim the custom ROI mask to be within mask constraints
+    output_mask = os.path.join(out_dir, "masked_%s" \
+                               % os.path.basename(roi_mask))
 
-        # process the output string
-        roi_means_string = str(retcode.split(raw_file)[1].rstrip("\n"))
+    return trim_mask(roi_mask, group_mask, output_mask)
 
-        roi_means_string_list = roi_means_string.split("\t")
 
-        # check
-        roi_means_list = []
-        for roi_mean in roi_means_string_list:
-            try:
-                roi_mean = float(roi_mean)
-            except:
-                continue
-
-            roi_means_list.append(roi_mean)
-
-        if len(roi_means_list) != retcode.count("Mean_"):
-            err = "\n\n[!] Something went wrong with parsing the output "\
-                  "of AFNI's 3dROIstats during the calculation of the " \
-                  "custom ROI means.\n\nOutput file: %s\n\nCustom ROI " \
-                  "mask file: %s\n\n3dROIstats output: %s\n\n" \
-                  % (raw_file, roi_mask, retcode)
-            raise Exception(err)
 
-        # add in the custom ROI means!
-        roi_dict = {}
-        roi_dict["Raw_Filepath"] = raw_file
+def calculate_custom_roi_mean_in_df(model_df, roi_mask, num_processes=1,
+                                    cache_file=None):
 
-        i = 1
-        for roi_mean in roi_means_list:
-            roi_label = "Custom_ROI_Mean_%d" % i
-            roi_dict[roi_label] = roi_mean
-            i += 1
+    import pandas as pd
 
-        roi_dict_list.append(roi_dict)
+    raw_files = list(model_df["Raw_Filepath"])
 
+    roi_means = calculate_covariate_means(raw_files, None, roi_mask,
+                                          num_processes, cache_file)[1]
 
-    roi_df = pd.DataFrame(roi_dict_list)
-    
-    # demean!
-    i = 1
-    for roi_mean in roi_means_list:
-        roi_label = "Custom_ROI_Mean_%d" % i
-        i += 1  
-        roi_df[roi_label] = roi_df[roi_label].astype(float)
+    roi_df = pd.DataFrame({"Raw_Filepath": raw_files})
+
+    # add in the custom ROI means, and demean!
+    for i in range(roi_means.shape[1]):
+        roi_label = "Custom_ROI_Mean_%d" % (i + 1)
+        roi_df[roi_label] = roi_means[:, i].astype(float)
         roi_df[roi_label] = roi_df[roi_label].sub(roi_df[roi_label].mean())
     
     model_df = pd.merge(model_df, roi_df, how="inner", on=["Raw_Filepath"])
@@ -664,14 +890,17 @@ def prep_group_analysis_workflow(model_df, pipeline_config_path, \
     merge_outfile = model_name + "_" + resource_id + "_merged.nii.gz"
     merge_outfile = os.path.join(model_path, merge_outfile)
 
-    merge_file = create_merged_copefile(list(model_df["Filepath"]), \
-                                        merge_outfile)
-
-    # create merged group mask
+    # and the merged group mask, in the same pass
     merge_mask_outfile = model_name + "_" + resource_id + \
                              "_merged_mask.nii.gz"
     merge_mask_outfile = os.path.join(model_path, merge_mask_outfile)
-    merge_mask = create_merge_mask(merge_file, merge_mask_outfile)
+
+    merge_file, merge_mask, volume_hashes = \
+        create_merged_copefile(list(model_df["Filepath"]), merge_outfile,
+                               merge_mask_outfile)
+
+    # check the merged file's order
+    check_merged_file(list(model_df["Filepath"]), merge_file, volume_hashes)
 
     if "Group Mask" in group_config_obj.mean_mask:
         mask_for_means = merge_mask
@@ -687,11 +916,15 @@ def prep_group_analysis_workflow(model_df, pipeline_config_path, \
                                                mask_for_means_path)
         readme_flags.append("individual_masks")
 
-    # calculate measure means, and demean
-    if "Measure_Mean" in design_formula:
-        model_df = calculate_measure_mean_in_df(model_df, mask_for_means)
+    # the measure and custom ROI means of every raw output file are cached,
+    # and shared by all the models of the pipeline
+    covariate_cache = os.path.join(group_config_obj.output_dir,
+                                   "group_analysis_results_%s" % pipeline_ID,
+                                   "covariate_means_cache.pkl")
+    num_processes = pipeline_config_obj.maxCoresPerParticipant
 
-    # calculate custom ROIs, and demean (in workflow?)
+    # prepare the custom ROI mask
+    roi_mask = None
     if "Custom_ROI_Mean" in design_formula:
 
         custom_roi_mask = group_config_obj.custom_roi_mask
@@ -703,20 +936,32 @@ def prep_group_analysis_workflow(model_df, pipeline_config_path, \
                   "\n\nDesign formula: %s\n\n" % design_formula
             raise Exception(err)
 
-        # make sure the custom ROI mask file is the same resolution as the
-        # output files - if not, resample and warn the user
-        roi_mask = check_mask_file_resolution(list(model_df["Raw_Filepath"])[0], \
-                                              custom_roi_mask, mask_for_means, \
-                                              model_path, resource_id)
-
-        # trim the custom ROI mask to be within mask constraints
-        output_mask = os.path.join(model_path, "masked_%s" \
-                                   % os.path.basename(roi_mask))
-        roi_mask = trim_mask(roi_mask, mask_for_means, output_mask)
+        # resample the custom ROI mask to the resolution of the output
+        # files if needed, and trim it to be within mask constraints
+        roi_mask = prepare_custom_roi_mask(list(model_df["Raw_Filepath"])[0],
+                                           custom_roi_mask, mask_for_means,
+                                           model_path, resource_id)
         readme_flags.append("custom_roi_mask_trimmed")
 
+    # load each raw output file once for both kinds of means
+    if ("Measure_Mean" in design_formula) and (roi_mask is not None):
+        calculate_covariate_means(list(model_df["Raw_Filepath"]),
+                                  mask_for_means, roi_mask, num_processes,
+                                  covariate_cache)
+
+    # calculate measure means, and demean
+    if "Measure_Mean" in design_formula:
+        model_df = calculate_measure_mean_in_df(model_df, mask_for_means,
+                                                num_processes,
+                                                covariate_cache)
+
+    # calculate custom ROIs, and demean (in workflow?)
+    if roi_mask is not None:
+
         # calculate
-        model_df = calculate_custom_roi_mean_in_df(model_df, roi_mask)
+        model_df = calculate_custom_roi_mean_in_df(model_df, roi_mask,
+                                                   num_processes,
+                                                   covariate_cache)
 
         # update the design formula
         new_design_substring = ""
@@ -849,9 +1094,6 @@ def prep_group_analysis_workflow(model_df, pipeline_config_path, \
         contrasts_dict = create_contrasts_dict(dmatrix, contrasts_list,
             resource_id)
 
-    # check the merged file's order
-    check_merged_file(model_df["Filepath"], merge_file)
-
     # we must demean the categorical regressors if the Intercept/Grand Mean
     # is included in the model, otherwise FLAME produces blank outputs
     if "Intercept" in column_names:
@@ -87,76 +87,264 @@ def load_pheno_csv_into_df(pheno_file):
 
 
 
-def gather_nifti_globs(pipeline_output_folder, resource_list):
+def list_output_directory(directory):
+
+    # lists a directory with scandir when available, which gives whether
+    # each entry is a directory without one more stat call per entry
+    #
+    # input
+    #   directory: full path to the directory
+    #
+    # output
+    #   entries: list of (entry name, is_directory) tuples
+
+    import os
+
+    try:
+        from os import scandir
+    except ImportError:
+        try:
+            from scandir import scandir
+        except ImportError:
+            scandir = None
+
+    if scandir is not None:
+        return [(entry.name, entry.is_dir()) for entry in scandir(directory)]
+
+    return [(name, os.path.isdir(os.path.join(directory, name))) \
+                for name in os.listdir(directory)]
+
+
+
+def index_output_directory(pipeline_output_folder, resource_list, \
+                               index_file=None):
+
+    # indexes the pipeline output directory in a single walk: the folder
+    # itself, each participant's folder, and everything under the folders
+    # of the resources in resource_list
+    #
+    # a directory is only listed again if it was modified since it was
+    # recorded in index_file (a .csv table), which is updated, so later
+    # runs only list what changed
+    #
+    # input
+    #   pipeline_output_folder: full path to the pipeline output directory
+    #   resource_list: names of the resource folders to index
+    #   index_file: (optional) full path to the index table
+    #
+    # output
+    #   dir_index: dictionary of directory -> (modification time, list of
+    #              (entry name, is_directory) tuples)
+
+    import os
+    import pandas as pd
+
+    pipeline_output_folder = os.path.normpath(pipeline_output_folder)
+
+    # the index of the last run
+    old_index = {}
+    if index_file and os.path.isfile(index_file):
+        try:
+            index_df = pd.read_csv(index_file, keep_default_na=False)
+            for directory, dir_df in index_df.groupby("Directory"):
+                entries = [(name, bool(is_dir)) for name, is_dir in \
+                               zip(dir_df["Name"], dir_df["Is_Directory"]) \
+                           if name != ""]
+                old_index[directory] = (int(dir_df["Modified"].iloc[0]), \
+                                        entries)
+        except Exception as e:
+            print "\n\nWARNING: Could not read the output directory " \
+                  "index %s, indexing the whole directory.\nDetails: %s" \
+                  "\n\n" % (index_file, e)
+            old_index = {}
+
+    dir_index = {}
+
+    def index_directory(directory):
+        # modification times in microseconds, stored exactly in the table
+        modified = int(os.stat(directory).st_mtime * 1e6)
+        if (directory in old_index) and \
+                (old_index[directory][0] == modified):
+            entries = old_index[directory][1]
+        else:
+            entries = list_output_directory(directory)
+        dir_index[directory] = (modified, entries)
+        return entries
+
+    resource_set = set(resource_list)
+
+    for part_name, part_is_dir in index_directory(pipeline_output_folder):
+        if not part_is_dir:
+            continue
+        part_dir = os.path.join(pipeline_output_folder, part_name)
+
+        dirs_to_index = [os.path.join(part_dir, name) for name, is_dir \
+                             in index_directory(part_dir) \
+                         if is_dir and name in resource_set]
+
+        while len(dirs_to_index) > 0:
+            directory = dirs_to_index.pop()
+            for name, is_dir in index_directory(directory):
+                if is_dir:
+                    dirs_to_index.append(os.path.join(directory, name))
+
+    if index_file:
+        index_rows = []
+        for directory, (modified, entries) in dir_index.items():
+            if len(entries) == 0:
+                # keep track of empty directories too
+                entries = [("", False)]
+            for name, is_dir in entries:
+                index_rows.append({"Directory": directory, \
+                                   "Modified": modified, "Name": name, \
+                                   "Is_Directory": int(is_dir)})
+
+        index_df = pd.DataFrame(index_rows, columns=["Directory", \
+            "Modified", "Name", "Is_Directory"])
+
+        tmp_file = "%s.%d.tmp" % (index_file, os.getpid())
+        index_df.to_csv(tmp_file, index=False)
+        os.rename(tmp_file, index_file)
+
+    return dir_index
+
+
+
+def walk_output_index(dir_index, top):
+
+    # os.walk, over the output directory index
+
+    import os
+
+    top = os.path.normpath(top)
+
+    if top not in dir_index:
+        return
+
+    entries = dir_index[top][1]
+    dirs = [name for name, is_dir in entries if is_dir]
+    files = [name for name, is_dir in entries if not is_dir]
+
+    yield top, dirs, files
+
+    for name in dirs:
+        for walked in walk_output_index(dir_index, os.path.join(top, name)):
+            yield walked
+
+
+
+def glob_output_index(dir_index, pattern):
+
+    # glob.glob, over the output directory index
+
+    import os
+    import fnmatch
+
+    pattern = os.path.normpath(pattern)
+    dirname, basename = os.path.split(pattern)
+
+    if not any(c in dirname for c in "*?["):
+        dirs = [dirname]
+    else:
+        dirs = glob_output_index(dir_index, dirname)
+
+    magic = any(c in basename for c in "*?[")
+
+    paths = []
+    for directory in dirs:
+        if directory not in dir_index:
+            continue
+        for name, is_dir in dir_index[directory][1]:
+            if magic:
+                if name.startswith(".") or \
+                        not fnmatch.fnmatchcase(name, basename):
+                    continue
+            elif name != basename:
+                continue
+            paths.append(os.path.join(directory, name))
+
+    return paths
+
+
+
+def gather_nifti_paths(pipeline_output_folder, resource_list, dir_index):
 
     # the number of directory levels under each participant's output folder
     # can vary depending on what preprocessing strategies were chosen, and
     # there may be several output filepaths with varying numbers of directory
     # levels
 
-    # this parses them quickly while also catching each preprocessing strategy
+    # this collects the NIFTI files at any level (at least two levels under
+    # the resource folder) from the output directory index
 
     import os
-    import glob
-    from __builtin__ import any as b_any
+    import fnmatch
 
     ext = ".nii"
-    nifti_globs = []
+    nifti_paths = []
 
     if len(resource_list) == 0:
         err = "\n\n[!] No derivatives selected!\n\n"
         raise Exception(err)
 
-    # remove any extra /'s
-    pipeline_output_folder = pipeline_output_folder.rstrip("/")
-
-    # grab MeanFD_Jenkinson just in case
-    resource_list.append("power_params")
+    pipeline_output_folder = os.path.normpath(pipeline_output_folder)
 
     print "\n\nGathering the output file paths from %s..." \
           % pipeline_output_folder
 
     for resource_name in resource_list:
 
-        glob_string = os.path.join(pipeline_output_folder, "*", \
-                                       resource_name, "*", "*")
-
-        # get all glob strings that result in a list of paths where every path
-        # ends with a NIFTI file
-        
-        prog_string = ".."
-
-        while len(glob.glob(glob_string)) != 0:
-
-            if b_any(ext in x for x in glob.glob(glob_string)) == True:
-                nifti_globs.append(glob_string)
-        
-            glob_string = os.path.join(glob_string, "*")
-            prog_string = prog_string + "."
-            print prog_string
-
-    if len(nifti_globs) == 0:
+        resource_dirs = glob_output_index(dir_index, \
+            os.path.join(pipeline_output_folder, "*", resource_name))
+
+        for resource_dir in resource_dirs:
+            for root, dirs, files in walk_output_index(dir_index, \
+                                                       resource_dir):
+                if root == resource_dir:
+                    continue
+                # skip hidden directories, as glob does
+                if any(level.startswith(".") for level in \
+                           root[len(resource_dir):].split(os.sep)):
+                    continue
+                for name in dirs + files:
+                    if fnmatch.fnmatchcase(name, "*" + ext + "*") and \
+                            not name.startswith("."):
+                        nifti_paths.append(os.path.join(root, name))
+
+    if len(nifti_paths) == 0:
         err = "\n\n[!] No output filepaths found in the pipeline output " \
               "directory provided for the derivatives selected!\n\nPipeline "\
-              "output directory provided: %s\nDerivatives selected:\s\n\n" \
+              "output directory provided: %s\nDerivatives selected: %s\n\n" \
               % (pipeline_output_folder, resource_list)
         raise Exception(err)
 
-    return nifti_globs
+    return nifti_paths
 
 
 
-def grab_raw_score_filepath(filepath, resource_id):
+def grab_raw_score_filepath(filepath, resource_id, dir_index=None):
 
     # this lives in the output path collector
+    #   the paths are looked up in the output directory index, if provided
 
     import os
     import glob
 
+    if dir_index is None:
+        glob_paths = glob.glob
+        path_exists = os.path.exists
+    else:
+        glob_paths = lambda pattern: glob_output_index(dir_index, pattern)
+
+        def path_exists(path):
+            dirname, basename = os.path.split(os.path.normpath(path))
+            return (dirname in dir_index) and \
+                (basename in [name for name, is_dir in dir_index[dirname][1]])
+
     if "vmhc" in resource_id:
         raw_score_path = filepath.replace(resource_id,"vmhc_raw_score")
         raw_score_path = raw_score_path.replace(raw_score_path.split("/")[-1],"")
-        raw_score_path = glob.glob(os.path.join(raw_score_path,"*"))[0]
+        raw_score_path = glob_paths(os.path.join(raw_score_path,"*"))[0]
     else:                   
         raw_score_path = filepath.replace("_zstd","")
         raw_score_path = raw_score_path.replace("_fisher","")
@@ -170,21 +358,21 @@ def grab_raw_score_filepath(filepath, resource_id):
             sca_filename = raw_score_path.split("/")[-1]
             globpath = raw_score_path.replace(sca_filename, "*")
             globpath = os.path.join(globpath, sca_filename)
-            raw_score_path = glob.glob(globpath)[0]     
+            raw_score_path = glob_paths(globpath)[0]     
         elif "dr_tempreg_maps" in resource_id:
             raw_score_path = raw_score_path.replace("map_z_","map_")
             raw_filename = raw_score_path.split("/")[-1]
             raw_score_path = raw_score_path.replace(raw_filename,"")
-            raw_score_path = glob.glob(os.path.join(raw_score_path,"*",raw_filename))[0]       
+            raw_score_path = glob_paths(os.path.join(raw_score_path,"*",raw_filename))[0]       
         else:
             # in case filenames are different between z-standardized and raw
             raw_score_path = raw_score_path.replace(raw_score_path.split("/")[-1],"")
             try:
-                raw_score_path = glob.glob(os.path.join(raw_score_path,"*"))[0]
+                raw_score_path = glob_paths(os.path.join(raw_score_path,"*"))[0]
             except:
                 raw_score_path = os.path.join(raw_score_path,"*")
                 
-    if (raw_score_path is None) or (not os.path.exists(raw_score_path)):
+    if (raw_score_path is None) or (not path_exists(raw_score_path)):
         err = "\n\n[!] The filepath for the raw score of " \
               "%s can not be found.\nFilepath: %s\n\nThis " \
               "is needed for the Measure Mean calculation." \
@@ -195,10 +383,19 @@ def grab_raw_score_filepath(filepath, resource_id):
 
 
 
-def find_power_params_file(filepath, resource_id, series_id):
+def find_power_params_file(filepath, resource_id, series_id, \
+                               dir_index=None):
+
+    # the directories are looked up in the output directory index, if
+    # provided
 
     import os
 
+    if dir_index is None:
+        walk = os.walk
+    else:
+        walk = lambda top: walk_output_index(dir_index, top)
+
     try:
         power_path = filepath.replace(resource_id, "power_params", 1)
         series_id_string = "_scan_%s" % series_id
@@ -212,7 +409,7 @@ def find_power_params_file(filepath, resource_id, series_id):
         raise Exception(err)
     
     power_params_file = None
-    for root, dirs, files in os.walk(power_first_half):
+    for root, dirs, files in walk(power_first_half):
         for filename in files:
             filepath = os.path.join(root, filename)
             if "pow_params.txt" in filepath:
@@ -265,69 +462,90 @@ def extract_power_params(power_params_lines, power_params_filepath):
  
 
 
-def create_output_dict_list(nifti_globs, pipeline_output_folder, \
-                                get_motion=False, get_raw_score=False):
+def create_output_dict_list(nifti_paths, pipeline_output_folder, \
+                                get_motion=False, get_raw_score=False, \
+                                dir_index=None, manifest_file=None):
+
+    # the power parameters and raw score files are looked up in the output
+    # directory index, if provided, and all of the outputs found are
+    # written to the manifest_file table (.csv), if provided
 
     import os
-    import glob
+    import pandas as pd
 
-    ext = ".nii"
+    pipeline_output_folder = os.path.normpath(pipeline_output_folder)
 
-    # parse each result of each "valid" glob string
+    # parse each output filepath
     output_dict_list = {}
-    output_df_dict = {}
-
-    for nifti_glob_string in nifti_globs:
+    manifest_rows = []
 
-        nifti_paths = glob.glob(nifti_glob_string + ext + "*")   
+    # several outputs share the same power parameters file
+    power_params_dict = {}
 
-        for filepath in nifti_paths:
+    for filepath in nifti_paths:
         
-            second_half_filepath = filepath.split(pipeline_output_folder)[1]
-            filename = filepath.split("/")[-1]
-            
-            resource_id = second_half_filepath.split("/")[2]
-            series_id_string = second_half_filepath.split("/")[3]
-            strat_info = second_half_filepath.split(series_id_string)[1]
-            
-            unique_resource_id = (resource_id,strat_info)
-                        
-            if unique_resource_id not in output_dict_list.keys():
-                output_dict_list[unique_resource_id] = []
-            
-            unique_id = second_half_filepath.split("/")[1]
+        second_half_filepath = filepath.split(pipeline_output_folder)[1]
+        filename = filepath.split("/")[-1]
+        
+        resource_id = second_half_filepath.split("/")[2]
+        series_id_string = second_half_filepath.split("/")[3]
+        strat_info = second_half_filepath.split(series_id_string)[1]
+        
+        unique_resource_id = (resource_id,strat_info)
+                    
+        if unique_resource_id not in output_dict_list.keys():
+            output_dict_list[unique_resource_id] = []
+        
+        unique_id = second_half_filepath.split("/")[1]
 
-            series_id = series_id_string.replace("_scan_","")
-            series_id = series_id.replace("_rest","")
-            
-            new_row_dict = {}
-            
-            new_row_dict["Participant"] = unique_id
-            new_row_dict["Series"] = series_id
-                                   
-            new_row_dict["Filepath"] = filepath
-                        
-            if get_motion:
-                # if we're including motion measures
-                power_params_file = find_power_params_file(filepath, \
-                    resource_id, series_id)
+        series_id = series_id_string.replace("_scan_","")
+        series_id = series_id.replace("_rest","")
+        
+        new_row_dict = {}
+        
+        new_row_dict["Participant"] = unique_id
+        new_row_dict["Series"] = series_id
+                               
+        new_row_dict["Filepath"] = filepath
+
+        manifest_row = {"Resource": resource_id, "Strategy": strat_info, \
+                        "Participant": unique_id, "Series": series_id, \
+                        "Filepath": filepath, "Power_Params_Filepath": "", \
+                        "Raw_Filepath": ""}
+                    
+        if get_motion:
+            # if we're including motion measures
+            power_params_file = find_power_params_file(filepath, \
+                resource_id, series_id, dir_index)
+            if power_params_file not in power_params_dict.keys():
                 power_params_lines = load_text_file(power_params_file, \
                     "power parameters file")
-                meanfd_p, meanfd_j, meandvars = \
+                power_params_dict[power_params_file] = \
                     extract_power_params(power_params_lines, \
                                          power_params_file)
-                new_row_dict["MeanFD_Power"] = meanfd_p
-                new_row_dict["MeanFD_Jenkinson"] = meanfd_j
-                new_row_dict["MeanDVARS"] = meandvars
-
-            if get_raw_score:
-                # grab raw score for measure mean just in case
-                raw_score_path = grab_raw_score_filepath(filepath, \
-                                                         resource_id)                    
-                new_row_dict["Raw_Filepath"] = raw_score_path
-                       
-            # unique_resource_id is tuple (resource_id,strat_info)
-            output_dict_list[unique_resource_id].append(new_row_dict)
+            meanfd_p, meanfd_j, meandvars = \
+                power_params_dict[power_params_file]
+            new_row_dict["MeanFD_Power"] = meanfd_p
+            new_row_dict["MeanFD_Jenkinson"] = meanfd_j
+            new_row_dict["MeanDVARS"] = meandvars
+            manifest_row["Power_Params_Filepath"] = power_params_file
+
+        if get_raw_score:
+            # grab raw score for measure mean just in case
+            raw_score_path = grab_raw_score_filepath(filepath, \
+                                                     resource_id, dir_index)
+            new_row_dict["Raw_Filepath"] = raw_score_path
+            manifest_row["Raw_Filepath"] = raw_score_path
+                   
+        # unique_resource_id is tuple (resource_id,strat_info)
+        output_dict_list[unique_resource_id].append(new_row_dict)
+        manifest_rows.append(manifest_row)
+
+    if manifest_file:
+        manifest_df = pd.DataFrame(manifest_rows, columns=["Resource", \
+            "Strategy", "Participant", "Series", "Filepath", \
+            "Power_Params_Filepath", "Raw_Filepath"])
+        manifest_df.to_csv(manifest_file, index=False)
 
     return output_dict_list
 
@@ -357,13 +575,34 @@ def create_output_df_dict(output_dict_list, inclusion_list=None):
 
 
 def gather_outputs(pipeline_folder, resource_list, inclusion_list, \
-                       get_motion, get_raw_score):
+                       get_motion, get_raw_score, index_file=None, \
+                       manifest_file=None):
 
     # probably won't have a session list due to subject ID format!
 
-    nifti_globs = gather_nifti_globs(pipeline_folder, resource_list)
-    output_dict_list = create_output_dict_list(nifti_globs, pipeline_folder, \
-                           get_motion, get_raw_score)
+    # the output directory is walked once, indexing the folders of the
+    # resources, of the power parameters and of the raw scores
+    index_resources = list(resource_list)
+    if get_motion:
+        index_resources.append("power_params")
+    if get_raw_score:
+        for resource_name in resource_list:
+            if "vmhc" in resource_name:
+                index_resources.append("vmhc_raw_score")
+            else:
+                raw_name = resource_name.replace("_zstd","")
+                raw_name = raw_name.replace("_fisher","")
+                raw_name = raw_name.replace("_zstat","")
+                index_resources.append(raw_name)
+
+    dir_index = index_output_directory(pipeline_folder, index_resources, \
+                                       index_file)
+
+    nifti_paths = gather_nifti_paths(pipeline_folder, resource_list, \
+                                     dir_index)
+    output_dict_list = create_output_dict_list(nifti_paths, pipeline_folder, \
+                           get_motion, get_raw_score, dir_index, \
+                           manifest_file)
     output_df_dict = create_output_df_dict(output_dict_list, inclusion_list)
 
     return output_df_dict
@@ -573,11 +812,23 @@ def prep_analysis_df_dict(config_file, pipeline_output_folder):
     # - each dataframe will contain output filepaths and their associated
     #   information, and each dataframe will include ALL SERIES/SCANS
     # - the dataframes will be pruned for each model LATER
+    # - the index of the output directory and the manifest of the outputs
+    #   found are kept next to it, so later runs only list what changed
+    pipeline_output_name = \
+        os.path.basename(os.path.normpath(pipeline_output_folder))
+    index_file = os.path.join(c.outputDirectory, \
+                              "%s_output_index.csv" % pipeline_output_name)
+    manifest_file = os.path.join(c.outputDirectory, \
+                                 "%s_output_manifest.csv" \
+                                 % pipeline_output_name)
+
     output_df_dict = gather_outputs(pipeline_output_folder, \
                                         full_output_measure_list, \
                                         full_inclusion_list, \
                                         get_motion, \
-                                        get_raw_score)
+                                        get_raw_score, \
+                                        index_file, \
+                                        manifest_file)
 
 
     # alright, group model processing time
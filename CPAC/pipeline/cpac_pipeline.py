@@ -57,6 +57,8 @@ from CPAC.network_centrality import create_resting_state_graphs, \
                                     get_cent_zscore
 from CPAC.utils.datasource import *
 from CPAC.utils import Configuration, create_all_qc
+from CPAC.utils import functional_size_gb, estimate_memory_gb, \
+                       set_node_resources
 
 ### no create_log_template here, move in CPAC/utils/utils.py
 from CPAC.qc.qc import create_montage, create_montage_gm_wm_csf
@@ -223,6 +225,13 @@ def prep_workflow(sub_dict, c, strategies, run, pipeline_timing_info=None,
     if not os.path.exists(log_dir):
         os.makedirs(os.path.join(log_dir))
 
+    # Size of the subject's functional data and volume of its voxels, from
+    # which the memory of the heavy nodes is estimated for the MultiProc
+    # plugin. They are read before the S3 inputs are prefetched: a subject
+    # whose scans are on S3 gets None, and the nodes their default estimates
+    func_size_gb, func_voxel_volume = \
+        functional_size_gb(sub_dict.get('func', sub_dict.get('rest', {})))
+
     # temp
     already_skullstripped = c.already_skullstripped[0]
     if already_skullstripped == 2:
@@ -387,6 +396,31 @@ def prep_workflow(sub_dict, c, strategies, run, pipeline_timing_info=None,
     except KeyError:
         input_creds_path = None
 
+    # Pull the subject's inputs on S3 into the local cache of S3 downloads
+    # (shared by the subjects and reruns of the pipeline) while the
+    # workflow is built, several at a time; the datasource nodes link them
+    # from there (see CPAC.utils.s3_cache)
+    s3_prefetch = None
+    if run == 1:
+        import threading
+        from CPAC.utils.s3_cache import prefetch_s3_files
+
+        os.environ['CPAC_S3_CACHE'] = os.path.join(c.workingDirectory,
+                                                   's3_cache')
+
+        try:
+            func_paths = sub_dict['func']
+        except KeyError:
+            func_paths = sub_dict.get('rest', {})
+
+        s3_prefetch = threading.Thread(target=prefetch_s3_files,
+                                       args=([sub_dict['anat'], func_paths],
+                                             input_creds_path),
+                                       kwargs={'num_threads':
+                                               c.maxCoresPerParticipant})
+        s3_prefetch.daemon = True
+        s3_prefetch.start()
+
     flow = create_anat_datasource()
     flow.inputs.inputnode.subject = subject_id
     flow.inputs.inputnode.anat = sub_dict['anat']
@@ -1668,9 +1702,13 @@ def prep_workflow(sub_dict, c, strategies, run, pipeline_timing_info=None,
             if 'seg_preproc' in nodes:
             
                 if 'anat_mni_fnirt_register' in nodes:
-                    nuisance = create_nuisance(False, 'nuisance_%d' % num_strat)
+                    nuisance = create_nuisance(False, 'nuisance_%d' % num_strat,
+                                               data_size_gb=func_size_gb,
+                                               voxel_volume=func_voxel_volume)
                 else:
-                    nuisance = create_nuisance(True, 'nuisance_%d' % num_strat)
+                    nuisance = create_nuisance(True, 'nuisance_%d' % num_strat,
+                                               data_size_gb=func_size_gb,
+                                               voxel_volume=func_voxel_volume)
 
                 nuisance.get_node('residuals').iterables = ([('selector', c.Regressors),
                                                              ('compcor_ncomponents', c.nComponents)])
@@ -1744,6 +1782,7 @@ def prep_workflow(sub_dict, c, strategies, run, pipeline_timing_info=None,
 
                 strat.update_resource_pool({'functional_nuisance_residuals':(nuisance, 'outputspec.subject')})
                 strat.update_resource_pool({'functional_nuisance_regressors':(nuisance, 'outputspec.regressors')})
+                strat.update_resource_pool({'functional_nuisance_basis':(nuisance, 'outputspec.basis')})
 
                 create_log_node(nuisance, 'outputspec.subject', num_strat)
             
@@ -1851,10 +1890,19 @@ def prep_workflow(sub_dict, c, strategies, run, pipeline_timing_info=None,
         for strat in strat_list:
             frequency_filter = pe.Node(util.Function(input_names=['realigned_file',
                                                                   'bandpass_freqs',
-                                                                  'sample_period'],
+                                                                  'sample_period',
+                                                                  'memory_limit',
+                                                                  'dtype'],
                                                      output_names=['bandpassed_file'],
                                                      function=bandpass_voxels),
                                        name='frequency_filter_%d' % num_strat)
+            # FFT of the voxels in chunks of at most 0.5 GB
+            frequency_filter.inputs.memory_limit = 0.5
+            # float64 data and filtered data (written with the input's dtype
+            # unless the dtype input is set)
+            set_node_resources(frequency_filter,
+                               memory_gb=estimate_memory_gb(func_size_gb,
+                                                            4, 2.0) + 0.5)
 
             frequency_filter.iterables = ('bandpass_freqs', c.nuisanceBandpassFreq)
             try:
@@ -2377,9 +2425,13 @@ def prep_workflow(sub_dict, c, strategies, run, pipeline_timing_info=None,
             nodes = getNodeList(strat)
             
             if 'func_mni_fsl_warp' in nodes:
-                vmhc = create_vmhc(False, 'vmhc_%d' % num_strat)
+                vmhc = create_vmhc(False, 'vmhc_%d' % num_strat,
+                                   data_size_gb=func_size_gb,
+                                   voxel_volume=func_voxel_volume)
             else:
-                vmhc = create_vmhc(True, 'vmhc_%d' % num_strat, int(num_ants_cores))
+                vmhc = create_vmhc(True, 'vmhc_%d' % num_strat, int(num_ants_cores),
+                                   data_size_gb=func_size_gb,
+                                   voxel_volume=func_voxel_volume)
 
             vmhc.inputs.inputspec.standard_for_func = c.template_skull_for_func
             vmhc.inputs.fwhm_input.fwhm = c.fwhm
@@ -2465,7 +2517,7 @@ def prep_workflow(sub_dict, c, strategies, run, pipeline_timing_info=None,
     if 1 in c.runReHo:
         for strat in strat_list:
 
-            preproc = create_reho()
+            preproc = create_reho(data_size_gb=func_size_gb)
             cluster_size = c.clusterSize
             # Check the cluster size is supported
             if not (cluster_size == 27 or \
@@ -3225,7 +3277,8 @@ def prep_workflow(sub_dict, c, strategies, run, pipeline_timing_info=None,
                 network_centrality = \
                     create_resting_state_graphs(wf_name='network_centrality_%d-%s' \
                                                         % (num_strat, methodOption),
-                                                allocated_memory=c.memoryAllocatedForDegreeCentrality)
+                                                allocated_memory=c.memoryAllocatedForDegreeCentrality,
+                                                num_threads=c.maxCoresPerParticipant)
 
                 # Connect resampled (to template/mask resolution)
                 # functional_mni to inputspec
@@ -5183,9 +5236,6 @@ def prep_workflow(sub_dict, c, strategies, run, pipeline_timing_info=None,
         subject_info_pickle.close()
         '''
 
-        #TODO:set memory and num_threads of critical nodes if running 
-        #MultiProcPlugin
-
         # Create callback logger
         import logging as cb_logging
         cb_log_filename = os.path.join(log_dir,
@@ -5218,8 +5268,22 @@ def prep_workflow(sub_dict, c, strategies, run, pipeline_timing_info=None,
             logger.error(err_msg)
             #raise Exception(err_msg)
 
+        # Masked functional data shared by the nodes of the subject, as
+        # uncompressed arrays (see CPAC.utils.data_cache)
+        from CPAC.utils.data_cache import evict_data_cache
+        data_cache_dir = os.path.join(c.workingDirectory, wfname, 'data_cache')
+        os.environ['CPAC_DATA_CACHE'] = data_cache_dir
+
+        # The inputs of the subject are in the S3 cache
+        if s3_prefetch is not None:
+            s3_prefetch.join()
+
         # Actually run the pipeline now, for the current subject
-        workflow.run(plugin=plugin, plugin_args=plugin_args)
+        try:
+            workflow.run(plugin=plugin, plugin_args=plugin_args)
+        finally:
+            evict_data_cache(data_cache_dir)
+            del os.environ['CPAC_DATA_CACHE']
 
         # Dump subject info pickle file to subject log dir
         subject_info['status'] = 'Completed'
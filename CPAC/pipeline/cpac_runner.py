@@ -389,6 +389,189 @@ def append_seeds_to_file(working_dir, seed_list, seed_file):
         return f_name
 
 
+# Estimate the cores and memory a subject's workflow needs
+def subject_resources(c):
+    '''
+    Function to estimate the number of cores and memory (in GB) a single
+    subject's workflow needs, from the pipeline configuration
+
+    Parameters
+    ----------
+    c : Configuration
+        pipeline configuration
+
+    Returns
+    -------
+    num_cores : integer
+        maxCoresPerParticipant, or num_ants_threads if ANTS registration
+        uses more threads
+    memory_gb : float
+        maximumMemoryPerParticipant, or memoryAllocatedForDegreeCentrality
+        if centrality is run and needs more; 0 if neither is set
+    '''
+
+    num_cores = getattr(c, 'maxCoresPerParticipant', None) or 1
+    reg_option = getattr(c, 'regOption', None) or []
+    if 'ANTS' in reg_option:
+        num_cores = max(num_cores, getattr(c, 'num_ants_threads', None) or 1)
+
+    memory_gb = getattr(c, 'maximumMemoryPerParticipant', None) or 0
+    run_centrality = getattr(c, 'runNetworkCentrality', None) or [0]
+    if 1 in run_centrality:
+        memory_gb = max(memory_gb,
+                        getattr(c, 'memoryAllocatedForDegreeCentrality',
+                                None) or 0)
+
+    return int(num_cores), float(memory_gb)
+
+
+# Run a subject in a child process, and signal the scheduler once done
+def _run_subject(done_queue, idx, target, args):
+    '''
+    Function to run a subject's workflow in a child process, putting the
+    subject's index in the done queue when it returns or fails
+
+    Parameters
+    ----------
+    done_queue : multiprocessing.Queue
+        queue read by schedule_subjects to reap finished subjects
+    idx : integer
+        index of the subject in the scheduler's list
+    target : function
+        function running the subject's workflow
+    args : tuple
+        arguments of target
+    '''
+
+    try:
+        target(*args)
+    finally:
+        done_queue.put(idx)
+
+
+# Run the subjects on this computer, as resources become available
+def schedule_subjects(target, args_list, num_cores, memory_gb,
+                      max_subjects, total_cores=None, total_memory_gb=None,
+                      pid_file=None, poll_interval=60):
+    '''
+    Function to run one process per subject, started lazily from a queue:
+    a subject is admitted whenever fewer than `max_subjects` are running
+    and the cores and memory it needs are free (a subject is always
+    admitted when none is running). Finished subjects are reaped as soon
+    as they signal it, freeing their resources for the next subject.
+
+    Parameters
+    ----------
+    target : function
+        function run for each subject (e.g. prep_workflow)
+    args_list : list of tuples
+        arguments of `target` for each subject
+    num_cores : integer
+        cores needed by a subject
+    memory_gb : float
+        memory (in GB) needed by a subject
+    max_subjects : integer
+        maximum number of subjects running at once
+    total_cores : integer, optional
+        cores available (default: all the cores of this computer)
+    total_memory_gb : float, optional
+        memory (in GB) available (default: all the memory of this computer)
+    pid_file : file, optional
+        open file the pid of each subject's process is written to
+    poll_interval : float, optional
+        seconds to wait for a subject to signal it finished; running
+        processes are also checked for having died without signaling it
+        every time a subject finishes or this wait runs out
+
+    Returns
+    -------
+    summary : dictionary
+        number of subjects run and failed, wall time (seconds), throughput
+        (subjects per hour) and slot utilization (fraction of the core-time
+        available to subjects that was used by running subjects)
+    '''
+
+    # Import packages
+    import Queue
+    from collections import deque
+    from multiprocessing import Queue as ProcessQueue, cpu_count
+
+    if total_cores is None:
+        total_cores = cpu_count()
+    if total_memory_gb is None:
+        import psutil
+        total_memory_gb = psutil.virtual_memory().total/(1024.0**3)
+
+    done_queue = ProcessQueue()
+    pending = deque(range(len(args_list)))
+    running = {}
+    durations = []
+    num_failed = 0
+    used_cores = 0
+    used_memory_gb = 0.0
+
+    run_start = time.time()
+    while pending or running:
+        # Admit subjects while their resources are free
+        while pending and len(running) < max_subjects and \
+                (not running or
+                 (used_cores + num_cores <= total_cores and
+                  used_memory_gb + memory_gb <= total_memory_gb)):
+            idx = pending.popleft()
+            p = Process(target=_run_subject,
+                        args=(done_queue, idx, target, args_list[idx]))
+            p.start()
+            if pid_file is not None:
+                print >>pid_file, p.pid
+                pid_file.flush()
+            running[idx] = (p, time.time())
+            used_cores += num_cores
+            used_memory_gb += memory_gb
+
+        # Wait for a subject to finish
+        try:
+            finished = [done_queue.get(timeout=poll_interval)]
+        except Queue.Empty:
+            finished = []
+        # Processes killed before they could signal it
+        finished += [idx for idx, (p, start) in running.items() \
+                     if not p.is_alive() and idx not in finished]
+
+        for idx in finished:
+            if idx not in running:
+                continue
+            p, start = running.pop(idx)
+            p.join()
+            durations.append(time.time() - start)
+            if p.exitcode != 0:
+                num_failed += 1
+            used_cores -= num_cores
+            used_memory_gb -= memory_gb
+
+    wall_time = time.time() - run_start
+
+    # Core-time available to subjects over the run
+    slot_cores = min(total_cores, max(max_subjects, 1)*num_cores)
+    slot_cores = max(slot_cores, num_cores)
+
+    summary = {'subjects': len(args_list),
+               'failed': num_failed,
+               'wall_time': wall_time,
+               'throughput': 0.0,
+               'slot_utilization': 0.0}
+    if wall_time > 0:
+        summary['throughput'] = 3600.0*len(args_list)/wall_time
+        summary['slot_utilization'] = \
+            num_cores*sum(durations)/(slot_cores*wall_time)
+
+    print '\n\nRun summary: %d subjects (%d failed) in %.1f seconds, ' \
+          '%.2f subjects per hour, %.1f%% slot utilization\n\n' \
+          % (summary['subjects'], summary['failed'], summary['wall_time'],
+             summary['throughput'], 100*summary['slot_utilization'])
+
+    return summary
+
+
 # Run C-PAC subjects via job queue
 def run(config_file, subject_list_file, p_name=None, plugin=None, plugin_args=None):
     '''
@@ -492,10 +675,8 @@ def run(config_file, subject_list_file, p_name=None, plugin=None, plugin_args=No
     # Run on one computer
     else:
         # Init variables
-        procss = [Process(target=prep_workflow,
-                          args=(sub, c, strategies, 1,
-                                pipeline_timing_info, p_name, plugin, plugin_args)) \
-                  for sub in sublist]
+        args_list = [(sub, c, strategies, 1, pipeline_timing_info, p_name,
+                      plugin, plugin_args) for sub in sublist]
 
         if not os.path.exists(c.workingDirectory):
             try:
@@ -507,44 +688,11 @@ def run(config_file, subject_list_file, p_name=None, plugin=None, plugin_args=No
                 raise Exception(err)
                 
         pid = open(os.path.join(c.workingDirectory, 'pid.txt'), 'w')
-        # Init job queue
-        jobQueue = []
-
-        # If we're allocating more processes than are subjects, run them all
-        if len(sublist) <= c.numParticipantsAtOnce:
-            for p in procss:
-                p.start()
-                print >>pid,p.pid
-        # Otherwise manage resources to run processes incrementally
-        else:
-            idx = 0
-            while(idx < len(sublist)):
-                # If the job queue is empty and we haven't started indexing
-                if len(jobQueue) == 0 and idx == 0:
-                    # Init subject process index
-                    idc = idx
-                    # Launch processes (one for each subject)
-                    for p in procss[idc : idc+c.numParticipantsAtOnce]:
-                        p.start()
-                        print >>pid, p.pid
-                        jobQueue.append(p)
-                        idx += 1
-                # Otherwise, jobs are running - check them
-                else:
-                    # Check every job in the queue's status
-                    for job in jobQueue:
-                        # If the job is not alive
-                        if not job.is_alive():
-                            # Find job and delete it from queue
-                            print 'found dead job ', job
-                            loc = jobQueue.index(job)
-                            del jobQueue[loc]
-                            # ...and start the next available process (subject)
-                            procss[idx].start()
-                            # Append this to job queue and increment index
-                            jobQueue.append(procss[idx])
-                            idx += 1
-                    # Add sleep so while loop isn't consuming 100% of CPU
-                    time.sleep(2)
+
+        # Start subjects as their cores and memory become available
+        num_cores, memory_gb = subject_resources(c)
+        schedule_subjects(prep_workflow, args_list, num_cores, memory_gb,
+                          c.numParticipantsAtOnce, pid_file=pid)
+
         # Close PID txt file to indicate finish
         pid.close()
@@ -0,0 +1,178 @@
+"""
+This tests the merging of the participants' maps for group analysis in
+pipeline/cpac_ga_model_generator.py
+"""
+
+import os
+import numpy as np
+import nibabel as nb
+from numpy.testing import *
+
+
+def write_maps(out_dir, num_maps, shape=(5, 6, 4)):
+    np.random.seed(1)
+    affine = np.diag([3.0, 3.0, 3.0, 1.0])
+
+    maps = []
+    map_files = []
+    for i in range(num_maps):
+        data = np.random.randn(*shape).astype(np.float32)
+        # each map has a few zero voxels, missing from the group mask
+        data[i, 0, 0] = 0
+        map_file = os.path.join(out_dir, 'map_%d.nii.gz' % i)
+        nb.Nifti1Image(data, affine).to_filename(map_file)
+        maps.append(data)
+        map_files.append(map_file)
+
+    return maps, map_files
+
+
+def test_create_merged_copefile():
+    import tempfile
+    from CPAC.pipeline.cpac_ga_model_generator import \
+        create_merged_copefile, create_merge_mask, check_merged_file
+
+    out_dir = tempfile.mkdtemp()
+    maps, map_files = write_maps(out_dir, 4)
+
+    merged_file, mask_file, volume_hashes = \
+        create_merged_copefile(map_files,
+                               os.path.join(out_dir, 'merged.nii.gz'),
+                               os.path.join(out_dir, 'merged_mask.nii.gz'))
+
+    merged_img = nb.load(merged_file)
+    assert_equal(merged_img.shape, (5, 6, 4, 4))
+    assert_array_equal(merged_img.get_affine(), np.diag([3.0, 3.0, 3.0, 1.0]))
+    assert_array_equal(merged_img.get_data(), np.stack(maps, axis=3))
+
+    mask = np.all(np.stack(maps, axis=3) != 0, axis=3)
+    assert_array_equal(nb.load(mask_file).get_data(), mask)
+
+    # the same mask, computed from the merged file
+    mask_file = create_merge_mask(merged_file,
+                                  os.path.join(out_dir, 'mask.nii.gz'))
+    assert_array_equal(nb.load(mask_file).get_data(), mask)
+
+    check_merged_file(map_files, merged_file, volume_hashes)
+
+    # the volumes are not in the order of the files
+    assert_raises(Exception, check_merged_file, map_files, merged_file,
+                  volume_hashes[::-1])
+    assert_raises(Exception, check_merged_file, map_files[:3], merged_file,
+                  volume_hashes[:3])
+
+
+def test_create_merged_copefile_shape():
+    import tempfile
+    from CPAC.pipeline.cpac_ga_model_generator import create_merged_copefile
+
+    out_dir = tempfile.mkdtemp()
+    maps, map_files = write_maps(out_dir, 2)
+    other_maps, other_files = write_maps(tempfile.mkdtemp(), 3,
+                                         shape=(5, 6, 5))
+
+    assert_raises(Exception, create_merged_copefile,
+                  map_files + other_files[2:],
+                  os.path.join(out_dir, 'merged.nii.gz'))
+
+
+def test_calculate_covariate_means():
+    import tempfile
+    import cPickle as pickle
+    import pandas as pd
+    from CPAC.pipeline.cpac_ga_model_generator import \
+        calculate_covariate_means, calculate_measure_mean_in_df, \
+        calculate_custom_roi_mean_in_df
+
+    out_dir = tempfile.mkdtemp()
+    maps, map_files = write_maps(out_dir, 3)
+    affine = np.diag([3.0, 3.0, 3.0, 1.0])
+
+    mask = np.ones((5, 6, 4), dtype=np.float32)
+    mask[:, :, 0] = 0
+    mask_file = os.path.join(out_dir, 'mask.nii.gz')
+    nb.Nifti1Image(mask, affine).to_filename(mask_file)
+
+    rois = np.zeros((5, 6, 4), dtype=np.float32)
+    rois[:2] = 4
+    rois[3:, :3] = 2
+    roi_file = os.path.join(out_dir, 'rois.nii.gz')
+    nb.Nifti1Image(rois, affine).to_filename(roi_file)
+
+    measure_means = [m[mask != 0].mean() for m in maps]
+    roi_means = [[m[rois == 2].mean(), m[rois == 4].mean()] for m in maps]
+
+    cache_file = os.path.join(out_dir, 'cache.pkl')
+    for num_processes in [1, 2]:
+        means = calculate_covariate_means(map_files, mask_file, roi_file,
+                                          num_processes, cache_file)
+        assert_array_almost_equal(means[0], measure_means, decimal=5)
+        assert_array_almost_equal(means[1], roi_means, decimal=5)
+
+    # the means of each file and mask are cached
+    cache = pickle.load(open(cache_file, 'rb'))
+    assert_equal(len(cache), 6)
+
+    model_df = pd.DataFrame({'Raw_Filepath': map_files})
+    model_df = calculate_measure_mean_in_df(model_df, mask_file,
+                                            cache_file=cache_file)
+    model_df = calculate_custom_roi_mean_in_df(model_df, roi_file,
+                                               cache_file=cache_file)
+    assert_array_almost_equal(model_df['Measure_Mean'],
+                              measure_means - np.mean(measure_means),
+                              decimal=5)
+    roi_means = np.array(roi_means)
+    for i in range(2):
+        assert_array_almost_equal(
+            model_df['Custom_ROI_Mean_%d' % (i + 1)],
+            roi_means[:, i] - roi_means[:, i].mean(), decimal=5)
+
+
+def test_custom_roi_mean():
+    import tempfile
+    import pandas as pd
+    from CPAC.pipeline.cpac_ga_model_generator import \
+        prepare_custom_roi_mask, calculate_custom_roi_mean_in_df
+
+    out_dir = tempfile.mkdtemp()
+    maps, map_files = write_maps(out_dir, 3)
+    affine = np.diag([3.0, 3.0, 3.0, 1.0])
+
+    group_mask = np.ones((5, 6, 4), dtype=np.float32)
+    group_mask[:, :, 0] = 0
+    group_mask_file = os.path.join(out_dir, 'group_mask.nii.gz')
+    nb.Nifti1Image(group_mask, affine).to_filename(group_mask_file)
+
+    # a custom ROI mask of twice the resolution of the output files
+    rois = np.zeros((10, 12, 8), dtype=np.int16)
+    rois[:4] = 4
+    rois[6:, :6] = 2
+    roi_file = os.path.join(out_dir, 'rois.nii.gz')
+    nb.Nifti1Image(rois, np.diag([1.5, 1.5, 1.5, 1.0])).to_filename(roi_file)
+
+    roi_mask = prepare_custom_roi_mask(map_files[0], roi_file,
+                                       group_mask_file, out_dir, 'alff')
+    assert_equal(os.path.basename(roi_mask), 'masked_resampled_rois.nii.gz')
+
+    # resampled to the grid of the output files, and trimmed to the group
+    # mask
+    trimmed_rois = rois[::2, ::2, ::2] * (group_mask != 0)
+    assert_array_equal(nb.load(roi_mask).get_data(), trimmed_rois)
+
+    model_df = pd.DataFrame({'Raw_Filepath': map_files})
+    model_df = calculate_custom_roi_mean_in_df(model_df, roi_mask)
+
+    roi_means = np.array([[m[trimmed_rois == 2].mean(),
+                           m[trimmed_rois == 4].mean()] for m in maps])
+    for i in range(2):
+        assert_array_almost_equal(
+            model_df['Custom_ROI_Mean_%d' % (i + 1)],
+            roi_means[:, i] - roi_means[:, i].mean(), decimal=5)
+
+    # a mask of the resolution of the output files is only trimmed
+    same_res_file = os.path.join(out_dir, 'same_res_rois.nii.gz')
+    nb.Nifti1Image(rois[::2, ::2, ::2], affine).to_filename(same_res_file)
+    roi_mask = prepare_custom_roi_mask(map_files[0], same_res_file,
+                                       group_mask_file, out_dir)
+    assert_equal(os.path.basename(roi_mask), 'masked_same_res_rois.nii.gz')
+    assert_array_equal(nb.load(roi_mask).get_data(), trimmed_rois)
@@ -0,0 +1,98 @@
+"""
+This tests the indexing of the pipeline output directory in
+pipeline/cpac_group_runner.py
+"""
+
+import os
+from numpy.testing import *
+
+
+def touch(filepath, content=""):
+    if not os.path.isdir(os.path.dirname(filepath)):
+        os.makedirs(os.path.dirname(filepath))
+    f = open(filepath, "w")
+    f.write(content)
+    f.close()
+
+
+def make_output_folder(pipeline_folder, participants):
+    # a pipeline output directory, with two preprocessing strategies of
+    # the z-standardized ALFF, its raw score, and the power parameters
+    for part in participants:
+        for strat in ["_hp_0.01/_fwhm_4", "_hp_0.01/_fwhm_6"]:
+            touch(os.path.join(pipeline_folder, part, "alff_to_standard_zstd",
+                               "_scan_rest_1", strat,
+                               "alff_zstd.nii.gz"))
+            touch(os.path.join(pipeline_folder, part, "alff_to_standard",
+                               "_scan_rest_1", strat, "alff.nii.gz"))
+        touch(os.path.join(pipeline_folder, part, "power_params",
+                           "_scan_rest_1", "_threshold_0.2",
+                           "pow_params.txt"),
+              "Subject,Scan,MeanFD_Power,MeanFD_Jenkinson,MeanDVARS\n"
+              "%s,rest_1,0.1,0.2,0.3\n" % part)
+        touch(os.path.join(pipeline_folder, part, "functional_mni",
+                           "_scan_rest_1", "functional_mni.nii.gz"))
+
+
+def test_gather_outputs():
+    import tempfile
+    from CPAC.pipeline.cpac_group_runner import index_output_directory, \
+        gather_nifti_paths, create_output_dict_list, grab_raw_score_filepath
+
+    out_dir = tempfile.mkdtemp()
+    pipeline_folder = os.path.join(out_dir, "pipeline_test")
+    make_output_folder(pipeline_folder, ["sub001", "sub002"])
+
+    index_file = os.path.join(out_dir, "index.csv")
+    manifest_file = os.path.join(out_dir, "manifest.csv")
+
+    resources = ["alff_to_standard_zstd", "alff_to_standard", "power_params"]
+    dir_index = index_output_directory(pipeline_folder, resources,
+                                       index_file)
+
+    # the folders of the other resources are not indexed
+    assert_equal(os.path.join(pipeline_folder, "sub001", "functional_mni")
+                 in dir_index, False)
+
+    nifti_paths = gather_nifti_paths(pipeline_folder,
+                                     ["alff_to_standard_zstd"], dir_index)
+    assert_equal(len(nifti_paths), 4)
+
+    output_dict_list = create_output_dict_list(nifti_paths, pipeline_folder,
+                                               True, True, dir_index,
+                                               manifest_file)
+    assert_equal(sorted(output_dict_list.keys()),
+                 [("alff_to_standard_zstd", "/_hp_0.01/_fwhm_4/" \
+                                            "alff_zstd.nii.gz"),
+                  ("alff_to_standard_zstd", "/_hp_0.01/_fwhm_6/" \
+                                            "alff_zstd.nii.gz")])
+
+    for row_dicts in output_dict_list.values():
+        for row_dict in row_dicts:
+            assert_equal(row_dict["Series"], "rest_1")
+            assert_equal(row_dict["MeanFD_Jenkinson"], "0.2")
+            # the same raw score as without the index
+            assert_equal(row_dict["Raw_Filepath"],
+                         grab_raw_score_filepath(row_dict["Filepath"],
+                                                 "alff_to_standard_zstd"))
+
+    manifest_lines = open(manifest_file).readlines()
+    assert_equal(len(manifest_lines), 5)
+
+    # a new participant is found on the next run, from the updated index
+    make_output_folder(pipeline_folder, ["sub003"])
+    dir_index = index_output_directory(pipeline_folder, resources,
+                                       index_file)
+    nifti_paths = gather_nifti_paths(pipeline_folder,
+                                     ["alff_to_standard_zstd"], dir_index)
+    assert_equal(len(nifti_paths), 6)
+
+    # a removed output is dropped, as its directory is listed again
+    os.remove(os.path.join(pipeline_folder, "sub001",
+                           "alff_to_standard_zstd", "_scan_rest_1",
+                           "_hp_0.01", "_fwhm_4", "alff_zstd.nii.gz"))
+    dir_index = index_output_directory(pipeline_folder, resources,
+                                       index_file)
+    nifti_paths = gather_nifti_paths(pipeline_folder,
+                                     ["alff_to_standard_zstd"], dir_index)
+    assert_equal(len(nifti_paths), 5)
@@ -0,0 +1,73 @@
+"""
+This tests the subject scheduler in pipeline/cpac_runner.py
+"""
+
+import os
+import time
+from numpy.testing import *
+
+
+def touch_subject(out_dir, idx, seconds):
+    # Records the times a subject started and finished
+    start = time.time()
+    time.sleep(seconds)
+    f = open(os.path.join(out_dir, '%d.txt' % idx), 'w')
+    f.write('%r %r' % (start, time.time()))
+    f.close()
+
+
+def failing_subject():
+    raise RuntimeError('subject failed')
+
+
+def killed_subject(seconds):
+    # Sleeps, or exits at once without signaling the scheduler it finished
+    if seconds is None:
+        os._exit(1)
+    time.sleep(seconds)
+
+
+def test_schedule_subjects():
+    import tempfile
+    from CPAC.pipeline.cpac_runner import schedule_subjects
+    
+    out_dir = tempfile.mkdtemp()
+    args_list = [(out_dir, i, 0.2) for i in range(6)]
+    
+    summary = schedule_subjects(touch_subject, args_list, 2, 1.0, 3, 
+                                total_cores=4, total_memory_gb=10.0,
+                                poll_interval=1)
+    assert_equal(summary['subjects'], 6)
+    assert_equal(summary['failed'], 0)
+    
+    # Only 2 subjects of 2 cores fit in 4 cores at any time
+    times = [map(float, open(os.path.join(out_dir, '%d.txt' % i)).read() 
+                 .split()) for i in range(6)]
+    for t, (start, stop) in enumerate(times):
+        running = [1 for s, e in times if s <= start < e]
+        assert len(running) <= 2
+    
+    assert summary['slot_utilization'] > 0
+    assert summary['slot_utilization'] <= 1
+
+
+def test_schedule_subjects_memory():
+    from CPAC.pipeline.cpac_runner import schedule_subjects
+    
+    # A subject needing more memory than available still runs (alone)
+    summary = schedule_subjects(failing_subject, [()] * 2, 1, 8.0, 4, 
+                                total_cores=4, total_memory_gb=4.0,
+                                poll_interval=1)
+    assert_equal(summary['failed'], 2)
+
+
+def test_schedule_subjects_killed():
+    from CPAC.pipeline.cpac_runner import schedule_subjects
+    
+    # A killed subject is reaped when another subject finishes, without
+    # waiting for the poll interval to run out
+    summary = schedule_subjects(killed_subject, [(None,), (0.5,)], 1, 1.0, 2,
+                                total_cores=4, total_memory_gb=4.0,
+                                poll_interval=60)
+    assert_equal(summary['failed'], 1)
+    assert summary['wall_time'] < 30
@@ -609,6 +609,8 @@ def create_wf_calculate_ants_warp(name='create_wf_calculate_ants_warp', mult_inp
     '''
     calculate_ants_warp = pe.Node(interface=util.Function(input_names=['anatomical_brain', 'reference_brain', 'anatomical_skull', 'reference_skull', 'wait'], output_names=['warp_list', 'warped_image'], function=hardcoded_reg), name='calc_ants_warp')
     calculate_ants_warp.interface.num_threads = num_threads
+    # Nonlinear registration of a 1mm anatomical to a 1mm template
+    calculate_ants_warp.interface.estimated_memory_gb = 3.0
 
     select_forward_initial = pe.Node(util.Function(input_names=['warp_list',
             'selection'], output_names=['selected_warp'],
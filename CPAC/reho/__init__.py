@@ -2,10 +2,16 @@ from reho import create_reho
 
 from utils import f_kendall, \
                   compute_reho, \
+                  compute_reho_map, \
+                  rank_timeseries, \
+                  get_neighbourhood_offsets, \
                   getOpString
 
 
 __all__ = ['create_reho', \
            'f_kendall', \
            'getOpString', \
-           'compute_reho']
+           'compute_reho', \
+           'compute_reho_map', \
+           'rank_timeseries', \
+           'get_neighbourhood_offsets']
@@ -9,7 +9,7 @@ import nipype.interfaces.utility as util
 from CPAC.reho.utils import *
 
 
-def create_reho():
+def create_reho(data_size_gb=None):
 
     """
     Regional Homogeneity(ReHo) approach to fMRI data analysis
@@ -19,7 +19,9 @@ def create_reho():
     Parameters
     ----------
 
-    None
+    data_size_gb : float, optional
+        Size of the subject's float32 functional data, from which the memory
+        of the ReHo node is estimated (see `CPAC.utils.functional_size_gb`)
 
     Returns
     -------
@@ -82,6 +84,7 @@ def create_reho():
     """
 
 
+    from CPAC.utils import estimate_memory_gb, set_node_resources
 
 
     reHo = pe.Workflow(name='reHo')
@@ -103,6 +106,9 @@ def create_reho():
                                    output_names=['out_file'],
                      function=compute_reho),
                      name='reho_map')
+    # Data and the ranks of its time-series
+    set_node_resources(raw_reho_map,
+                       memory_gb=estimate_memory_gb(data_size_gb, 3, 2.0))
 
 
     reHo.connect(inputNode, 'rest_res_filt',
@@ -0,0 +1,48 @@
+import numpy as np
+from numpy.testing import assert_array_equal, assert_allclose
+
+
+def reference_ranks(data):
+    """Ranks each row with ties set to the ceiling of their average rank"""
+    ranks = np.zeros(data.shape, dtype=np.int32)
+    for v in range(data.shape[0]):
+        for t in range(data.shape[1]):
+            below = np.sum(data[v] < data[v, t])
+            tied = np.sum(data[v] == data[v, t])
+            ranks[v, t] = np.ceil(below + (tied - 1) / 2.0)
+    return ranks
+
+
+def test_rank_timeseries():
+    from CPAC.reho import rank_timeseries
+
+    data = np.random.randint(0, 5, (50, 20)).astype('float32')
+
+    assert_array_equal(rank_timeseries(data), reference_ranks(data))
+
+
+def test_compute_reho_map():
+    from CPAC.reho import compute_reho_map, f_kendall, \
+                          get_neighbourhood_offsets
+
+    data = np.random.randint(0, 10, (8, 7, 6, 30)).astype('float64')
+    mask = (np.random.random((8, 7, 6)) > 0.3).astype('float64')
+
+    for cluster_size in (7, 19, 27):
+        offsets = get_neighbourhood_offsets(cluster_size)
+        assert len(offsets) == cluster_size
+
+        ref = np.zeros(mask.shape)
+        for i in range(1, mask.shape[0] - 1):
+            for j in range(1, mask.shape[1] - 1):
+                for k in range(1, mask.shape[2] - 1):
+                    if not mask[i, j, k]:
+                        continue
+                    nbrs = [(i+dx, j+dy, k+dz) for (dx, dy, dz) in offsets
+                            if mask[i+dx, j+dy, k+dz] > 0]
+                    ts = np.array([data[n] for n in nbrs])
+                    ref[i, j, k] = f_kendall(reference_ranks(ts).T)
+
+        comp = compute_reho_map(data, mask, cluster_size, chunk_size=17)
+
+        assert_allclose(comp, ref)
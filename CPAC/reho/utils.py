@@ -66,215 +66,234 @@ def f_kendall(timeseries_matrix):
 
     return kcc
 
-def compute_reho(in_file, mask_file, cluster_size):
+def get_neighbourhood_offsets(cluster_size):
 
     """
-    Computes the ReHo Map, by computing tied ranks of the timepoints,
-    followed by computing Kendall's coefficient concordance(KCC) of a timeseries with its neighbours
+    Returns the (x, y, z) offsets of the voxels making up a ReHo neighbourhood
 
     Parameters
     ----------
 
-    in_file : nifti file
-        4D EPI File 
-
-    mask_file : nifti file
-        Mask of the EPI File(Only Compute ReHo of voxels in the mask)
-
     cluster_size : integer
-        for a brain voxel the number of neighbouring brain voxels to use for KCC.
-
+        number of voxels in the neighbourhood (7, 19 or 27)
 
     Returns
     -------
 
-    out_file : nifti file
-        ReHo map of the input EPI image
+    offsets : list of tuples
+        (dx, dy, dz) offsets relative to the center voxel, center included
 
     """
 
-    import nibabel as nb
-    import numpy as np
-    import os
-    import sys
-    from CPAC.reho.utils import f_kendall
+    offsets = []
 
-    out_file = None
+    for dx in (-1, 0, 1):
+        for dy in (-1, 0, 1):
+            for dz in (-1, 0, 1):
 
-    res_fname = (in_file)
-    res_mask_fname = (mask_file)
-    CUTNUMBER = 10
+                dist = abs(dx) + abs(dy) + abs(dz)
 
-#    nvoxel = 27
+                if cluster_size == 7 and dist > 1:
+                    continue
+                if cluster_size == 19 and dist > 2:
+                    continue
 
-    if not (cluster_size == 27 or cluster_size == 19 or cluster_size == 7):
-        cluster_size = 27
+                offsets.append((dx, dy, dz))
 
-    nvoxel = cluster_size
+    return offsets
 
-    res_img = nb.load(res_fname)
-    res_mask_img = nb.load(res_mask_fname)
 
+def rank_timeseries(data):
 
-    res_data = res_img.get_data()
-    res_mask_data = res_mask_img.get_data()
+    """
+    Computes the tied ranks of the timepoints of every row of the input matrix
 
-    print res_data.shape
-    (n_x, n_y, n_z, n_t) = res_data.shape
+    Tied values are assigned the ceiling of their average (zero-based) rank,
+    which is what the original REST implementation of ReHo did.
 
-    res_data = np.reshape(res_data, (n_x*n_y*n_z, n_t), order='F').T
+    Parameters
+    ----------
 
-    Ranks_res_data = np.tile((np.zeros((1, (res_data.shape)[1]))), [(res_data.shape)[0], 1])
-    #Ranks_res_data = np.tile(np.uint16(np.zeros((1, (res_data.shape)[1]))), [(res_data.shape)[0], 1])
+    data : ndarray
+        A matrix of shape (nvoxs, ntpts)
+
+    Returns
+    -------
 
-    segment_length = np.ceil(float((res_data.shape)[1])/float(CUTNUMBER))
+    ranks : ndarray
+        int32 matrix of shape (nvoxs, ntpts) with the ranks of each row
 
-    for icut in range(0, CUTNUMBER):
+    """
 
-        segment = None
+    import numpy as np
 
-        if not (icut == (CUTNUMBER - 1)):
+    nvoxs, ntpts = data.shape
 
-            segment = np.array(np.arange(icut * segment_length, (icut+1) * segment_length))
+    rows = np.arange(nvoxs)[:, np.newaxis]
+    order = np.argsort(data, axis=1, kind='mergesort')
+    sorted_data = data[rows, order]
 
-        else:
+    # Mark the first and last position of every run of tied values
+    starts = np.ones((nvoxs, ntpts), dtype=bool)
+    starts[:, 1:] = sorted_data[:, 1:] != sorted_data[:, :-1]
+    ends = np.ones((nvoxs, ntpts), dtype=bool)
+    ends[:, :-1] = starts[:, 1:]
 
-            segment = np.array(np.arange(icut * segment_length, ((res_data.shape)[1])))
+    positions = np.arange(ntpts, dtype=np.int32)
 
-        segment = np.int64(segment[np.newaxis])
+    first = np.where(starts, positions, 0).astype(np.int32)
+    np.maximum.accumulate(first, axis=1, out=first)
 
-        res_data_piece = res_data[:, segment[0]]
-        nvoxels_piece = (res_data_piece.shape)[1]
+    last = np.where(ends, positions, ntpts - 1).astype(np.int32)
+    last = np.minimum.accumulate(last[:, ::-1], axis=1)[:, ::-1]
 
-        res_data_sorted = np.sort(res_data_piece, 0, kind='mergesort')
-        sort_index = np.argsort(res_data_piece, axis=0, kind='mergesort')
+    ranks = np.empty((nvoxs, ntpts), dtype=np.int32)
+    ranks[rows, order] = (first + last + 1) // 2
 
-        db = np.diff(res_data_sorted, 1, 0)
+    return ranks
 
-        db = db == 0
 
-        sumdb = np.sum(db, 0)
+def compute_reho_map(data, mask, cluster_size=27, chunk_size=10000):
 
-        temp_array = np.array(np.arange(0, n_t))
-        temp_array = temp_array[:, np.newaxis]
+    """
+    Computes the ReHo map of a 4D array for all voxels of the mask at once
 
-        sorted_ranks = np.tile(temp_array, [1, nvoxels_piece])
+    Only voxels within the mask are ranked. The rank vectors of every
+    neighbourhood are summed by gathering shifted (flat) voxel indices,
+    so KCC is evaluated for a whole chunk of voxels in one go.
 
-        if np.any(sumdb[:]):
+    Parameters
+    ----------
 
-            tie_adjust_index = np.flatnonzero(sumdb)
+    data : ndarray
+        4D array of shape (n_x, n_y, n_z, n_t), or 2D array of shape
+        (n_voxels, n_t) with the time-series of the voxels in the mask
+        (in the order of `data[mask > 0]`)
 
-            for i in range(0, len(tie_adjust_index)):
+    mask : ndarray
+        3D mask array (Only Compute ReHo of voxels in the mask)
 
-                ranks = sorted_ranks[:, tie_adjust_index[i]]
+    cluster_size : integer
+        for a brain voxel the number of neighbouring brain voxels to use for KCC.
 
-                ties = db[:, tie_adjust_index[i]]
+    chunk_size : integer
+        number of voxels ranked and summed at a time
 
-                tieloc = np.append(np.flatnonzero(ties), n_t + 2)
-                maxties = len(tieloc)
-                tiecount = 0
+    Returns
+    -------
 
-                while(tiecount < maxties -1):
-                    tiestart = tieloc[tiecount]
-                    ntied = 2
-                    while(tieloc[tiecount + 1] == (tieloc[tiecount] + 1)):
-                        tiecount += 1
-                        ntied += 1
+    K : ndarray
+        3D array with the KCC of every voxel, zero outside of the mask
 
-                    ranks[tiestart:tiestart + ntied ] = np.ceil(np.float32(np.sum(ranks[tiestart:tiestart + ntied ]))/np.float32(ntied))
-                    tiecount += 1
+    """
 
-                sorted_ranks[:, tie_adjust_index[i]] = ranks
+    import numpy as np
+    from CPAC.reho.utils import get_neighbourhood_offsets, rank_timeseries
 
-        del db, sumdb
-        sort_index_base = np.tile(np.multiply(np.arange(0, nvoxels_piece), n_t), [n_t, 1])
-        sort_index += sort_index_base
-        del sort_index_base
+    (n_x, n_y, n_z) = mask.shape
+    n_t = data.shape[-1]
 
-        ranks_piece = np.zeros((n_t, nvoxels_piece))
+    # Voxels that can contribute to a neighbourhood
+    nbr_mask = mask > 0
+    nbr_coords = np.nonzero(nbr_mask)
+    nnbrs = len(nbr_coords[0])
 
-        ranks_piece = ranks_piece.flatten(order='F')
-        sort_index = sort_index.flatten(order='F')
-        sorted_ranks = sorted_ranks.flatten(order='F')
+    # The last row is left as zeros for voxels outside of the mask
+    ranks = np.zeros((nnbrs + 1, n_t), dtype=np.int32)
 
-        ranks_piece[sort_index] = np.array(sorted_ranks)
+    for start in range(0, nnbrs, chunk_size):
+        stop = min(start + chunk_size, nnbrs)
+        if data.ndim == 2:
+            piece = data[start:stop]
+        else:
+            piece = data[nbr_coords[0][start:stop],
+                         nbr_coords[1][start:stop],
+                         nbr_coords[2][start:stop]]
+        ranks[start:stop] = rank_timeseries(piece)
 
-        ranks_piece = np.reshape(ranks_piece, (n_t, nvoxels_piece), order='F')
+    lookup = np.empty(n_x * n_y * n_z, dtype=np.int64)
+    lookup.fill(nnbrs)
+    lookup[np.flatnonzero(nbr_mask)] = np.arange(nnbrs)
 
-#        ranks_piece = np.uint16(ranks_piece)
+    # Voxels for which ReHo is computed, the edges of the volume are skipped
+    centers = mask.astype(np.int64) != 0
+    centers[0, :, :] = centers[-1, :, :] = False
+    centers[:, 0, :] = centers[:, -1, :] = False
+    centers[:, :, 0] = centers[:, :, -1] = False
+    center_idx = np.flatnonzero(centers)
 
-        del sort_index, sorted_ranks
+    offsets = [dx * n_y * n_z + dy * n_z + dz
+               for (dx, dy, dz) in get_neighbourhood_offsets(cluster_size)]
 
-        Ranks_res_data[:, segment[0]] = ranks_piece
+    K = np.zeros((n_x, n_y, n_z))
+    K_flat = K.reshape(-1)
 
-        sys.stdout.write('.')
+    for start in range(0, len(center_idx), chunk_size):
+        idx = center_idx[start:start + chunk_size]
 
+        sr = np.zeros((len(idx), n_t))
+        k = np.zeros(len(idx))
 
-    Ranks_res_data = np.reshape(Ranks_res_data, (n_t, n_x, n_y, n_z), order='F')
+        for offset in offsets:
+            rows = lookup[idx + offset]
+            sr += ranks[rows]
+            k += rows != nnbrs
 
+        sr_bar = sr.mean(1)
+        s = np.sum(np.power(sr, 2), 1) - n_t * np.power(sr_bar, 2)
 
-    K = np.zeros((n_x, n_y, n_z))
+        K_flat[idx] = 12 * s / np.power(k, 2) / (np.power(n_t, 3) - n_t)
 
-    mask_cluster = np.ones((3, 3, 3))
+    return K
 
-    if nvoxel == 19:
-        mask_cluster[0, 0, 0] = 0
-        mask_cluster[0, 2, 0] = 0
-        mask_cluster[2, 0, 0] = 0
-        mask_cluster[2, 2, 0] = 0
-        mask_cluster[0, 0, 2] = 0
-        mask_cluster[0, 2, 2] = 0
-        mask_cluster[2, 0, 2] = 0
-        mask_cluster[2, 2, 2] = 0
 
-    elif nvoxel == 7:
+def compute_reho(in_file, mask_file, cluster_size):
 
-        mask_cluster[0, 0, 0] = 0
-        mask_cluster[0, 1, 0] = 0
-        mask_cluster[0, 2, 0] = 0
-        mask_cluster[0, 0, 1] = 0
-        mask_cluster[0, 2, 1] = 0
-        mask_cluster[0, 0, 2] = 0
-        mask_cluster[0, 1, 2] = 0
-        mask_cluster[0, 2, 2] = 0
-        mask_cluster[1, 0, 0] = 0
-        mask_cluster[1, 2, 0] = 0
-        mask_cluster[1, 0, 2] = 0
-        mask_cluster[1, 2, 2] = 0
-        mask_cluster[2, 0, 0] = 0
-        mask_cluster[2, 1, 0] = 0
-        mask_cluster[2, 2, 0] = 0
-        mask_cluster[2, 0, 1] = 0
-        mask_cluster[2, 2, 1] = 0
-        mask_cluster[2, 0, 2] = 0
-        mask_cluster[2, 1, 2] = 0
-        mask_cluster[2, 2, 2] = 0
+    """
+    Computes the ReHo Map, by computing tied ranks of the timepoints,
+    followed by computing Kendall's coefficient concordance(KCC) of a timeseries with its neighbours
 
+    Parameters
+    ----------
 
-    for i in range(1, n_x - 1):
+    in_file : nifti file
+        4D EPI File 
 
-        for j in range(1, n_y -1):
+    mask_file : nifti file
+        Mask of the EPI File(Only Compute ReHo of voxels in the mask)
 
-            for k in range(1, n_z -1):
+    cluster_size : integer
+        for a brain voxel the number of neighbouring brain voxels to use for KCC.
 
 
+    Returns
+    -------
 
-                block = Ranks_res_data[:, i-1:i+2, j-1:j+2, k-1:k+2]
-                mask_block = res_mask_data[i-1:i+2, j-1:j+2, k-1:k+2]
+    out_file : nifti file
+        ReHo map of the input EPI image
 
+    """
 
-                if not(int(mask_block[1, 1, 1]) == 0):
+    import nibabel as nb
+    import os
+    from CPAC.reho.utils import compute_reho_map
+    from CPAC.utils.data_cache import extract_masked_data
 
+    out_file = None
 
-                    if nvoxel == 19 or nvoxel == 7:
+    if not (cluster_size == 27 or cluster_size == 19 or cluster_size == 7):
+        cluster_size = 27
 
-                        mask_block = np.multiply(mask_block, mask_cluster)
+    res_img = nb.load(in_file)
+    res_mask_img = nb.load(mask_file)
 
-                    R_block = np.reshape(block, (block.shape[0], 27), order='F')
-                    mask_R_block = R_block[:, np.argwhere(np.reshape(mask_block, (1, 27), order='F') > 0)[:, 1]]
+    res_mask_data = res_mask_img.get_data()
+    # Time-series of the voxels in the mask (from the subject's data cache)
+    res_data = extract_masked_data(in_file, res_mask_data > 0)
 
-                    K[i, j, k] = f_kendall(mask_R_block)
+    print res_img.shape
 
+    K = compute_reho_map(res_data, res_mask_data, cluster_size)
 
     img = nb.Nifti1Image(K, header=res_img.get_header(), affine=res_img.get_affine())
 
@@ -285,5 +304,3 @@ def compute_reho(in_file, mask_file, cluster_size):
     out_file = reho_file
 
     return out_file
-
-
@@ -1,7 +1,13 @@
 from scrubbing import create_scrubbing_preproc, \
                       get_mov_parameters, \
-                      get_indx
+                      get_frames_in, \
+                      get_indx, \
+                      scrub_data, \
+                      scrub_image
 
 __all__ = ['create_scrubbing_preproc', \
            'get_mov_parameters', \
-           'get_indx']
+           'get_frames_in', \
+           'get_indx', \
+           'scrub_data', \
+           'scrub_image']
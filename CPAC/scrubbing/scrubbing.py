@@ -1,4 +1,3 @@
-import nipype.interfaces.afni.preprocess as e_afni
 import nipype.pipeline.engine as pe
 import nipype.interfaces.utility as util
 
@@ -47,10 +46,8 @@ def create_scrubbing_preproc(wf_name = 'scrubbing'):
     - Remove all movement parameters for all the time frames other than those that are present
       in the frames_in_1D file
       
-    - Remove the discarded timepoints from the input image. For details see `3dcalc <http://afni.nimh.nih.gov/pub/dist/doc/program_help/3dcalc.html>`_::
-        
-        3dcalc -a bandpassed_demeaned_filtered.nii.gz[0,1,5,6,7,8,9,10,15,16,17,18,19,20,24,25,287,288,289,290,291,292,293,294,295] 
-               -expr 'a' -prefix bandpassed_demeaned_filtered_3dc.nii.gz
+    - Remove the discarded timepoints from the input image, by selecting the
+      volumes to be kept from its data array in-process (see `scrub_data`)
                
     High Level Workflow Graph:
     
@@ -87,39 +84,20 @@ def create_scrubbing_preproc(wf_name = 'scrubbing'):
                         name='outputspec')
 
 
-    craft_scrub_input = pe.Node(util.Function(input_names=['scrub_input', 'frames_in_1D_file'],
-                                     output_names=['scrub_input_string'],
-                                     function=get_indx),
-               name = 'scrubbing_craft_input_string')
-
-    scrubbed_movement_parameters = pe.Node(util.Function(input_names=['infile_a', 'infile_b'], 
-                                                 output_names=['out_file'],
-                                                 function=get_mov_parameters), 
-                                   name='scrubbed_movement_parameters')
-
-    # THIS commented out until Nipype has an input for this interface that
-    # allows for the selection of specific volumes to include
-    
-    #scrubbed_preprocessed = pe.Node(interface=e_afni.Calc(), 
-    #                           name='scrubbed_preprocessed')
-    #scrubbed_preprocessed.inputs.expr = 'a'
-    #scrubbed_preprocessed.inputs.outputtype = 'NIFTI_GZ'   
-    
-    scrubbed_preprocessed = pe.Node(util.Function(input_names=['scrub_input'],
-                                                  output_names=['scrubbed_image'],
+    scrubbed_preprocessed = pe.Node(util.Function(input_names=['in_file',
+                                                               'frames_in_1D_file',
+                                                               'movement_parameters'],
+                                                  output_names=['scrubbed_image',
+                                                                'scrubbed_movement_parameters'],
                                                   function=scrub_image),
                             name='scrubbed_preprocessed')
 
-    scrub.connect(inputNode, 'preprocessed', craft_scrub_input, 'scrub_input')
-    scrub.connect(inputNode, 'frames_in_1D', craft_scrub_input, 'frames_in_1D_file')
-    
-    scrub.connect(craft_scrub_input, 'scrub_input_string', scrubbed_preprocessed, 'scrub_input')    
-
-    scrub.connect(inputNode, 'movement_parameters', scrubbed_movement_parameters, 'infile_b')
-    scrub.connect(inputNode, 'frames_in_1D', scrubbed_movement_parameters, 'infile_a' )
+    scrub.connect(inputNode, 'preprocessed', scrubbed_preprocessed, 'in_file')
+    scrub.connect(inputNode, 'frames_in_1D', scrubbed_preprocessed, 'frames_in_1D_file')
+    scrub.connect(inputNode, 'movement_parameters', scrubbed_preprocessed, 'movement_parameters')
 
     scrub.connect(scrubbed_preprocessed, 'scrubbed_image', outputNode, 'preprocessed')
-    scrub.connect(scrubbed_movement_parameters, 'out_file', outputNode, 'scrubbed_movement_parameters')
+    scrub.connect(scrubbed_preprocessed, 'scrubbed_movement_parameters', outputNode, 'scrubbed_movement_parameters')
 
     return scrub
 
@@ -147,29 +125,52 @@ def get_mov_parameters(infile_a, infile_b):
         
     """
     import os
-    import warnings
+    import numpy as np
+    from CPAC.scrubbing import get_frames_in
     
     out_file = os.path.join(os.getcwd(), 'rest_mc_scrubbed.1D')
 
-    f1= open(infile_a)
-    f2=open(infile_b)
-    l1=f1.readline()
-    l2=f2.readlines()
-    f1.close()
-    f2.close()
+    frames_in = get_frames_in(infile_a)
+    mov_params = np.loadtxt(infile_b, ndmin=2)
+
+    np.savetxt(out_file, mov_params[frames_in])
+
+    return out_file
+
+
+def get_frames_in(frames_in_1D_file):
+
+    """
+    Method to read the list of time frames
+    that are to be included
     
-    if l1:
-        l1=l1.rstrip(',').split(',')
-        warnings.warn("number of timepoints remaining after scrubbing -> %d"%len(l1))
-    else:
-        raise Exception("No time points remaining after scrubbing.")
+    Parameters
+    ----------
+    frames_in_1D_file : string
+        path to file containing the valid time frames,
+        as a comma-separated list of indices
+    
+    Returns
+    -------
+    frames_in : numpy.ndarray
+        indices of the valid time frames
+    
+    """
+    import warnings
+    import numpy as np
 
-    f = open(out_file, 'a')
-    for l in l1:
-        data=l2[int(l.strip())]
-        f.write(data)
+    f = open(frames_in_1D_file, 'r')
+    line = f.readline().strip().strip(',')
     f.close()
-    return out_file
+
+    if not line:
+        raise Exception("No time points remaining after scrubbing.")
+
+    frames_in = np.array(line.split(','), dtype=np.int64)
+    warnings.warn("number of timepoints remaining after scrubbing -> %d" \
+                  % len(frames_in))
+
+    return frames_in
 
 
 def get_indx(scrub_input, frames_in_1D_file):
@@ -206,34 +207,96 @@ def get_indx(scrub_input, frames_in_1D_file):
     return scrub_input_string
     
     
-def scrub_image(scrub_input):
+def scrub_data(data, mov_params, frames_in):
 
     """
-    Method to run 3dcalc in order to scrub the image. This is used instead of
-    the Nipype interface for 3dcalc because functionality is needed for
-    specifying an input file with specifically-selected volumes. For example:
-        input.nii.gz[2,3,4,..98], etc.
+    Method to remove the discarded time frames from the data
+    of a 4D image and from its movement parameters
+    
+    Parameters
+    ----------
+    data : numpy.ndarray
+        4D data (time on the last axis), possibly memory-mapped, in which
+        case only the volumes to be kept are read
+    mov_params : numpy.ndarray
+        (timepoints x parameters) movement parameters
+    frames_in : numpy.ndarray
+        indices of the time frames to be kept
+    
+    Returns
+    -------
+    scrubbed_data : numpy.ndarray
+        4D data of the kept time frames
+    scrubbed_mov_params : numpy.ndarray
+        movement parameters of the kept time frames
+    
+    """
+    import numpy as np
+
+    frames_in = np.asarray(frames_in)
+    ntpts = data.shape[3]
+
+    if mov_params.shape[0] != ntpts:
+        raise ValueError('Movement parameters of %d time frames conflict ' \
+                         'with image of %d time frames' \
+                         % (mov_params.shape[0], ntpts))
+
+    if frames_in.min() < 0 or frames_in.max() >= ntpts:
+        raise ValueError('Time frames to be kept are out of the range ' \
+                         'of the %d time frames of the image' % ntpts)
+
+    scrubbed_data = np.take(data, frames_in, axis=3)
+    scrubbed_mov_params = mov_params[frames_in]
+
+    return scrubbed_data, scrubbed_mov_params
+
+
+def scrub_image(in_file, frames_in_1D_file, movement_parameters):
+
+    """
+    Method to scrub an image in-process, by selecting the volumes to be
+    kept from its data array (memory-mapped by nibabel for uncompressed
+    files), and writing the scrubbed image once. The movement parameters
+    of the kept time frames are written alongside.
         
     Parameters
     ----------
-    scrub_input : string
-        path to 4D file to be scrubbed, plus with selected volumes to be
-        included
+    in_file : string
+        path to 4D file to be scrubbed
+    frames_in_1D_file : string
+        path to file containing the valid time frames
+    movement_parameters : string
+        path to the file containing motion parameters
         
     Returns
     -------
     scrubbed_image : string
         path to the scrubbed 4D file
+    scrubbed_movement_parameters : string
+        path to the file containing motion parameters
+        for the valid time frames
         
     """
 
     import os
-
-    os.system("3dcalc -a %s -expr 'a' -prefix scrubbed_preprocessed.nii.gz" % scrub_input)
+    import numpy as np
+    import nibabel as nb
+    from CPAC.scrubbing import get_frames_in, scrub_data
 
     scrubbed_image = os.path.join(os.getcwd(), "scrubbed_preprocessed.nii.gz")
+    scrubbed_movement_parameters = os.path.join(os.getcwd(),
+                                                'rest_mc_scrubbed.1D')
 
-    return scrubbed_image
+    frames_in = get_frames_in(frames_in_1D_file)
 
-    
-    
+    img = nb.load(in_file)
+    mov_params = np.loadtxt(movement_parameters, ndmin=2)
+
+    scrubbed_data, scrubbed_mov_params = scrub_data(img.get_data(),
+                                                    mov_params, frames_in)
+
+    nb.Nifti1Image(scrubbed_data, img.get_affine(),
+                   img.get_header()).to_filename(scrubbed_image)
+    np.savetxt(scrubbed_movement_parameters, scrubbed_mov_params)
+
+    return scrubbed_image, scrubbed_movement_parameters
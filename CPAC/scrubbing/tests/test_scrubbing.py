@@ -0,0 +1,51 @@
+"""
+This tests the functions in scrubbing/scrubbing.py
+"""
+
+import os
+import numpy as np
+import nibabel as nib
+from numpy.testing import *
+
+
+def test_scrub_image():
+    import tempfile
+    from CPAC.scrubbing import scrub_image
+    
+    data = np.random.standard_normal((5, 6, 4, 25)).astype('float32')
+    mov_params = np.random.standard_normal((25, 6))
+    frames_in = [0, 1, 2, 5, 6, 7, 12, 13, 20, 24]
+    
+    cwd = os.getcwd()
+    tmpdir = tempfile.mkdtemp()
+    os.chdir(tmpdir)
+    try:
+        nib.Nifti1Image(data, np.eye(4)).to_filename('rest.nii')
+        np.savetxt('rest_mc.1D', mov_params)
+        f = open('frames_in.1D', 'w')
+        f.write('%s,' % ','.join(str(i) for i in frames_in))
+        f.close()
+        
+        scrubbed_image, scrubbed_movement_parameters = \
+            scrub_image('rest.nii', 'frames_in.1D', 'rest_mc.1D')
+        
+        assert_equal(os.path.basename(scrubbed_image), 
+                     'scrubbed_preprocessed.nii.gz')
+        assert_equal(os.path.basename(scrubbed_movement_parameters), 
+                     'rest_mc_scrubbed.1D')
+        
+        img = nib.load(scrubbed_image)
+        assert_equal(img.shape, (5, 6, 4, len(frames_in)))
+        assert_array_equal(img.get_data(), data[..., frames_in])
+        assert_allclose(np.loadtxt(scrubbed_movement_parameters), 
+                        mov_params[frames_in])
+    finally:
+        os.chdir(cwd)
+
+
+def test_scrub_data_range():
+    from CPAC.scrubbing import scrub_data
+    
+    data = np.zeros((2, 2, 2, 10))
+    assert_raises(ValueError, scrub_data, data, np.zeros((10, 6)), [0, 10])
+    assert_raises(ValueError, scrub_data, data, np.zeros((9, 6)), [0, 1])
@@ -5,6 +5,8 @@ from timeseries_analysis import create_surface_registration, \
                                 gen_vertices_timeseries, \
                                 gen_voxel_timeseries, \
                                 gen_roi_timeseries, \
+                                get_roi_label_index, \
+                                extract_roi_timeseries, \
                                 get_spatial_map_timeseries
 
 __all__ = ['create_surface_registration', \
@@ -14,4 +16,6 @@ __all__ = ['create_surface_registration', \
            'gen_vertices_timeseries', \
            'gen_voxel_timeseries', \
            'gen_roi_timeseries', \
+           'get_roi_label_index', \
+           'extract_roi_timeseries', \
            'get_spatial_map_timeseries']
@@ -0,0 +1,93 @@
+"""
+This tests the functions in timeseries/timeseries_analysis.py
+"""
+
+import os
+import numpy as np
+import nibabel as nib
+from numpy.testing import *
+
+
+def test_gen_roi_timeseries():
+    import tempfile
+    from CPAC.timeseries import gen_roi_timeseries, get_roi_label_index
+    
+    data = np.random.standard_normal((6, 7, 5, 30)).astype('float32')
+    rois = np.random.randint(0, 8, (6, 7, 5)).astype('float32')
+    rois[rois == 3] = 0
+    
+    cwd = os.getcwd()
+    tmpdir = tempfile.mkdtemp()
+    os.chdir(tmpdir)
+    try:
+        nib.Nifti1Image(data, np.eye(4)).to_filename('rest.nii.gz')
+        nib.Nifti1Image(rois, np.eye(4)).to_filename('atlas.nii.gz')
+    
+        out_list = gen_roi_timeseries('rest.nii.gz', 'atlas.nii.gz',
+                                      [True, True])
+        assert_equal([os.path.basename(f) for f in out_list],
+                     ['roi_atlas.1D', 'roi_atlas.txt', 'roi_atlas.csv', 
+                      'roi_atlas.npz'])
+    
+        # Reference: mean of the voxels of each node
+        nodes = [1, 2, 4, 5, 6, 7]
+        ref = np.array([ data[rois == n].mean(0) for n in nodes ])
+    
+        roi_1D = np.loadtxt(out_list[0])
+        assert_allclose(roi_1D, ref.T, atol=1e-6)
+        assert_equal(open(out_list[0]).readline().split(), 
+                     ['#%i' % n for n in nodes])
+        roi_csv = np.loadtxt(out_list[2], delimiter=',', skiprows=1)
+        assert_equal(roi_csv[:,0], nodes)
+        assert_allclose(roi_csv[:,1:], ref, atol=1e-6)
+        roi_npz = np.load(out_list[3])
+        assert_allclose(roi_npz['roi_data'], ref, atol=1e-6)
+        assert_equal(list(roi_npz['roi_numbers']), [str(n) for n in nodes])
+    
+        # The label index is only built once per mask
+        assert get_roi_label_index('atlas.nii.gz') is \
+               get_roi_label_index(os.path.join(tmpdir, 'atlas.nii.gz'))
+    finally:
+        os.chdir(cwd)
+
+
+def test_gen_voxel_timeseries():
+    import tempfile
+    from CPAC.timeseries import gen_voxel_timeseries
+    
+    data = np.random.standard_normal((6, 7, 5, 25)).astype('float32')
+    mask = np.random.random((6, 7, 5)) > 0.5
+    affine = np.array([[2., 0, 0, -10], [0, 2, 0, 4], [0, 0, 2, -6], 
+                       [0, 0, 0, 1]])
+    
+    cwd = os.getcwd()
+    os.chdir(tempfile.mkdtemp())
+    try:
+        img = nib.Nifti1Image(data, affine)
+        img.set_qform(affine)
+        img.to_filename('rest.nii.gz')
+        nib.Nifti1Image(mask.astype('int16'), affine).to_filename('mask.nii.gz')
+    
+        out_list = gen_voxel_timeseries('rest.nii.gz', 'mask.nii.gz', 
+                                        [True, True])
+        assert_equal([os.path.basename(f) for f in out_list],
+                     ['mask_mask.1D', 'mask_mask.csv', 'mask_mask.npy', 
+                      'mask_mask_xyz.npy'])
+    
+        ref = data[mask].T
+        ref_xyz = np.argwhere(mask)*2 + [-10, 4, -6]
+    
+        assert_allclose(np.loadtxt(out_list[0]), ref.mean(1), atol=1e-6)
+        timeseries = np.load(out_list[2], mmap_mode='r')
+        assert_equal(timeseries.dtype, np.float32)
+        assert_equal(timeseries, ref)
+        assert_allclose(np.load(out_list[3]), ref_xyz)
+    
+        voxel_csv = np.loadtxt(out_list[1], delimiter=',', skiprows=1)
+        assert_equal(voxel_csv[:,0], np.arange(25))
+        assert_equal(voxel_csv[:,1:].astype('float32'), ref)
+        header = open(out_list[1]).readline().strip()
+        assert header.startswith('volume/xyz,"(%r, %r, %r)"' % 
+                                 tuple(ref_xyz[0].astype('float')))
+    finally:
+        os.chdir(cwd)
@@ -205,16 +205,17 @@ def get_voxel_timeseries(wf_name='voxel_timeseries'):
         inputspec.rest : string  (nifti file)
             path to input functional data
         inputspec.output_type : string (list of boolean)
-            list of boolean for csv and npz file formats
+            list of boolean for csv and npy file formats
         input_mask.masks : string (nifti file)
             path to ROI mask
         
     Workflow Outputs::
     
-        outputspec.mask_outputs: string (1D, csv and/or npz files)
+        outputspec.mask_outputs: string (1D, csv and/or npy files)
             list of time series matrices stored in csv and/or
-            npz files.By default it outputs mean of voxels 
-            across each time point in a afni compatible 1D file.
+            npy files (timeseries and voxel coordinates). By default it 
+            outputs mean of voxels across each time point in a afni 
+            compatible 1D file.
     
         High Level Workflow Graph:
     
@@ -554,6 +555,95 @@ def get_normalized_moments(wf_name='normalized_moments'):
 
 
 
+# Label indices of the ROI masks already read by this process, keyed by
+# (path, modification time) of the mask
+_roi_label_indices = {}
+
+
+def get_roi_label_index(template):
+    """
+    Method to index the voxels of each node in an roi mask, once per mask
+    (the index is cached for the lifetime of the process)
+
+    Parameters
+    ----------
+    template : string
+        path to input roi mask in functional native space
+
+    Returns
+    -------
+    roi_mask : numpy.ndarray
+        3D boolean array of the voxels belonging to any node
+    roi_numbers : numpy.ndarray
+        sorted (positive) node numbers
+    averaging : scipy.sparse.csr_matrix
+        (nodes x voxels in `roi_mask`) matrix averaging the voxels of each
+        node
+
+    """
+    import os
+    import nibabel as nib
+    import numpy as np
+    import scipy.sparse as sparse
+
+    key = (os.path.realpath(template), os.path.getmtime(template))
+    if key in _roi_label_indices:
+        return _roi_label_indices[key]
+
+    unit_data = nib.load(template).get_data()
+    # Cast as rounded-up integer
+    unit_data = np.int64(np.ceil(unit_data))
+    roi_mask = unit_data > 0
+
+    roi_numbers, voxel_nodes = np.unique(unit_data[roi_mask],
+                                         return_inverse=True)
+    node_sizes = np.bincount(voxel_nodes)
+    averaging = sparse.csr_matrix((1.0/node_sizes[voxel_nodes],
+                                   (voxel_nodes, np.arange(len(voxel_nodes)))),
+                                  shape=(len(roi_numbers), len(voxel_nodes)))
+
+    _roi_label_indices[key] = (roi_mask, roi_numbers, averaging)
+
+    return _roi_label_indices[key]
+
+
+def extract_roi_timeseries(img_data, label_index, chunk_size=100):
+    """
+    Method to compute the mean timeseries of every node in an roi mask
+
+    Parameters
+    ----------
+    img_data : numpy.ndarray
+        4D functional data (may be memory-mapped), or 2D (voxels x
+        timepoints) data of the voxels in the mask of `label_index`
+    label_index : tuple
+        output of `get_roi_label_index`
+    chunk_size : integer
+        number of timepoints read at a time
+
+    Returns
+    -------
+    roi_data : numpy.ndarray
+        (nodes x timepoints) mean timeseries of each node
+
+    """
+    import numpy as np
+
+    roi_mask, roi_numbers, averaging = label_index
+    vol = img_data.shape[-1]
+
+    roi_data = np.empty((len(roi_numbers), vol))
+    for start in range(0, vol, chunk_size):
+        stop = min(start + chunk_size, vol)
+        if img_data.ndim == 2:
+            chunk = np.asarray(img_data[:, start:stop])
+        else:
+            chunk = np.asarray(img_data[..., start:stop])[roi_mask]
+        roi_data[:, start:stop] = averaging.dot(chunk.astype(np.float64))
+
+    return roi_data
+
+
 def gen_roi_timeseries(data_file,
                        template,
                        output_type):
@@ -585,29 +675,25 @@ def gen_roi_timeseries(data_file,
 
     """
     import nibabel as nib
-    import csv
     import numpy as np
     import os
     import shutil
+    from CPAC.timeseries.timeseries_analysis import get_roi_label_index, \
+                                                    extract_roi_timeseries
+    from CPAC.utils.data_cache import extract_masked_data
 
-    unit_data = nib.load(template).get_data()
-    # Cast as rounded-up integer
-    unit_data = np.int64(np.ceil(unit_data))
+    label_index = get_roi_label_index(template)
+    roi_mask, roi_numbers, averaging = label_index
     datafile = nib.load(data_file)
-    img_data = datafile.get_data()
-    vol = img_data.shape[3]
+    vol = datafile.shape[3]
 
-    if unit_data.shape != img_data.shape[:3]:
+    if roi_mask.shape != datafile.shape[:3]:
         raise Exception('\n\n[!] CPAC says: Invalid Shape Error.'\
                         'Please check the voxel dimensions. '\
                         'Data and roi should have the same shape.\n\n')
 
-    nodes = np.unique(unit_data).tolist()
-    sorted_list = []
-    node_dict = {}
     out_list = []
 
-
     # extracting filename from input template
     tmp_file = os.path.splitext(
                     os.path.basename(template))[0]
@@ -616,49 +702,19 @@ def gen_roi_timeseries(data_file,
     txt_file = os.path.abspath('roi_' + tmp_file + '.txt')
     csv_file = os.path.abspath('roi_' + tmp_file + '.csv')
     numpy_file = os.path.abspath('roi_' + tmp_file + '.npz')
-    
-    nodes.sort()
-    for n in nodes:
-        if n > 0:
-            node_array = img_data[unit_data == n]
-            node_str = 'node_%s' % (n)
-            avg = np.mean(node_array, axis=0)
-            avg = np.round(avg, 6)
-            list1 = [n] + avg.tolist()
-            sorted_list.append(list1)
-            node_dict[node_str] = avg.tolist()
 
+    # (nodes x timepoints) mean timeseries, from the subject's data cache
+    img_data = extract_masked_data(data_file, roi_mask)
+    roi_data = np.round(extract_roi_timeseries(img_data, label_index), 6)
+    roi_number_list = [str(n) for n in roi_numbers]
+
+    print "roi numbers: ", roi_number_list
 
     # writing to 1Dfile
     print "writing 1D file.."
-    f = open(oneD_file, 'w')
-    writer = csv.writer(f, delimiter='\t')
-
-    value_list = []
-
-    new_keys = sorted([int(float(key.split('node_')[1])) for key in node_dict.keys()])
-
-    roi_number_list = [str(n) for n in new_keys]
-
-    roi_number_str = []
-    for number in roi_number_list:
-
-        roi_number_str.append("#" + number)
-
-
-    print "new keys: ", new_keys
-    print "roi number str: ", roi_number_str
-    for key in new_keys:
-        value_list.append(node_dict['node_%s' % key])
-
-    column_list = zip(*value_list)
-
-
-    writer.writerow(roi_number_str)
-
-    for column in column_list:
-        writer.writerow(list(column))
-    f.close()
+    np.savetxt(oneD_file, roi_data.T, fmt='%.6f', delimiter='\t',
+               header='\t'.join(['#' + n for n in roi_number_list]),
+               comments='')
     out_list.append(oneD_file)
 
     # copy the 1D contents to txt file
@@ -668,19 +724,17 @@ def gen_roi_timeseries(data_file,
     # if csv is required
     if output_type[0]:
         print "writing csv file.."
-        f = open(csv_file, 'wt')
-        writer = csv.writer(f, delimiter=',',
-                                quoting=csv.QUOTE_MINIMAL)
-        headers = ['node/volume'] + np.arange(vol).tolist()
-        writer.writerow(headers)
-        writer.writerows(sorted_list)
-        f.close()
+        np.savetxt(csv_file, np.column_stack([roi_numbers, roi_data]),
+                   fmt=['%d'] + ['%.6f']*vol, delimiter=',',
+                   header=','.join(['node/volume'] + \
+                                   [str(v) for v in range(vol)]),
+                   comments='')
         out_list.append(csv_file)
 
     # if npz file is required
     if output_type[1]:
         print "writing npz file.."
-        np.savez(numpy_file, roi_data=value_list, roi_numbers=roi_number_list)
+        np.savez(numpy_file, roi_data=roi_data, roi_numbers=roi_number_list)
         out_list.append(numpy_file)
 
     return out_list
@@ -701,15 +755,16 @@ def gen_voxel_timeseries(data_file,
         path to input mask in functional native space
     output_type :list
         list of two boolean values suggesting
-        the output types - numpy npz file and csv 
-        format
+        the output types - csv file and numpy (npy) files
         
     Returns
     -------
     out_list : list of files
         Based on ouput_type options method returns a list containing 
-        path to npz and csv file having timeseries of each voxel in 
-        the data that is present in the input mask.The row header 
+        path to csv and npy files having timeseries of each voxel in 
+        the data that is present in the input mask. The npy files hold
+        a (volumes x voxels) float32 array and the (voxels x 3) xyz
+        coordinates of the voxels, both can be memory-mapped. The row header
         corresponds to voxel's xyz cordinates and column headers corresponds 
         to the volume index in the csv. By default it outputs afni compatible 
         1D file with mean of timeseries of voxels across timepoints.
@@ -721,7 +776,6 @@ def gen_voxel_timeseries(data_file,
     """
     import nibabel as nib
     import numpy as np
-    import csv
     import os
 
     unit = nib.load(template)
@@ -730,8 +784,6 @@ def gen_voxel_timeseries(data_file,
     img_data = datafile.get_data()
     header_data = datafile.get_header()
     qform = header_data.get_qform()
-    sorted_list = []
-    vol_dict = {}
     out_list = []
 
     #if unit_data.shape != img_data.shape[:3]:
@@ -743,47 +795,42 @@ def gen_voxel_timeseries(data_file,
                   os.path.basename(template))[0]
     tmp_file = os.path.splitext(tmp_file)[0]
     oneD_file = os.path.abspath('mask_' + tmp_file + '.1D')
-    f = open(oneD_file, 'wt')
-
-    x, y, z = unit_data.shape
 
-    node_array = img_data[unit_data != 0]
-    node_array = node_array.T
+    # Single contiguous (volumes x voxels) array
+    mask = unit_data != 0
+    node_array = np.ascontiguousarray(img_data[mask].T, dtype=np.float32)
     time_points = node_array.shape[0]
-    for t in range(0, time_points):
-        str = 'vol %s' % (t)
-        vol_dict[str] = node_array[t]
-        print >> f, np.round(np.mean(node_array[t]), 6)
-        val = node_array[t].tolist()
-        val.insert(0, t)
-        sorted_list.append(val)
-
-    f.close()
+
+    np.savetxt(oneD_file, np.round(node_array.mean(1, dtype=np.float64), 6),
+               fmt='%.6f')
     out_list.append(oneD_file)
 
+    # xyz coordinates of every voxel, in the order of the columns
+    cordinates = np.argwhere(mask).dot(qform[:3,:3].T) + qform[:3,3]
+
     if output_type[0]:
+        # Streamed a few volumes at a time
         csv_file = os.path.abspath('mask_' + tmp_file + '.csv')
         f = open(csv_file, 'wt')
-        writer = csv.writer(f, delimiter=',',
-                            quoting=csv.QUOTE_MINIMAL)
-        one = np.array([1])
-        headers = ['volume/xyz']
-        cordinates = np.argwhere(unit_data != 0)
-        for val in range(np.alen(cordinates)):
-            ijk_mat = np.concatenate([cordinates[val], one])
-            ijk_mat = ijk_mat.T
-            product = np.dot(qform, ijk_mat)
-            val = tuple(product.tolist()[0:3])
-            headers.append(val)
-        writer.writerow(headers)
-        writer.writerows(sorted_list)
+        headers = ['volume/xyz'] + ['"%s"' % str(tuple(xyz)) 
+                                    for xyz in cordinates.tolist()]
+        f.write(','.join(headers) + '\n')
+        for start in range(0, time_points, 10):
+            stop = min(start + 10, time_points)
+            np.savetxt(f, np.column_stack([np.arange(start, stop),
+                                           node_array[start:stop]]),
+                       fmt=['%d'] + ['%.9g']*node_array.shape[1],
+                       delimiter=',')
         f.close()
         out_list.append(csv_file)
 
     if output_type[1]:
-        numpy_file = os.path.abspath('mask_' + tmp_file + '.npz')
-        np.savez(numpy_file, **dict(vol_dict))
+        numpy_file = os.path.abspath('mask_' + tmp_file + '.npy')
+        np.save(numpy_file, node_array)
         out_list.append(numpy_file)
+        xyz_file = os.path.abspath('mask_' + tmp_file + '_xyz.npy')
+        np.save(xyz_file, cordinates)
+        out_list.append(xyz_file)
 
     return out_list
 
@@ -11,3 +11,11 @@ from .datasource import create_roi_mask_dataflow
 from .datasource import create_grp_analysis_dataflow
 from .datasource import create_spatial_map_dataflow
 from .configuration import Configuration
+from .group_store import create_group_store, load_group_store
+from .data_cache import load_masked_data, extract_masked_data, \
+                        select_masked_data, select_masked_data_list, \
+                        cache_masked_data, evict_data_cache
+from .node_resources import functional_size_gb, estimate_memory_gb, \
+                            resampled_size_factor, set_node_resources
+from .s3_cache import cache_s3_object, evict_s3_cache, link_cached_file, \
+                      prefetch_s3_files
@@ -564,12 +564,99 @@ def return_local_filepaths(path_template, bids_flag=False):
     return matched_paths
 
 
+# List a prefix of an S3 bucket
+def list_s3_prefix(s3_client, bucket_name, prefix, cache_dir=None,
+                   cache_ttl=3600):
+    '''
+    Function to list the sub-prefixes (sub-directories) and the keys
+    directly under a prefix of an S3 bucket, page by page, using '/' as
+    the delimiter; listings are cached for cache_ttl seconds, if a cache
+    directory is given
+
+    Parameters
+    ----------
+    s3_client : boto3 S3 client
+        client to list the bucket with
+    bucket_name : string
+        name of the S3 bucket
+    prefix : string
+        prefix to list under, e.g. 'base_dir/site_1/'
+    cache_dir : string (optional); default=None
+        directory to cache the listings in
+    cache_ttl : float (optional); default=3600
+        number of seconds cached listings are used for
+
+    Returns
+    -------
+    sub_prefixes : list
+        a list of the sub-prefixes, ending with '/'
+    keys : list
+        a list of the keys
+    '''
+
+    # Import packages
+    import hashlib
+    import json
+    import os
+    import time
+
+    # Check for a cached listing
+    if cache_dir is not None:
+        listing_id = hashlib.md5(('%s/%s' % (bucket_name, prefix))
+                                 .encode('utf-8')).hexdigest()
+        cache_file = os.path.join(cache_dir, '%s.json' % listing_id)
+        try:
+            with open(cache_file, 'r') as f:
+                listing = json.load(f)
+            if time.time() - listing['time'] < cache_ttl:
+                return [str(sp) for sp in listing['prefixes']], \
+                       [str(key) for key in listing['keys']]
+        except (IOError, OSError, ValueError, KeyError):
+            pass
+
+    # List the bucket, page by page
+    sub_prefixes = []
+    keys = []
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix,
+                                   Delimiter='/'):
+        for common_prefix in page.get('CommonPrefixes', []):
+            sub_prefixes.append(str(common_prefix['Prefix']))
+        for s3_obj in page.get('Contents', []):
+            keys.append(str(s3_obj['Key']))
+
+    # Cache the listing, renamed into place for concurrent builds
+    if cache_dir is not None:
+        if not os.path.exists(cache_dir):
+            try:
+                os.makedirs(cache_dir)
+            except OSError:
+                if not os.path.isdir(cache_dir):
+                    raise
+        tmp_file = '%s.%d.tmp' % (cache_file, os.getpid())
+        with open(tmp_file, 'w') as f:
+            json.dump({'time': time.time(), 'prefixes': sub_prefixes,
+                       'keys': keys}, f)
+        os.rename(tmp_file, cache_file)
+
+    # Return the sub-prefixes and keys
+    return sub_prefixes, keys
+
+
 # Return matching filepaths
-def return_s3_filepaths(path_template, creds_path=None, bids_flag=False):
+def return_s3_filepaths(path_template, creds_path=None, bids_flag=False,
+                        include_sites=None, include_subs=None,
+                        exclude_subs=None, num_threads=16, cache_dir=None,
+                        cache_ttl=3600):
     '''
     Function to return the filepaths from an S3 bucket given a file
     pattern template and, optionally, credentials
 
+    The bucket is listed one directory level of the template at a time,
+    the prefixes of a level being listed concurrently; only the prefixes
+    matching the template (and the sites and participants to include) at
+    each level are listed further.
+
     Parameters
     ----------
     path_template : string
@@ -583,6 +670,18 @@ def return_s3_filepaths(path_template, creds_path=None, bids_flag=False):
     bids_flag : boolean (optional); default=False
         flag to indicate if the dataset to gather is organized to the
         BIDS standard
+    include_sites : list or string (optional); default=None
+        sites to list the folders of, as in filter_sub_paths
+    include_subs : list or string (optional); default=None
+        participants to list the folders of, as in filter_sub_paths
+    exclude_subs : list or string (optional); default=None
+        participants not to list the folders of, as in filter_sub_paths
+    num_threads : integer (optional); default=16
+        number of prefixes listed at a time
+    cache_dir : string (optional); default=None
+        directory to cache the listings in (see list_s3_prefix)
+    cache_ttl : float (optional); default=3600
+        number of seconds cached listings are used for
 
     Returns
     -------
@@ -595,6 +694,7 @@ def return_s3_filepaths(path_template, creds_path=None, bids_flag=False):
     import logging
     import os
     import re
+    from multiprocessing.pool import ThreadPool
 
     from indi_aws import fetch_creds
 
@@ -613,11 +713,52 @@ def return_s3_filepaths(path_template, creds_path=None, bids_flag=False):
     # Get logger
     logger = logging.getLogger('sublist_builder')
 
-    # Extract base prefix to search through in S3
+    # File pattern filter
     if bids_flag:
-        prefix = path_template.split('*')[0].replace(s3_prefix, '').lstrip('/')
+        file_pattern = path_template
     else:
-        prefix = path_template.split('{site}')[0].replace(s3_prefix, '').lstrip('/')
+        file_pattern = path_template.replace('{site}', '*').\
+                       replace('{participant}', '*').replace('{session}', '*')
+
+    # Directory levels of the pattern and template under the bucket
+    pattern_levels = file_pattern.replace(s3_prefix, '').lstrip('/').split('/')
+    template_levels = path_template.replace(s3_prefix, '').lstrip('/').\
+                      split('/')
+
+    # Sites and participants to prune the listing with, read as in
+    # filter_sub_paths; participant lists that cannot be read are left to
+    # filter_sub_paths
+    prune_ids = []
+    for keyword, include_ids, exclude_ids in \
+            [(site_kw, include_sites, None),
+             (ppant_kw, include_subs, exclude_subs)]:
+        id_lists = []
+        for ids in [include_ids, exclude_ids]:
+            if ids is not None and not isinstance(ids, list):
+                if '.txt' in ids:
+                    ids = read_subj_txtfile(ids) if os.path.exists(ids) \
+                          else None
+                else:
+                    ids = [ids]
+            id_lists.append(ids)
+        levels = [idx for idx, level in enumerate(template_levels) \
+                  if keyword in level]
+        if len(levels) > 0 and id_lists != [None, None]:
+            prune_ids.append((keyword, levels[0], id_lists[0], id_lists[1]))
+
+    def keep_prefix(sub_prefix, level_idx):
+        # Check the site or participant of a prefix
+        for keyword, kw_level_idx, include_ids, exclude_ids in prune_ids:
+            if kw_level_idx != level_idx:
+                continue
+            key_str = extract_keyword_from_path(
+                os.path.join(s3_prefix, sub_prefix.rstrip('/')), keyword,
+                path_template)
+            if include_ids is not None and key_str not in include_ids:
+                return False
+            if exclude_ids is not None and key_str in exclude_ids:
+                return False
+        return True
 
     # Attempt to get bucket
     try:
@@ -628,33 +769,55 @@ def return_s3_filepaths(path_template, creds_path=None, bids_flag=False):
         logger.error(err_msg)
         raise Exception(err_msg)
 
-    # Get filepaths from S3 with prefix
+    # Clients, unlike buckets, can be shared by threads
+    s3_client = bucket.meta.client
+
+    # Get filepaths from S3, level by level
     logger.info('Gathering files from S3 to parse...')
+    prefixes = ['']
     s3_filepaths = []
-    for s3_obj in bucket.objects.filter(Prefix=prefix):
-        s3_filepaths.append(str(s3_obj.key))
-
-    # Prepend 's3://bucket_name/' on found paths
-    s3_filepaths = [os.path.join(s3_prefix, s3_fp) for s3_fp in s3_filepaths]
+    pool = ThreadPool(num_threads)
+    try:
+        for level_idx, level_pattern in enumerate(pattern_levels):
+            last_level = (level_idx == len(pattern_levels) - 1)
 
-    # File pattern filter
-    if bids_flag:
-        file_pattern = path_template
-    else:
-        file_pattern = path_template.replace('{site}', '*').\
-                       replace('{participant}', '*').replace('{session}', '*')
+            # No need to list levels without patterns
+            if not last_level and not re.search(r'[*?\[]', level_pattern):
+                prefixes = [prefix + level_pattern + '/' \
+                            for prefix in prefixes]
+                continue
 
-    # Get only matching s3 paths
-    s3_filepaths = fnmatch.filter(s3_filepaths, file_pattern)
+            # List what starts with the literal beginning of the pattern
+            literal = re.split(r'[*?\[]', level_pattern)[0]
+            listings = pool.map(lambda prefix: \
+                                list_s3_prefix(s3_client, bucket_name,
+                                               prefix + literal, cache_dir,
+                                               cache_ttl),
+                                prefixes)
+
+            next_prefixes = []
+            for prefix, (sub_prefixes, keys) in zip(prefixes, listings):
+                if last_level:
+                    for key in keys:
+                        if fnmatch.fnmatch(key[len(prefix):], level_pattern):
+                            s3_filepaths.append(key)
+                else:
+                    for sub_prefix in sub_prefixes:
+                        if fnmatch.fnmatch(sub_prefix[len(prefix):-1],
+                                           level_pattern) and \
+                                keep_prefix(sub_prefix, level_idx):
+                            next_prefixes.append(sub_prefix)
+            prefixes = next_prefixes
+
+            logger.info('Listed %d prefixes at directory level %d'
+                        % (len(listings), level_idx))
+    finally:
+        pool.close()
+        pool.join()
 
-    # Restrict filepaths and pattern to be of same directory depth
-    # as fnmatch will expand /*/ recursively to .../*/*/...
-    matched_s3_paths = []
-    for s3fp in s3_filepaths:
-        s3_split = s3fp.split('/')
-        fp_split = file_pattern.split('/')
-        if len(s3_split) == len(fp_split):
-            matched_s3_paths.append(s3fp)
+    # Prepend 's3://bucket_name/' on found paths
+    matched_s3_paths = [os.path.join(s3_prefix, s3_fp) \
+                        for s3_fp in s3_filepaths]
 
     # Print how many found
     num_s3_files = len(matched_s3_paths)
@@ -831,10 +994,17 @@ def build_sublist(data_config_yml):
        s3_str in bids_base_dir:
         # Get anatomical filepaths from s3
         print 'Fetching anatomical files...'
-        anat_paths = return_s3_filepaths(anat_template, creds_path, bids_flag)
+        # (the listings, shared by the anatomical and functional files, are
+        # cached for an hour)
+        s3_cache_dir = os.path.join(sublist_outdir, 's3_listing_cache')
+        anat_paths = return_s3_filepaths(anat_template, creds_path, bids_flag,
+                                         include_sites, include_subs,
+                                         exclude_subs, cache_dir=s3_cache_dir)
         # Get functional filepaths from s3
         print 'Fetching functional files...'
-        func_paths = return_s3_filepaths(func_template, creds_path, bids_flag)
+        func_paths = return_s3_filepaths(func_template, creds_path, bids_flag,
+                                         include_sites, include_subs,
+                                         exclude_subs, cache_dir=s3_cache_dir)
 
     # If one is in S3 and the other is not, raise error - not supported
     elif (s3_str in anat_template.lower() and s3_str not in func_template.lower()) or \
@@ -0,0 +1,298 @@
+def get_data_cache_dir(cache_dir=None):
+    """
+    Returns the directory of the per-subject data cache: `cache_dir` if
+    given, else the directory set in the CPAC_DATA_CACHE environment
+    variable (by the pipeline, for the subject being run), else None
+
+    Parameters
+    ----------
+    cache_dir : string, optional
+
+    Returns
+    -------
+    cache_dir : string or None
+    """
+    import os
+
+    if cache_dir is None:
+        cache_dir = os.environ.get('CPAC_DATA_CACHE') or None
+
+    return cache_dir
+
+
+def file_content_hash(in_file, block_size=2**20):
+    """
+    md5 hash of the contents of a file, read `block_size` bytes at a time
+
+    Parameters
+    ----------
+    in_file : string
+
+    Returns
+    -------
+    hash : string
+        hexadecimal digest
+    """
+    import hashlib
+
+    md5 = hashlib.md5()
+    f = open(in_file, 'rb')
+    try:
+        block = f.read(block_size)
+        while block:
+            md5.update(block)
+            block = f.read(block_size)
+    finally:
+        f.close()
+
+    return md5.hexdigest()
+
+
+def cache_masked_data(in_file, cache_dir=None):
+    """
+    Writes the time-series of the voxels of a 4D nifti file with any
+    non-zero time point to the data cache, as uncompressed .npy files that
+    can be memory-mapped, unless the cache already holds them
+
+    Entries are named after the md5 hash of the contents of `in_file`, so
+    every node reading the same file (whatever its path) shares them.
+
+    Parameters
+    ----------
+    in_file : string
+        path of a 4D nifti file
+    cache_dir : string, optional
+        directory of the cache (see `get_data_cache_dir`)
+
+    Returns
+    -------
+    mask_file : string
+        .npy file of the 3D boolean mask of the cached voxels
+    data_file : string
+        .npy file of the (voxels x timepoints) float32 time-series of the
+        voxels in the mask
+    """
+    import os
+    import numpy as np
+
+    cache_dir = get_data_cache_dir(cache_dir)
+    if cache_dir is None:
+        raise ValueError('No data cache directory specified')
+
+    content_hash = file_content_hash(in_file)
+    mask_file = os.path.join(cache_dir, '%s_mask.npy' % content_hash)
+    data_file = os.path.join(cache_dir, '%s_data.npy' % content_hash)
+
+    if os.path.exists(mask_file) and os.path.exists(data_file):
+        return mask_file, data_file
+
+    if not os.path.exists(cache_dir):
+        try:
+            os.makedirs(cache_dir)
+        except OSError:
+            if not os.path.isdir(cache_dir):
+                raise
+
+    mask, data = read_masked_data(in_file)
+
+    # Written under temporary names and renamed, as concurrent nodes may
+    # be caching the same file
+    for out_file, arr in [(data_file, data), (mask_file, mask)]:
+        tmp_file = '%s.%d.tmp.npy' % (out_file[:-4], os.getpid())
+        np.save(tmp_file, arr)
+        os.rename(tmp_file, out_file)
+
+    return mask_file, data_file
+
+
+def read_masked_data(in_file):
+    """
+    Reads the time-series of the voxels of a 4D nifti file with any
+    non-zero time point (without caching them)
+
+    Parameters
+    ----------
+    in_file : string
+        path of a 4D nifti file
+
+    Returns
+    -------
+    mask : numpy.ndarray
+        3D boolean mask of the voxels
+    data : numpy.ndarray
+        (voxels x timepoints) float32 time-series of the voxels in the mask
+    """
+    import nibabel as nb
+    from CPAC.nuisance.utils import masked_timeseries
+
+    img_data = nb.load(in_file).get_data()
+    mask, data = masked_timeseries(img_data, 'float32')
+
+    # masked_timeseries returns a (timepoints x voxels) view
+    return mask, data.T
+
+
+def load_masked_data(in_file, cache_dir=None):
+    """
+    Returns the time-series of the voxels of a 4D nifti file with any
+    non-zero time point, memory-mapped from the data cache when a cache
+    directory is set (see `get_data_cache_dir`), else read from the file
+
+    Parameters
+    ----------
+    in_file : string
+        path of a 4D nifti file
+    cache_dir : string, optional
+        directory of the cache
+
+    Returns
+    -------
+    mask : numpy.ndarray
+        3D boolean mask of the voxels
+    data : numpy.ndarray or numpy.memmap
+        (voxels x timepoints) float32 time-series of the voxels in the mask
+        (read-only when memory-mapped)
+    """
+    import numpy as np
+
+    if get_data_cache_dir(cache_dir) is None:
+        return read_masked_data(in_file)
+
+    mask_file, data_file = cache_masked_data(in_file, cache_dir)
+
+    return np.load(mask_file), np.load(data_file, mmap_mode='r')
+
+
+def extract_masked_data(in_file, mask, cache_dir=None):
+    """
+    Returns the time-series of the voxels of a 4D nifti file in `mask`,
+    through `load_masked_data`
+
+    Parameters
+    ----------
+    in_file : string
+        path of a 4D nifti file
+    mask : numpy.ndarray
+        3D boolean mask
+    cache_dir : string, optional
+        directory of the cache
+
+    Returns
+    -------
+    data : numpy.ndarray
+        (voxels x timepoints) float32 time-series of the voxels in `mask`
+        (see `select_masked_data`)
+    """
+    data_mask, data = load_masked_data(in_file, cache_dir)
+
+    return select_masked_data(data_mask, data, mask)
+
+
+def select_masked_data(data_mask, data, mask):
+    """
+    Selects the time-series of the voxels in `mask` from the output of
+    `load_masked_data`
+
+    Parameters
+    ----------
+    data_mask : numpy.ndarray
+        3D boolean mask of the voxels in `data`
+    data : numpy.ndarray
+        (voxels x timepoints) time-series of the voxels in `data_mask`
+    mask : numpy.ndarray
+        3D boolean mask
+
+    Returns
+    -------
+    masked_data : numpy.ndarray
+        (voxels x timepoints) float32 time-series of the voxels in `mask`,
+        in the order of `data[mask]` for the 4D data; voxels that are not
+        in `data_mask` (zero at all time points) are zero
+    """
+    import numpy as np
+
+    if mask.shape != data_mask.shape:
+        raise ValueError('Mask shape %s conflicts with data shape %s' \
+                         % (str(mask.shape), str(data_mask.shape)))
+
+    # Rows of the voxels of data_mask, in flat index order
+    rows = np.cumsum(data_mask.ravel()) - 1
+    mask = mask.astype('bool')
+    in_data = data_mask[mask]
+
+    masked_data = np.zeros((mask.sum(), data.shape[1]), dtype=np.float32)
+    masked_data[in_data] = data[rows[np.flatnonzero(mask)[in_data]]]
+
+    return masked_data
+
+
+def select_masked_data_list(data_mask, data, masks, chunk_size=10000):
+    """
+    Selects the time-series of the voxels in each of `masks` from the
+    output of `load_masked_data`, in a single pass over `data`, read
+    `chunk_size` voxels at a time
+
+    Parameters
+    ----------
+    data_mask : numpy.ndarray
+        3D boolean mask of the voxels in `data`
+    data : numpy.ndarray
+        (voxels x timepoints) time-series of the voxels in `data_mask`
+    masks : list of numpy.ndarray
+        3D boolean masks
+    chunk_size : integer, optional
+
+    Returns
+    -------
+    masked_data_list : list of numpy.ndarray
+        (voxels x timepoints) float32 time-series of the voxels in each
+        mask, as returned by `select_masked_data`
+    """
+    import numpy as np
+
+    for mask in masks:
+        if mask.shape != data_mask.shape:
+            raise ValueError('Mask shape %s conflicts with data shape %s' \
+                             % (str(mask.shape), str(data_mask.shape)))
+
+    # Rows of the voxels of data_mask, in flat index order
+    rows = np.cumsum(data_mask.ravel()) - 1
+
+    masked_data_list = []
+    selections = []
+    for mask in masks:
+        mask = mask.astype('bool')
+        in_data = data_mask[mask]
+        masked_data_list.append(np.zeros((mask.sum(), data.shape[1]),
+                                         dtype=np.float32))
+        # Rows of data of the voxels of the mask, and their rows in the
+        # output (both increasing)
+        selections.append((rows[np.flatnonzero(mask)[in_data]],
+                           np.flatnonzero(in_data)))
+
+    for start in range(0, data.shape[0], chunk_size):
+        chunk = data[start:start+chunk_size]
+        stop = start + chunk.shape[0]
+        for masked_data, (data_rows, out_rows) in zip(masked_data_list,
+                                                      selections):
+            lo, hi = np.searchsorted(data_rows, [start, stop])
+            masked_data[out_rows[lo:hi]] = chunk[data_rows[lo:hi] - start]
+
+    return masked_data_list
+
+
+def evict_data_cache(cache_dir=None):
+    """
+    Removes the data cache of a subject, once its workflow has finished
+
+    Parameters
+    ----------
+    cache_dir : string, optional
+        directory of the cache (see `get_data_cache_dir`)
+    """
+    import os
+    import shutil
+
+    cache_dir = get_data_cache_dir(cache_dir)
+    if cache_dir is not None and os.path.isdir(cache_dir):
+        shutil.rmtree(cache_dir)
@@ -60,6 +60,8 @@ def check_for_s3(file_path, creds_path, dl_dir=None, img_type='anat'):
     import botocore.exceptions
 
     from indi_aws import fetch_creds
+    from CPAC.utils.s3_cache import get_s3_cache_dir, cache_s3_object, \
+                                    link_cached_file
 
     # Init variables
     s3_str = 's3://'
@@ -88,9 +90,13 @@ def check_for_s3(file_path, creds_path, dl_dir=None, img_type='anat'):
         if not os.path.exists(local_dir):
             os.makedirs(local_dir)
 
-        # Download file
+        # Download file, through the local cache of S3 downloads when the
+        # pipeline sets one (see CPAC.utils.s3_cache)
         try:
-            bucket.download_file(Key=s3_key, Filename=local_path)
+            if get_s3_cache_dir() is not None:
+                link_cached_file(cache_s3_object(bucket, s3_key), local_path)
+            else:
+                bucket.download_file(Key=s3_key, Filename=local_path)
         except botocore.exceptions.ClientError as exc:
             error_code = int(exc.response['Error']['Code'])
             if error_code == 403:
@@ -0,0 +1,69 @@
+def create_group_store(subjects_file_list, mask_file, normalize=False):
+    """
+    Writes the masked data of every subject of a group to uncompressed
+    float32 .npy files, so that group-level nodes can memory-map them
+    (and share the page cache) instead of each loading the whole group.
+
+    Parameters
+    ----------
+    subjects_file_list : list of strings
+        A length `N` list of file paths of the 4D nifti files of subjects
+    mask_file : string
+        Path to a mask file in nifti format
+    normalize : boolean, optional
+        Center and scale every voxel's timeseries to unit norm before
+        storing it (as expected by `CPAC.cwas.calc_cwas` with `normed=True`)
+
+    Returns
+    -------
+    store_files : list of strings
+        A length `N` list of .npy files holding (`T`, `V`) float32 arrays,
+        `V` being the number of voxels in the mask
+    """
+    import os
+    import numpy as np
+    import nibabel as nb
+
+    from CPAC.utils import safe_shape
+
+    mask = nb.load(mask_file).get_data().astype('bool')
+
+    store_files = []
+    for i, subject_file in enumerate(subjects_file_list):
+        data = nb.load(subject_file).get_data()
+        if not safe_shape(data, mask):
+            raise ValueError('Subject %s with volume shape %s conflicts ' \
+                             'with mask shape %s' % (subject_file,
+                                                     str(data.shape[:3]),
+                                                     str(mask.shape)))
+
+        Y = data[mask].T.astype('float64')
+        if normalize:
+            Y -= Y.mean(0)
+            Y /= np.sqrt((Y**2).sum(0))
+
+        store_file = os.path.join(os.getcwd(), 'subject_%04i.npy' % i)
+        np.save(store_file, np.ascontiguousarray(Y, dtype='float32'))
+        store_files.append(store_file)
+
+    print '... group store written for', len(store_files), 'subjects'
+
+    return store_files
+
+
+def load_group_store(store_files):
+    """
+    Memory-maps the arrays of a group store (read-only)
+
+    Parameters
+    ----------
+    store_files : list of strings
+        .npy files, e.g. from `create_group_store`
+
+    Returns
+    -------
+    store : list of numpy.memmap
+    """
+    import numpy as np
+
+    return [np.load(store_file, mmap_mode='r') for store_file in store_files]
@@ -0,0 +1,136 @@
+def functional_size_gb(func_paths):
+    """
+    Size (in GB) of the float32 data of the largest of the 4D nifti files
+    of a subject, and the volume of its voxels, from their headers (the
+    data is not read)
+
+    The size is needed when the subject's workflow is built, before its
+    inputs on S3 are prefetched (see `CPAC.utils.s3_cache`): scans on S3
+    are skipped, so a subject whose scans are all on S3 gets None, and
+    `estimate_memory_gb` falls back to the default estimates of the nodes.
+
+    Parameters
+    ----------
+    func_paths : string, list or dictionary
+        path(s) of the functional scans of a subject, e.g. the 'func' entry
+        of a subject list (nested dictionaries are searched too); paths that
+        are not local nifti files (e.g. on S3) are skipped
+
+    Returns
+    -------
+    size_gb : float or None
+        None if no scan could be read
+    voxel_volume : float or None
+        volume (in mm^3) of the voxels of the largest scan, None if no scan
+        could be read
+    """
+    import os
+    import numpy as np
+    import nibabel as nb
+
+    if isinstance(func_paths, dict):
+        func_paths = func_paths.values()
+    elif isinstance(func_paths, basestring):
+        func_paths = [func_paths]
+
+    size_gb = None
+    voxel_volume = None
+    for func_path in func_paths:
+        if not isinstance(func_path, basestring):
+            scan_size_gb, scan_voxel_volume = functional_size_gb(func_path)
+        elif not os.path.isfile(func_path):
+            continue
+        else:
+            try:
+                hdr = nb.load(func_path).get_header()
+            except Exception:
+                continue
+            shape = hdr.get_data_shape()
+            scan_size_gb = 4*np.prod(shape, dtype=np.float64)/(1024.0**3)
+            scan_voxel_volume = float(np.prod(hdr.get_zooms()[:3]))
+
+        if scan_size_gb is not None and \
+                (size_gb is None or scan_size_gb > size_gb):
+            size_gb = scan_size_gb
+            voxel_volume = scan_voxel_volume
+
+    return size_gb, voxel_volume
+
+
+def resampled_size_factor(voxel_volume, resolution=2.0):
+    """
+    Ratio of the size of functional data resampled to isotropic voxels of
+    `resolution` mm (e.g. for the tissue signals or in standard space) to
+    the size of the data
+
+    Parameters
+    ----------
+    voxel_volume : float or None
+        volume (in mm^3) of the voxels of the data (see
+        `functional_size_gb`)
+    resolution : float, optional
+
+    Returns
+    -------
+    factor : float
+        1.0 if the volume of the voxels is unknown
+    """
+
+    if not voxel_volume:
+        return 1.0
+
+    return voxel_volume/resolution**3
+
+
+def estimate_memory_gb(data_size_gb, copies, default_gb, base_gb=0.25):
+    """
+    Estimated memory (in GB) of a node holding `copies` float32 copies of
+    the functional data at once, on top of `base_gb` for the interpreter
+    and libraries
+
+    Parameters
+    ----------
+    data_size_gb : float or None
+        size of the float32 functional data (see `functional_size_gb`)
+    copies : float
+        number of copies of the data (a float64 copy counts twice, a
+        resampled copy counts `resampled_size_factor` times)
+    default_gb : float
+        estimate used when the size of the data is unknown
+    base_gb : float, optional
+
+    Returns
+    -------
+    memory_gb : float
+    """
+
+    if data_size_gb is None:
+        return default_gb
+
+    return base_gb + copies*data_size_gb
+
+
+def set_node_resources(node, memory_gb=None, num_threads=None):
+    """
+    Declares the memory and threads a node needs, for the MultiProc plugin
+    to schedule it
+
+    Parameters
+    ----------
+    node : nipype.pipeline.engine.Node
+    memory_gb : float, optional
+        estimated memory (in GB)
+    num_threads : integer, optional
+        number of threads
+
+    Returns
+    -------
+    node : nipype.pipeline.engine.Node
+    """
+
+    if memory_gb is not None:
+        node.interface.estimated_memory_gb = memory_gb
+    if num_threads is not None:
+        node.interface.num_threads = num_threads
+
+    return node
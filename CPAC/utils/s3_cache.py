@@ -0,0 +1,294 @@
+def get_s3_cache_dir(cache_dir=None):
+    """
+    Returns the directory of the local cache of S3 downloads: `cache_dir`
+    if given, else the directory set in the CPAC_S3_CACHE environment
+    variable (by the pipeline), else None
+
+    Parameters
+    ----------
+    cache_dir : string, optional
+
+    Returns
+    -------
+    cache_dir : string or None
+    """
+    import os
+
+    if cache_dir is None:
+        cache_dir = os.environ.get('CPAC_S3_CACHE') or None
+
+    return cache_dir
+
+
+def get_s3_cache_size_gb(max_size_gb=None, default_size_gb=20.0):
+    """
+    Returns the size bound (in GB) of the local cache of S3 downloads:
+    `max_size_gb` if given, else the size set in the CPAC_S3_CACHE_SIZE_GB
+    environment variable, else `default_size_gb`
+
+    Parameters
+    ----------
+    max_size_gb : float, optional
+    default_size_gb : float, optional
+
+    Returns
+    -------
+    max_size_gb : float
+    """
+    import os
+
+    if max_size_gb is None:
+        max_size_gb = float(os.environ.get('CPAC_S3_CACHE_SIZE_GB') or
+                            default_size_gb)
+
+    return max_size_gb
+
+
+def parse_s3_path(file_path):
+    """
+    Splits an s3:// path (the "s3" in any case) into its bucket and key
+
+    Parameters
+    ----------
+    file_path : string
+
+    Returns
+    -------
+    bucket_name : string or None
+        None if `file_path` is not on S3
+    s3_key : string or None
+    """
+
+    s3_str = 's3://'
+
+    if not file_path.lower().startswith(s3_str):
+        return None, None
+
+    bucket_name = file_path[len(s3_str):].split('/')[0]
+    s3_key = file_path[len(s3_str) + len(bucket_name):].lstrip('/')
+
+    return bucket_name, s3_key
+
+
+def cache_s3_object(bucket, s3_key, cache_dir=None, max_size_gb=None):
+    """
+    Returns the path of an S3 object in the local cache, downloading it
+    first if the cache does not hold it yet
+
+    Entries are named after the bucket, the key and the ETag of the object,
+    so a modified object is downloaded again. Downloads are written under
+    temporary names and renamed, as concurrent nodes and subjects may be
+    fetching the same object. Least recently used entries are evicted to
+    keep the cache under `max_size_gb`.
+
+    Parameters
+    ----------
+    bucket : boto3 Bucket
+    s3_key : string
+    cache_dir : string, optional
+        directory of the cache (see `get_s3_cache_dir`)
+    max_size_gb : float, optional
+        size bound of the cache (see `get_s3_cache_size_gb`)
+
+    Returns
+    -------
+    cached_path : string
+    """
+    import os
+    import hashlib
+    import threading
+
+    cache_dir = get_s3_cache_dir(cache_dir)
+    if cache_dir is None:
+        raise ValueError('No S3 cache directory specified')
+
+    s3_object = bucket.Object(s3_key)
+    etag = s3_object.e_tag.strip('"')
+
+    entry = hashlib.md5(('%s/%s/%s' % (bucket.name, s3_key, etag))
+                        .encode('utf-8')).hexdigest()
+    entry_dir = os.path.join(cache_dir, entry)
+    cached_path = os.path.join(entry_dir, os.path.basename(s3_key))
+
+    if os.path.exists(cached_path):
+        # Most recently used
+        os.utime(cached_path, None)
+        return cached_path
+
+    if not os.path.exists(entry_dir):
+        try:
+            os.makedirs(entry_dir)
+        except OSError:
+            if not os.path.isdir(entry_dir):
+                raise
+
+    tmp_path = os.path.join(entry_dir, '.%s.%d.%d.tmp'
+                            % (os.path.basename(s3_key), os.getpid(),
+                               threading.current_thread().ident))
+    try:
+        s3_object.download_file(tmp_path)
+        os.rename(tmp_path, cached_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    evict_s3_cache(cache_dir, max_size_gb, keep=[cached_path])
+
+    return cached_path
+
+
+def evict_s3_cache(cache_dir=None, max_size_gb=None, keep=None):
+    """
+    Removes the least recently used entries of the local cache of S3
+    downloads until it is under `max_size_gb`
+
+    Parameters
+    ----------
+    cache_dir : string, optional
+        directory of the cache (see `get_s3_cache_dir`)
+    max_size_gb : float, optional
+        size bound of the cache (see `get_s3_cache_size_gb`)
+    keep : list of strings, optional
+        cached paths not to remove
+    """
+    import os
+
+    cache_dir = get_s3_cache_dir(cache_dir)
+    if cache_dir is None or not os.path.isdir(cache_dir):
+        return
+
+    max_size = get_s3_cache_size_gb(max_size_gb) * 1024**3
+    keep = keep or []
+
+    cached_files = []
+    for entry in os.listdir(cache_dir):
+        entry_dir = os.path.join(cache_dir, entry)
+        if not os.path.isdir(entry_dir):
+            continue
+        for name in os.listdir(entry_dir):
+            # Downloads in progress
+            if name.startswith('.'):
+                continue
+            cached_path = os.path.join(entry_dir, name)
+            try:
+                stat = os.stat(cached_path)
+            except OSError:
+                continue
+            cached_files.append((stat.st_mtime, stat.st_size, cached_path))
+
+    total_size = sum(size for mtime, size, cached_path in cached_files)
+
+    for mtime, size, cached_path in sorted(cached_files):
+        if total_size <= max_size:
+            break
+        if cached_path in keep:
+            continue
+        # Files handed to the pipeline are hard links (see
+        # link_cached_file), so they outlive the entry
+        try:
+            os.remove(cached_path)
+            os.rmdir(os.path.dirname(cached_path))
+        except OSError:
+            pass
+        total_size -= size
+
+
+def link_cached_file(cached_path, local_path):
+    """
+    Hard-links a cached file to `local_path`, or copies it when it cannot
+    be linked (e.g. on another file system)
+
+    Parameters
+    ----------
+    cached_path : string
+    local_path : string
+
+    Returns
+    -------
+    local_path : string
+    """
+    import os
+    import shutil
+
+    if os.path.lexists(local_path):
+        os.remove(local_path)
+
+    try:
+        os.link(cached_path, local_path)
+    except (OSError, AttributeError):
+        tmp_path = '%s.%d.tmp' % (local_path, os.getpid())
+        shutil.copyfile(cached_path, tmp_path)
+        os.rename(tmp_path, local_path)
+
+    return local_path
+
+
+def prefetch_s3_files(file_paths, creds_path=None, cache_dir=None,
+                      max_size_gb=None, num_threads=4):
+    """
+    Downloads the S3 files among `file_paths` to the local cache, several
+    at a time, so the nodes reading them find them there
+
+    Files that cannot be fetched are only reported: the nodes reading them
+    raise the errors.
+
+    Parameters
+    ----------
+    file_paths : string, list or dictionary
+        path(s) of the inputs of a subject, e.g. the 'anat' and 'func'
+        entries of a subject list (nested lists and dictionaries are
+        searched too); paths that are not on S3 are skipped
+    creds_path : string, optional
+        path to the AWS credentials of the buckets
+    cache_dir : string, optional
+        directory of the cache (see `get_s3_cache_dir`)
+    max_size_gb : float, optional
+        size bound of the cache (see `get_s3_cache_size_gb`)
+    num_threads : integer, optional
+        number of concurrent downloads
+
+    Returns
+    -------
+    cached_paths : dictionary
+        cached path of each S3 file, None for files that could not be
+        fetched
+    """
+    from multiprocessing.pool import ThreadPool
+
+    s3_paths = []
+    to_search = [file_paths]
+    while len(to_search) > 0:
+        file_path = to_search.pop(0)
+        if isinstance(file_path, dict):
+            to_search.extend(file_path.values())
+        elif isinstance(file_path, (list, tuple)):
+            to_search.extend(file_path)
+        elif isinstance(file_path, basestring) and \
+                parse_s3_path(file_path)[0] is not None and \
+                file_path not in s3_paths:
+            s3_paths.append(file_path)
+
+    if len(s3_paths) == 0:
+        return {}
+
+    def fetch(file_path):
+        from indi_aws import fetch_creds
+
+        bucket_name, s3_key = parse_s3_path(file_path)
+        try:
+            # Buckets (boto3 resources) are not shared between threads
+            bucket = fetch_creds.return_bucket(creds_path, bucket_name)
+            return file_path, cache_s3_object(bucket, s3_key, cache_dir,
+                                              max_size_gb)
+        except Exception as exc:
+            print 'Could not prefetch %s: %s' % (file_path, exc)
+            return file_path, None
+
+    pool = ThreadPool(min(num_threads, len(s3_paths)))
+    try:
+        cached_paths = dict(pool.map(fetch, s3_paths))
+    finally:
+        pool.close()
+        pool.join()
+
+    return cached_paths
@@ -0,0 +1,53 @@
+"""
+S3 stand-in of moto shared by the tests of the S3 utilities
+"""
+
+
+def mock_s3(*modules):
+    '''
+    Function to start the S3 stand-in of moto, skipping the test when
+    boto3, moto or any of `modules` is not installed
+
+    Parameters
+    ----------
+    modules : strings
+        names of the other modules the test needs (e.g. 'indi_aws')
+
+    Returns
+    -------
+    mock : moto mock
+        to be used as a context manager around the test
+    '''
+
+    from unittest import SkipTest
+
+    for module in ('boto3',) + modules:
+        try:
+            __import__(module)
+        except ImportError:
+            raise SkipTest('%s is not installed' % module)
+    try:
+        from moto import mock_aws
+    except ImportError:
+        try:
+            from moto import mock_s3 as mock_aws
+        except ImportError:
+            raise SkipTest('moto is not installed')
+
+    return mock_aws()
+
+
+def create_bucket(bucket_name, objects):
+    '''
+    Function to create a bucket of the S3 stand-in holding `objects`, a
+    dictionary of the content of each key
+    '''
+
+    import boto3
+
+    s3 = boto3.resource('s3', region_name='us-east-1')
+    bucket = s3.create_bucket(Bucket=bucket_name)
+    for key, content in objects.items():
+        bucket.put_object(Key=key, Body=content)
+
+    return bucket
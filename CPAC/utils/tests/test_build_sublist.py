@@ -0,0 +1,73 @@
+"""
+This tests the S3 listing of utils/build_sublist.py, against the S3
+stand-in of moto
+"""
+
+import os
+import fnmatch
+import tempfile
+from numpy.testing import *
+
+from CPAC.utils.tests.s3_mock import mock_s3, create_bucket
+
+
+def create_dataset_bucket(bucket_name):
+    keys = []
+    for site in ['site_1', 'site_2', 'other']:
+        for sub in ['sub_%d' % i for i in range(3)]:
+            for sess in ['session_1', 'session_2']:
+                keys.append('data/%s/%s/%s/anat/mprage.nii.gz'
+                            % (site, sub, sess))
+                keys.append('data/%s/%s/%s/rest/rest.nii.gz'
+                            % (site, sub, sess))
+                # too deep for the template
+                keys.append('data/%s/%s/%s/anat/extra/mprage.nii.gz'
+                            % (site, sub, sess))
+        keys.append('data/%s/participants.tsv' % site)
+    keys.append('data/README')
+
+    bucket = create_bucket(bucket_name, dict((key, b'') for key in keys))
+
+    return bucket, keys
+
+
+def test_return_s3_filepaths():
+    from CPAC.utils.build_sublist import return_s3_filepaths
+
+    with mock_s3('indi_aws'):
+        bucket, keys = create_dataset_bucket('cpac-test')
+
+        path_template = 's3://cpac-test/data/{site}/{participant}/' \
+                        '{session}/anat/*.nii.gz'
+
+        # the paths found by matching every key of the bucket
+        file_pattern = 's3://cpac-test/data/*/*/*/anat/*.nii.gz'
+        expected = [os.path.join('s3://cpac-test', key) for key in keys
+                    if fnmatch.fnmatch(os.path.join('s3://cpac-test', key),
+                                       file_pattern) and
+                    len(key.split('/')) == 6]
+
+        s3_paths = return_s3_filepaths(path_template, num_threads=4)
+        assert_equal(sorted(s3_paths), sorted(expected))
+        assert_equal(len(s3_paths), 18)
+
+        # only the folders of the sites and participants included
+        s3_paths = return_s3_filepaths(path_template,
+                                       include_sites=['site_1', 'site_2'],
+                                       exclude_subs='sub_0')
+        assert_equal(sorted(s3_paths),
+                     sorted(p for p in expected if '/other/' not in p and
+                            '/sub_0/' not in p))
+
+        # cached listings are used until they expire
+        cache_dir = tempfile.mkdtemp()
+        s3_paths = return_s3_filepaths(path_template, cache_dir=cache_dir)
+        bucket.put_object(Key='data/site_1/sub_9/session_1/anat/t1.nii.gz',
+                          Body=b'')
+        assert_equal(sorted(return_s3_filepaths(path_template,
+                                                cache_dir=cache_dir)),
+                     sorted(s3_paths))
+        assert_equal(len(return_s3_filepaths(path_template,
+                                             cache_dir=cache_dir,
+                                             cache_ttl=0)),
+                     len(s3_paths) + 1)
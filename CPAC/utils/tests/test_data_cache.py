@@ -0,0 +1,61 @@
+"""
+This tests the functions in utils/data_cache.py
+"""
+
+import os
+import shutil
+import tempfile
+import numpy as np
+import nibabel as nib
+from numpy.testing import *
+
+
+def test_data_cache():
+    from CPAC.utils.data_cache import load_masked_data, extract_masked_data, \
+                                      select_masked_data_list, \
+                                      evict_data_cache
+    
+    tmpdir = tempfile.mkdtemp()
+    cache_dir = os.path.join(tmpdir, 'data_cache')
+    
+    data = np.random.standard_normal((6, 7, 5, 20)).astype('float32')
+    data[np.random.random((6, 7, 5)) > 0.6] = 0
+    in_file = os.path.join(tmpdir, 'rest.nii.gz')
+    nib.Nifti1Image(data, np.eye(4)).to_filename(in_file)
+    ref_mask = (data != 0).any(-1)
+    
+    # Without a cache directory, the data is read from the file
+    mask, masked = load_masked_data(in_file)
+    assert_equal(mask, ref_mask)
+    assert_equal(masked, data[ref_mask])
+    
+    mask, masked = load_masked_data(in_file, cache_dir)
+    assert isinstance(masked, np.memmap)
+    assert_equal(mask, ref_mask)
+    assert_equal(masked, data[ref_mask])
+    assert_equal(len(os.listdir(cache_dir)), 2)
+    
+    # Copies of the file share the entries
+    shutil.copy(in_file, os.path.join(tmpdir, 'copy.nii.gz'))
+    load_masked_data(os.path.join(tmpdir, 'copy.nii.gz'), cache_dir)
+    assert_equal(len(os.listdir(cache_dir)), 2)
+    
+    # Voxels of any mask, zero outside of the cached voxels
+    other_mask = np.random.random((6, 7, 5)) > 0.5
+    assert_equal(extract_masked_data(in_file, other_mask, cache_dir), 
+                 data[other_mask])
+    
+    # Several masks in a single pass over the data
+    masks = [np.random.random((6, 7, 5)) > p for p in [0.2, 0.5, 0.9]]
+    mask, masked = load_masked_data(in_file, cache_dir)
+    for chunk_size in [5, 10000]:
+        for masked_data, m in zip(select_masked_data_list(mask, masked, 
+                                                          masks, 
+                                                          chunk_size), 
+                                  masks):
+            assert masked_data.dtype == np.float32
+            assert_equal(masked_data, data[m])
+    
+    evict_data_cache(cache_dir)
+    assert not os.path.exists(cache_dir)
+    shutil.rmtree(tmpdir)
@@ -0,0 +1,47 @@
+"""
+This tests the functions in utils/node_resources.py
+"""
+
+import os
+import numpy as np
+import nibabel as nib
+from numpy.testing import *
+
+
+def test_functional_size_gb():
+    import tempfile
+    from CPAC.utils import functional_size_gb
+    
+    tmpdir = tempfile.mkdtemp()
+    small = os.path.join(tmpdir, 'small.nii.gz')
+    large = os.path.join(tmpdir, 'large.nii.gz')
+    nib.Nifti1Image(np.zeros((4, 5, 6, 10), dtype='int16'), 
+                    np.eye(4)).to_filename(small)
+    nib.Nifti1Image(np.zeros((4, 5, 6, 20), dtype='int16'), 
+                    np.diag([3.0, 3.0, 4.0, 1.0])).to_filename(large)
+    
+    # float32 size of the largest scan, whatever the stored data type, and
+    # the volume of its voxels
+    func_paths = {'rest_1': small, 
+                  'rest_2': {'scan': large},
+                  'rest_3': 's3://bucket/rest.nii.gz'}
+    size_gb, voxel_volume = functional_size_gb(func_paths)
+    assert_allclose(size_gb, 4*4*5*6*20/(1024.0**3))
+    assert_allclose(voxel_volume, 36.0)
+    assert_equal(functional_size_gb('s3://bucket/rest.nii.gz'), (None, None))
+
+
+def test_resampled_size_factor():
+    from CPAC.utils import resampled_size_factor
+    
+    # 3mm and 2mm voxels, to 2mm
+    assert_allclose(resampled_size_factor(27.0), 3.375)
+    assert_allclose(resampled_size_factor(8.0), 1.0)
+    assert_equal(resampled_size_factor(None), 1.0)
+
+
+def test_estimate_memory_gb():
+    from CPAC.utils import estimate_memory_gb
+    
+    assert_equal(estimate_memory_gb(None, 4, 2.0), 2.0)
+    assert_allclose(estimate_memory_gb(0.5, 4, 2.0), 2.25)
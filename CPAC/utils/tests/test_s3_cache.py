@@ -0,0 +1,90 @@
+"""
+This tests the functions in utils/s3_cache.py, against the S3 stand-in of
+moto
+"""
+
+import os
+import tempfile
+from numpy.testing import *
+
+from CPAC.utils.tests.s3_mock import mock_s3, create_bucket
+
+
+def test_cache_s3_object():
+    from CPAC.utils.s3_cache import cache_s3_object, link_cached_file, \
+                                    parse_s3_path
+
+    assert_equal(parse_s3_path('S3://fcp-indi/data/sub-01/anat.nii.gz'),
+                 ('fcp-indi', 'data/sub-01/anat.nii.gz'))
+    assert_equal(parse_s3_path('/data/sub-01/anat.nii.gz'), (None, None))
+
+    with mock_s3():
+        bucket = create_bucket('cpac-test', {'sub-01/anat.nii.gz': b'anat'})
+
+        cache_dir = os.path.join(tempfile.mkdtemp(), 's3_cache')
+        cached_path = cache_s3_object(bucket, 'sub-01/anat.nii.gz',
+                                      cache_dir)
+        assert_equal(os.path.basename(cached_path), 'anat.nii.gz')
+        assert_equal(open(cached_path, 'rb').read(), b'anat')
+
+        # cached, and linked into the working directory of a node
+        local_path = os.path.join(tempfile.mkdtemp(), 'anat.nii.gz')
+        link_cached_file(cached_path, local_path)
+        assert_equal(open(local_path, 'rb').read(), b'anat')
+        assert_equal(cache_s3_object(bucket, 'sub-01/anat.nii.gz',
+                                     cache_dir), cached_path)
+
+        # a modified object (new ETag) is downloaded again
+        bucket.put_object(Key='sub-01/anat.nii.gz', Body=b'new anat')
+        new_cached_path = cache_s3_object(bucket, 'sub-01/anat.nii.gz',
+                                          cache_dir)
+        assert_equal(new_cached_path != cached_path, True)
+        assert_equal(open(new_cached_path, 'rb').read(), b'new anat')
+        assert_equal(open(local_path, 'rb').read(), b'anat')
+
+
+def test_evict_s3_cache():
+    from CPAC.utils.s3_cache import cache_s3_object
+
+    with mock_s3():
+        objects = dict(('sub-%02d/func.nii.gz' % i, b'x' * 1000)
+                       for i in range(4))
+        bucket = create_bucket('cpac-test', objects)
+
+        # room for two of the objects
+        cache_dir = tempfile.mkdtemp()
+        max_size_gb = 2500.0 / 1024**3
+
+        cached_paths = []
+        for i in range(4):
+            cached_path = cache_s3_object(bucket, 'sub-%02d/func.nii.gz' % i,
+                                          cache_dir, max_size_gb)
+            cached_paths.append(cached_path)
+            # the least recently used is the first one
+            os.utime(cached_path, (i, i))
+
+        assert_equal([os.path.exists(p) for p in cached_paths],
+                     [False, False, True, True])
+
+
+def test_prefetch_s3_files():
+    from CPAC.utils.s3_cache import prefetch_s3_files
+
+    with mock_s3('indi_aws'):
+        create_bucket('cpac-test', {'sub-01/anat.nii.gz': b'anat',
+                                    'sub-01/rest_1.nii.gz': b'rest_1',
+                                    'sub-01/rest_2.nii.gz': b'rest_2'})
+
+        cache_dir = tempfile.mkdtemp()
+        cached_paths = prefetch_s3_files(
+            ['s3://cpac-test/sub-01/anat.nii.gz',
+             {'rest_1': 's3://cpac-test/sub-01/rest_1.nii.gz',
+              'rest_2': 's3://cpac-test/sub-01/rest_2.nii.gz',
+              'rest_3': 's3://cpac-test/sub-01/missing.nii.gz'},
+             '/data/sub-01/local.nii.gz'], cache_dir=cache_dir)
+
+        assert_equal(len(cached_paths), 4)
+        assert_equal(cached_paths['s3://cpac-test/sub-01/missing.nii.gz'],
+                     None)
+        assert_equal(open(cached_paths['s3://cpac-test/sub-01/rest_2.nii.gz'],
+                          'rb').read(), b'rest_2')
@@ -49,6 +49,7 @@ files_folders_wf = {
     'frame_wise_displacement':'parameters',
     'functional_nuisance_residuals':'func',
     'functional_nuisance_regressors':'func',
+    'functional_nuisance_basis':'func',
     'functional_median_angle_corrected':'func',
     'power_spectrum_distribution':'alff',
     'functional_freq_filtered':'func',
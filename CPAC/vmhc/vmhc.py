@@ -14,7 +14,8 @@ from CPAC.registration import create_wf_calculate_ants_warp, \
                               create_wf_collect_transforms, \
                               create_wf_apply_ants_warp
 
-def create_vmhc(use_ants, name='vmhc_workflow', ants_threads=1):
+def create_vmhc(use_ants, name='vmhc_workflow', ants_threads=1,
+                data_size_gb=None, voxel_volume=None):
 
     """
     Compute the map of brain functional homotopy, the high degree of synchrony in spontaneous activity between geometrically corresponding interhemispheric (i.e., homotopic) regions.
@@ -24,7 +25,13 @@ def create_vmhc(use_ants, name='vmhc_workflow', ants_threads=1):
     Parameters
     ----------
 
-    None
+    data_size_gb : float, optional
+        Size of the subject's float32 functional data, from which the memory
+        of the nodes is estimated (see `CPAC.utils.functional_size_gb`)
+
+    voxel_volume : float, optional
+        Volume (in mm^3) of the voxels of the functional data, from which
+        the size of the data in 2mm standard space is estimated
 
     Returns
     -------
@@ -230,7 +237,11 @@ def create_vmhc(use_ants, name='vmhc_workflow', ants_threads=1):
 
     """
 
+    from CPAC.utils import estimate_memory_gb, resampled_size_factor, \
+                           set_node_resources
+
     vmhc = pe.Workflow(name=name)
+    factor_2mm = resampled_size_factor(voxel_volume)
     inputNode = pe.Node(util.IdentityInterface(fields=['rest_res',
                                                 'example_func2highres_mat',
                                                 'rest_mask',
@@ -262,6 +273,10 @@ def create_vmhc(use_ants, name='vmhc_workflow', ants_threads=1):
         ## Apply nonlinear registration (func to standard)
         nonlinear_func_to_standard = pe.Node(interface=fsl.ApplyWarp(),
                           name='nonlinear_func_to_standard')
+        # Data and its warp in 2mm standard space
+        set_node_resources(nonlinear_func_to_standard,
+                           memory_gb=estimate_memory_gb(data_size_gb,
+                                                        1 + factor_2mm, 2.0))
 
     elif use_ants == True:
 
@@ -289,6 +304,10 @@ def create_vmhc(use_ants, name='vmhc_workflow', ants_threads=1):
     pearson_correlation.inputs.pearson = True
     pearson_correlation.inputs.polort = -1
     pearson_correlation.inputs.outputtype = 'NIFTI_GZ'
+    # Data in 2mm standard space and its L/R swapped copy
+    set_node_resources(pearson_correlation,
+                       memory_gb=estimate_memory_gb(data_size_gb,
+                                                    2*factor_2mm, 2.0))
 
     z_trans = pe.Node(interface=preprocess.Calc(),
                          name='z_trans')
@@ -0,0 +1,67 @@
+import argparse
+import time
+import numpy as np
+import nibabel as nb
+from CPAC.reho.utils import compute_reho_map
+
+
+def main():
+
+    """
+    Times the ReHo engine on an EPI image (or a random volume) and reports
+    the number of voxels processed per second
+
+    Parameters
+    ----------
+
+    None
+
+    Returns
+    -------
+
+    None
+
+    """
+
+    parser = argparse.ArgumentParser(description="example: \
+                        run reho_profiler.py -i rest.nii.gz -m mask.nii.gz")
+    parser.add_argument('-i', '--in_file', dest='in_file',
+                        help='4D EPI file, a random volume is used if omitted')
+    parser.add_argument('-m', '--mask_file', dest='mask_file',
+                        help='mask of the EPI file')
+    parser.add_argument('-s', '--shape', dest='shape', default='61,73,61,200',
+                        help='shape of the random volume (default 3mm MNI)')
+    parser.add_argument('-c', '--cluster_size', dest='cluster_size',
+                        type=int, default=27, help='7, 19 or 27')
+    parser.add_argument('--chunk_size', dest='chunk_size', type=int,
+                        default=10000, help='voxels per chunk')
+    args = parser.parse_args()
+
+    if args.in_file:
+        data = nb.load(args.in_file).get_data()
+        if args.mask_file:
+            mask = nb.load(args.mask_file).get_data()
+        else:
+            mask = (data != 0).any(-1)
+    else:
+        shape = [int(x) for x in args.shape.split(',')]
+        data = np.random.random(shape).astype('float32')
+        mask = np.ones(shape[:3])
+
+    nvoxs = int((mask != 0).sum())
+
+    start = time.time()
+    compute_reho_map(data, mask, args.cluster_size, args.chunk_size)
+    elapsed = time.time() - start
+
+    print '\n\nReHo Benchmark'
+    print     '---------------------------'
+    print 'Volume: ', data.shape
+    print 'Voxels in mask: ', nvoxs
+    print 'Time: %.2fs' % elapsed
+    print 'Voxels per second: %.0f' % (nvoxs / elapsed)
+    print     '---------------------------\n\n'
+
+if __name__ == "__main__":
+
+    main()
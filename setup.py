@@ -45,6 +45,9 @@ def configuration(parent_package='', top_path=None):
     config.add_extension('CPAC.network_centrality.thresh_and_sum', 
                          sources=['CPAC/network_centrality/thresh_and_sum.pyx'], 
                          include_dirs=[get_numpy_include_dirs()])
+    config.add_extension('CPAC.network_centrality.lfcd_bfs', 
+                         sources=['CPAC/network_centrality/lfcd_bfs.pyx'], 
+                         include_dirs=[get_numpy_include_dirs()])
 
     return config
 